@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
 import json
+import os
+import re
 import sys
-from bleak import BleakScanner, BleakClient
+import time
+from functools import partial
+
+from ble_adapters import AdapterScheduler, MultiAdapterScanner, parse_adapters
+from ble_registry import DeviceRegistry
+from e6_quantizer import CACHE_DIR
+from frame_cache import atomic_write
 
 # PH6 桌牌的 UUID
 PH6_SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
@@ -81,13 +90,19 @@ def is_likely_nameplate(name, address):
     
     return False
 
-async def verify_ph6_device(device):
-    """驗證設備是否為真正的 PH6 桌牌"""
+async def check_ph6_services(device, timeout=10.0, client_factory=None):
+    """連接設備並檢查 PH6 服務與特徵值
+
+    回傳 True（是 PH6）、False（連得上但沒有 PH6 服務）或 None（連線失敗/逾時，無法判斷）
+    """
+    if client_factory is None:
+        from bleak import BleakClient
+        client_factory = BleakClient
     try:
-        async with BleakClient(device.address, timeout=10.0) as client:
+        async with client_factory(device, timeout=timeout) as client:
             # 嘗試連接並檢查服務
             if not client.is_connected:
-                return False
+                return None
                 
             services = client.services
             
@@ -110,56 +125,319 @@ async def verify_ph6_device(device):
             return has_ph6_service and has_command_char and has_ack_char
             
     except Exception:
-        return False
+        return None
+
+async def verify_ph6_device(device):
+    """驗證設備是否為真正的 PH6 桌牌"""
+    return bool(await check_ph6_services(device, timeout=10.0))
+
+class VerificationCache:
+    """GATT 驗證結果，以地址為鍵存成 JSON 檔；每台設備只需連線驗證一次"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "verified_devices.json")
+        self._verdicts = None
+
+    @staticmethod
+    def _key(address):
+        return re.sub(r"[^0-9A-Za-z]", "", address).upper()
+
+    def _load_all(self):
+        if self._verdicts is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._verdicts = json.load(f)
+            except (OSError, ValueError):
+                self._verdicts = {}
+        return self._verdicts
+
+    def get(self, address):
+        entry = self._load_all().get(self._key(address))
+        return None if entry is None else entry["verified"]
 
-async def scan_for_nameplates():
-    """掃描桌牌設備"""
+    def reset(self):
+        """忽略已保存的結果（下次 put_many 時覆寫檔案）"""
+        self._verdicts = {}
+
+    def put_many(self, verdicts):
+        """verdicts: {地址: True/False}；無法判斷 (None) 的結果不寫入，下次再驗證"""
+        entries = self._load_all()
+        now = round(time.time())
+        for address, verified in verdicts.items():
+            if verified is not None:
+                entries[self._key(address)] = {"verified": verified, "checked_at": now}
+        try:
+            atomic_write(self.path, json.dumps(entries, indent=2).encode())
+        except OSError as e:
+            print(f"⚠️ 無法保存驗證結果: {e}", file=sys.stderr)
+
+async def verify_candidates(devices, ble_devices=None, max_concurrent=3, timeout=8.0, cache=None, client_factory=None):
+    """同時驗證多個候選設備，為每個設備加上 Verified 欄位 (True/False/None)
+
+    同時連線數以 max_concurrent 限制，每台設備最多 timeout 秒；cache 中已有結果的設備不再連線。
+    ble_devices 為 OriginalAddress -> BLEDevice，可省去 BleakClient 重新尋找設備的時間。
+    """
+    ble_devices = ble_devices or {}
+    slots = asyncio.Semaphore(max_concurrent)
+    fresh = {}
+
+    async def verify_one(info):
+        address = info["OriginalAddress"]
+        cached = cache.get(address) if cache is not None else None
+        if cached is not None:
+            info["Verified"] = cached
+            return
+        async with slots:
+            try:
+                verdict = await asyncio.wait_for(
+                    check_ph6_services(ble_devices.get(address, address), timeout, client_factory), timeout
+                )
+            except asyncio.TimeoutError:
+                verdict = None
+        info["Verified"] = verdict
+        fresh[address] = verdict
+
+    await asyncio.gather(*(verify_one(info) for info in devices))
+    if cache is not None and fresh:
+        cache.put_many(fresh)
+    return devices
+
+def build_device_info(device, advertisement_data):
+    """將一次廣播轉為桌牌設備資訊；不像桌牌的設備回傳 None"""
+    device_name = advertisement_data.local_name or device.name or "Unknown Device"
+    device_address = device.address
+    
+    # 檢查是否可能是桌牌設備
+    if not is_likely_nameplate(device_name, device_address):
+        return None
+
+    # 嘗試獲取真實的 MAC 地址
+    real_mac = extract_real_mac_from_advertisement(device, advertisement_data)
+    final_address = real_mac if real_mac else device_address
+    
+    return {
+        "Name": device_name,
+        "BluetoothAddress": final_address,  # 格式化的 MAC 地址，用於顯示
+        "OriginalAddress": device_address,  # 原始的 UUID 地址，用於 BLE 連接
+        "RealMacFound": real_mac is not None,
+        "SignalStrength": advertisement_data.rssi,  # 信號強度
+        "IsConnected": False,
+        "DeviceType": "Smart Nameplate"
+    }
+
+async def scan_for_nameplates(verify=False, verify_concurrency=3, verify_timeout=8.0, cache=None, scanner_factory=None):
+    """掃描桌牌設備
+
+    verify=True 時以 GATT 服務驗證名稱相符的候選設備（平行、有連線上限），
+    排除確認不是 PH6 的設備；驗證結果保存在 cache，之後的掃描不需再連線。
+    scanner_factory 可傳入 MultiAdapterScanner 等，預設使用 BleakScanner。
+    """
     try:
         discovered_devices = []
+        ble_devices = {}
         
         def detection_callback(device, advertisement_data):
-            device_name = advertisement_data.local_name or device.name or "Unknown Device"
-            device_address = device.address
-            
-            # 獲取信號強度
-            rssi = advertisement_data.rssi
+            device_info = build_device_info(device, advertisement_data)
             
-            # 檢查是否可能是桌牌設備
-            if is_likely_nameplate(device_name, device_address):
-                # 嘗試獲取真實的 MAC 地址
-                real_mac = extract_real_mac_from_advertisement(device, advertisement_data)
-                final_address = real_mac if real_mac else device_address
-                
-                device_info = {
-                    "Name": device_name,
-                    "BluetoothAddress": final_address,  # 格式化的 MAC 地址，用於顯示
-                    "OriginalAddress": device_address,  # 原始的 UUID 地址，用於 BLE 連接
-                    "RealMacFound": real_mac is not None,
-                    "SignalStrength": rssi,
-                    "IsConnected": False,
-                    "DeviceType": "Smart Nameplate"
-                }
-                
-                # 避免重複添加
-                if not any(d["OriginalAddress"] == device_address for d in discovered_devices):
-                    discovered_devices.append(device_info)
+            # 避免重複添加
+            if device_info and not any(d["OriginalAddress"] == device.address for d in discovered_devices):
+                discovered_devices.append(device_info)
+                ble_devices[device.address] = device
         
         # 使用回調函數進行掃描
-        scanner = BleakScanner(detection_callback)
+        if scanner_factory is None:
+            from bleak import BleakScanner
+            scanner_factory = BleakScanner
+        scanner = scanner_factory(detection_callback)
         await scanner.start()
         await asyncio.sleep(10.0)  # 掃描 10 秒
         await scanner.stop()
         
-        # 暫時跳過 PH6 驗證，直接返回發現的設備
-        return discovered_devices
+        if not verify:
+            # 未要求驗證時直接返回發現的設備
+            return discovered_devices
+
+        await verify_candidates(
+            discovered_devices, ble_devices, verify_concurrency, verify_timeout,
+            cache if cache is not None else VerificationCache(),
+        )
+        return [d for d in discovered_devices if d["Verified"] is not False]
         
     except Exception as e:
         return []
 
+async def watch_nameplates(registry, on_event, stop_event, expire_interval=1.0, scanner_factory=None):
+    """持續掃描直到 stop_event 被設定，廣播與逾時都更新 registry 並以 on_event 回報事件"""
+    def detection_callback(device, advertisement_data):
+        device_info = build_device_info(device, advertisement_data)
+        if device_info:
+            event = registry.observe(device_info)
+            if event:
+                on_event(event)
+
+    if scanner_factory is None:
+        from bleak import BleakScanner
+        scanner_factory = BleakScanner
+    scanner = scanner_factory(detection_callback)
+    await scanner.start()
+    try:
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), expire_interval)
+            except asyncio.TimeoutError:
+                pass
+            for event in registry.expire():
+                on_event(event)
+    finally:
+        await scanner.stop()
+
+async def save_sightings_periodically(scheduler, stop_event, interval=10.0):
+    """持續掃描時定期保存各介面卡的 RSSI 紀錄，投圖程序據此分配介面卡"""
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+        scheduler.save()
+
+async def watch_main(args, scanner_factory=None, scheduler=None):
+    """持續掃描模式：stdout 輸出 JSON-lines 事件，stdin 接受 {"op": "snapshot"} / {"op": "stop"}"""
+    registry = DeviceRegistry(expire_after=args.expire_after)
+    stop_event = asyncio.Event()
+
+    def emit(event):
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+
+    async def read_commands():
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        while not stop_event.is_set():
+            line = await reader.readline()
+            if not line:
+                # stdin 關閉時繼續掃描，直到程序被終止
+                return
+            try:
+                op = json.loads(line).get("op")
+            except (ValueError, AttributeError):
+                op = line.decode(errors="replace").strip()
+            if op == "snapshot":
+                emit({"event": "snapshot", "time": round(time.time(), 3), "devices": registry.snapshot()})
+            elif op == "stop":
+                stop_event.set()
+
+    commands = asyncio.create_task(read_commands())
+    saver = asyncio.create_task(save_sightings_periodically(scheduler, stop_event)) if scheduler else None
+    try:
+        await watch_nameplates(registry, emit, stop_event, scanner_factory=scanner_factory)
+    finally:
+        commands.cancel()
+        if saver is not None:
+            saver.cancel()
+            scheduler.save()
+
+def normalize_address(address):
+    """比對用的地址格式：大寫並移除 : 與 -（MAC 與 macOS UUID 地址皆適用）"""
+    return address.upper().replace(":", "").replace("-", "")
+
+async def ping_nameplates(targets, timeout=10.0, scanner_factory=None):
+    """尋找指定設備，全部找到或逾時即停止掃描
+
+    目標可以是廣播地址 (OriginalAddress) 或廣播數據中的真實 MAC，
+    回傳每個目標的 found / RSSI / 從開始掃描到看到的秒數。
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    results = {normalize_address(t): {"Target": t, "Found": False} for t in targets}
+    remaining = set(results)
+    all_found = asyncio.Event()
+
+    def detection_callback(device, advertisement_data):
+        if not remaining:
+            return
+        candidates = {normalize_address(device.address)}
+        real_mac = extract_real_mac_from_advertisement(device, advertisement_data)
+        if real_mac:
+            candidates.add(normalize_address(real_mac))
+        for key in candidates & remaining:
+            remaining.discard(key)
+            results[key].update({
+                "Found": True,
+                "Name": advertisement_data.local_name or device.name or "Unknown Device",
+                "OriginalAddress": device.address,
+                "BluetoothAddress": real_mac or device.address,
+                "SignalStrength": advertisement_data.rssi,
+                "LatencySeconds": round(loop.time() - started, 3),
+            })
+        if not remaining:
+            all_found.set()
+
+    if scanner_factory is None:
+        from bleak import BleakScanner
+        scanner_factory = BleakScanner
+    scanner = scanner_factory(detection_callback)
+    await scanner.start()
+    try:
+        await asyncio.wait_for(all_found.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await scanner.stop()
+    return list(results.values())
+
+async def ping_main(args, scanner_factory=None):
+    """輸出每個目標的 JSON 結果；全部找到才回傳 0"""
+    try:
+        results = await ping_nameplates(args.ping, args.timeout, scanner_factory)
+    except Exception as e:
+        print(f"❌ 掃描失敗: {e}", file=sys.stderr)
+        results = [{"Target": t, "Found": False} for t in args.ping]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0 if all(r["Found"] for r in results) else 1
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(usage="python3 backend_ble_scanner.py [--verify] [--watch [--expire-after 秒] | --ping 地址 [地址 ...] [--timeout 秒]]")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--watch", action="store_true", help="持續掃描並輸出 JSON-lines 事件")
+    mode.add_argument("--ping", nargs="+", metavar="地址", help="尋找指定設備（廣播地址或真實 MAC），看到即停止")
+    parser.add_argument("--expire-after", type=float, default=30.0, help="持續掃描時幾秒未見即視為離開 (預設 30)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="--ping 最長掃描秒數 (預設 10)")
+    parser.add_argument("--verify", action="store_true", help="以 GATT 服務驗證掃描到的設備，排除不是 PH6 的設備")
+    parser.add_argument("--verify-concurrency", type=int, default=3, help="驗證時同時連線數上限 (預設 3)")
+    parser.add_argument("--verify-timeout", type=float, default=8.0, help="每台設備驗證逾時秒數 (預設 8)")
+    parser.add_argument("--reverify", action="store_true", help="忽略已保存的驗證結果，重新連線驗證")
+    parser.add_argument("--adapters", default=None, help="以逗號分隔的藍牙介面卡，例如 hci0,hci1，同時掃描並記錄各介面卡的 RSSI (預設 PH6_BLE_ADAPTERS)")
+    return parser.parse_args(argv)
+
+def multi_adapter_scanner(adapters):
+    """指定介面卡時回傳 (scanner_factory, scheduler)，否則回傳 (None, None) 使用預設介面卡"""
+    if not adapters:
+        return None, None
+    scheduler = AdapterScheduler(adapters)
+    return partial(MultiAdapterScanner, adapters=adapters, scheduler=scheduler), scheduler
+
 async def main():
     """主函數"""
+    args = parse_args(sys.argv[1:])
+    scanner_factory, scheduler = multi_adapter_scanner(parse_adapters(args.adapters))
+    if args.watch:
+        await watch_main(args, scanner_factory, scheduler)
+        return
+    if args.ping:
+        code = await ping_main(args, scanner_factory)
+        if scheduler is not None:
+            scheduler.save()
+        sys.exit(code)
+
     try:
-        devices = await scan_for_nameplates()
+        cache = None
+        if args.verify:
+            cache = VerificationCache()
+            if args.reverify:
+                cache.reset()
+        devices = await scan_for_nameplates(args.verify, args.verify_concurrency, args.verify_timeout, cache, scanner_factory)
+        if scheduler is not None:
+            scheduler.save()
         # 輸出 JSON 格式的結果供 .NET 解析
         print(json.dumps(devices, ensure_ascii=False, indent=2))
     except Exception as e:
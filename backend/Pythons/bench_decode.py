@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""大尺寸來源圖片的解碼時間與記憶體基準
+
+以 12MP（4000x3000）的合成照片 JPEG 與 PNG 比較兩種轉換流程:
+    full      原本的流程：完整解碼 -> 轉 RGB -> LANCZOS 縮放 -> 量化
+    bounded   convert_image_to_e6：像素/記憶體上限檢查、JPEG 解碼時縮小 (draft)、
+              （僅解碼時已縮小者）reducing_gap 縮放 -> 量化
+每個組合在獨立子程序中執行，回報轉換耗時中位數與峰值常駐記憶體 (ru_maxrss)；
+另回報峰值相對轉換前的增量，排除直譯器、numpy 與查找表本身的記憶體。
+JPEG 的 bounded 峰值增量超過 --rss-budget，或任一格式的 bounded 比 full 更慢、
+峰值更高，即以非零結束碼回報（PNG 無法在解碼時縮小，峰值以完整解碼為下限）。
+
+使用方法: python3 bench_decode.py [--repeat 3] [--rss-budget 48] [--json 結果.json]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE_SIZE = (4000, 3000)
+FORMATS = ("jpeg", "png")
+MODES = ("full", "bounded")
+SEED = 20240601
+
+
+def make_sources(directory):
+    """產生固定內容的 12MP 類照片圖片：低解析度模糊雜訊放大，有大面積色塊與漸變"""
+    import random
+
+    from PIL import Image, ImageFilter
+
+    rng = random.Random(SEED)
+    small = Image.frombytes("RGB", (400, 300), rng.randbytes(400 * 300 * 3)).filter(ImageFilter.GaussianBlur(2))
+    photo = small.resize(SOURCE_SIZE, Image.Resampling.BICUBIC)
+    paths = {}
+    for fmt in FORMATS:
+        paths[fmt] = os.path.join(directory, f"photo_{SOURCE_SIZE[0]}x{SOURCE_SIZE[1]}.{'jpg' if fmt == 'jpeg' else fmt}")
+        photo.save(paths[fmt], quality=90) if fmt == "jpeg" else photo.save(paths[fmt])
+    return paths
+
+
+def current_rss_kib():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def run_child(mode, path, repeat):
+    """子程序：暖身載入查找表後量測 repeat 次轉換"""
+    import logging
+
+    import cast_image_to_ph6_fixed as cast
+    import e6_quantizer
+
+    logging.disable(logging.WARNING)
+
+    def full():
+        from PIL import Image
+
+        image = Image.open(path)
+        image.load()
+        rgb_image = image.convert("RGB").resize((800, 480), Image.Resampling.LANCZOS)
+        return e6_quantizer.quantize_image_to_e6(rgb_image)
+
+    convert = full if mode == "full" else lambda: cast.convert_image_to_e6(path)
+    e6_quantizer.numpy_available()
+    # 查找表每個程序只載入一次，先以小圖暖身（觸及與轉換結果相近的查找表分頁）
+    cast.convert_image_to_e6(make_warmup(path))
+    rss_before = current_rss_kib()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        frame = convert()
+        timings.append(time.perf_counter() - started)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "median_s": round(statistics.median(timings), 4),
+        "peak_rss_kib": peak,
+        "peak_delta_kib": max(0, peak - rss_before),
+        "frame_bytes": len(frame),
+    }))
+
+
+def make_warmup(path):
+    """兩種流程共用的暖身圖：同一張圖片先縮小到 800x480，避免暖身時就產生完整解碼的峰值"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.draft("RGB", (800, 480))
+        warmup = image.convert("RGB").resize((800, 480))
+    warmup_path = path + ".warmup.png"
+    warmup.save(warmup_path)
+    return warmup_path
+
+
+def measure(mode, path, repeat):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, path, "--repeat", str(repeat)],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 bench_decode.py [選項]")
+    parser.add_argument("--repeat", type=int, default=3, help="每個組合轉換次數，取中位數 (預設 3)")
+    parser.add_argument("--rss-budget", type=float, default=48, help="JPEG bounded 流程峰值記憶體增量上限 MiB (預設 48)")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.repeat)
+        return
+
+    results = {}
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = make_sources(tmp)
+        for fmt, path in sources.items():
+            for mode in MODES:
+                r = measure(mode, path, args.repeat)
+                name = f"{fmt}/{mode}"
+                results[name] = r
+                over = mode == "bounded" and (
+                    (fmt == "jpeg" and r["peak_delta_kib"] > args.rss_budget * 1024)
+                    or r["median_s"] > results[f"{fmt}/full"]["median_s"]
+                    or r["peak_delta_kib"] > results[f"{fmt}/full"]["peak_delta_kib"]
+                )
+                failed |= over
+                print(f"{'❌' if over else '✅'} {name:>13}: {r['median_s'] * 1000:8.1f}ms  峰值 RSS {r['peak_rss_kib'] / 1024:6.1f} MiB"
+                      f"（轉換增量 {r['peak_delta_kib'] / 1024:6.1f} MiB）")
+            full, bounded = results[f"{fmt}/full"], results[f"{fmt}/bounded"]
+            print(f"   {fmt}: 耗時 {full['median_s'] / bounded['median_s']:.1f} 倍快，"
+                  f"峰值增量 {full['peak_delta_kib'] / 1024:.1f} -> {bounded['peak_delta_kib'] / 1024:.1f} MiB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"source_size": SOURCE_SIZE, "results": results}, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""差異（dirty-block）上傳模擬量測
+
+以模擬設備比較整面上傳與只傳送變更區塊的封包數與耗時。
+使用方法: python3 bench_dirty_upload.py
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from frame_cache import BLOCK_SIZE, DeviceFrameStore
+from ph6_simulator import FakeBleakClient
+import cast_image_to_ph6_fixed as cast
+
+
+async def send(frame, blocks):
+    client = FakeBleakClient()
+    async with client:
+        ble = cast.BleClientFixed()
+        ble.ble_connect = True
+        started = time.perf_counter()
+        ok = await ble.send_image_to_ph6(
+            client, frame, 2,
+            block_delay=0, prep_delay=0, packet_delay=0, sync_delay=0, refresh_wait=0,
+            blocks=blocks,
+        )
+        elapsed = time.perf_counter() - started
+    return ok, client.data_packet_count, elapsed
+
+
+async def main():
+    previous = bytes(os.urandom(192000))
+    # 模擬只改了名字那一行：變更落在第 3 區塊內
+    edited = bytearray(previous)
+    edited[2 * BLOCK_SIZE + 100:2 * BLOCK_SIZE + 4100] = bytes(4000)
+    edited = bytes(edited)
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = DeviceFrameStore(store_dir)
+        store.save("SIMULATED", 2, previous)
+        blocks = store.plan_blocks("SIMULATED", 2, edited)
+
+    full_ok, full_packets, full_time = await send(edited, None)
+    diff_ok, diff_packets, diff_time = await send(edited, blocks)
+
+    print(json.dumps({
+        "changed_blocks": blocks,
+        "full": {"success": full_ok, "data_packets": full_packets, "seconds": round(full_time, 3)},
+        "incremental": {"success": diff_ok, "data_packets": diff_packets, "seconds": round(diff_time, 3)},
+        "packet_reduction": f"{(1 - diff_packets / full_packets) * 100:.1f}%",
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    cast.logger.setLevel("WARNING")
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""固定節奏與自適應節奏的模擬比較
+
+在具有接收緩衝區與丟包行為的模擬設備上連續投圖數次，比較廠商固定延遲與
+AdaptivePacer（每次投圖後保存並沿用學到的參數）的耗時與丟包數。
+節奏只依正式投圖也看得到的訊號調整（寫入延遲、區塊 ACK 旗標、傳輸結果）；
+模擬設備的丟包數只用於報表。
+
+使用方法: python3 bench_pacing.py [--casts 3] [--buffer-size 64] [--drain-rate 600] [--drop-rate 0]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cast_image_to_ph6_fixed as cast
+from ph6_pacing import AdaptivePacer, FixedPacing, PacingStore
+from ph6_simulator import FakeBleakClient
+
+ADDRESS = "SIMULATED"
+
+
+async def cast_once(frame, pacing, args):
+    client = FakeBleakClient(
+        ADDRESS,
+        buffer_size=args.buffer_size,
+        drain_rate=args.drain_rate,
+        drop_rate=args.drop_rate,
+    )
+    async with client:
+        ble = cast.BleClientFixed()
+        ble.ble_connect = True
+        started = time.perf_counter()
+        ok = await ble.send_image_to_ph6(client, frame, 2, refresh_wait=0, pacing=pacing)
+        elapsed = time.perf_counter() - started
+    return {
+        "success": ok,
+        "intact": ok and client.dropped_packets == 0,
+        "seconds": round(elapsed, 3),
+        "dropped_packets": client.dropped_packets,
+        "pacing": {k: round(v, 5) if isinstance(v, float) else v for k, v in pacing.as_dict().items()},
+    }
+
+
+async def run(args):
+    frame = os.urandom(192000)
+    results = {"fixed": [], "adaptive": []}
+
+    for _ in range(args.casts):
+        results["fixed"].append(await cast_once(frame, FixedPacing(), args))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PacingStore(os.path.join(tmp, "pacing.json"))
+        for _ in range(args.casts):
+            profile = store.load(ADDRESS)
+            pacer = AdaptivePacer.from_profile(profile) if profile else AdaptivePacer()
+            result = await cast_once(frame, pacer, args)
+            # 與 cast_frame_to_device 相同：只有投圖失敗才額外退避
+            if not result["success"]:
+                pacer.on_failure()
+            store.save(ADDRESS, pacer)
+            results["adaptive"].append(result)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 bench_pacing.py [選項]")
+    parser.add_argument("--casts", type=int, default=3, help="每種節奏連續投圖次數 (預設 3)")
+    parser.add_argument("--buffer-size", type=int, default=64, help="模擬設備緩衝區包數 (預設 64)")
+    parser.add_argument("--drain-rate", type=float, default=600, help="模擬設備每秒處理包數 (預設 600)")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="隨機丟包機率 (預設 0)")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    cast.logger.setLevel("WARNING")
+    # send_image_to_ph6 的 PROGRESS 行改寫到 stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run(args))
+
+    for mode, runs in results.items():
+        print(f"{mode:>8}: " + ", ".join(
+            f"{r['seconds']:.2f}s/{r['dropped_packets']} 丟包" for r in runs
+        ))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
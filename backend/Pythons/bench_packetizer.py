@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""封包產生與 CRC 計算的微基準
+
+比較每面畫面 (822 包) 的封包產生與 CRC8 計算時間:
+    vendor  - 原本傳輸迴圈的做法：畫面轉 list、逐包切片複製、逐位元組 safe_byte + 查表
+    python  - Ph6Packetizer.packetize 純 Python 路徑（單一緩衝區 + memoryview）
+    numpy   - Ph6Packetizer.packetize numpy 路徑（所有封包的 CRC 同時計算）
+
+使用方法: python3 bench_packetizer.py [--repeat 5] [--mtu 247] [--json 結果.json]
+"""
+import argparse
+import json
+import os
+import time
+
+import ph6_packetizer
+from ph6_packetizer import BLOCK_COUNT, BLOCK_SIZE, CRC8_TABLE, HEADER_SIZE, Ph6Packetizer, crc8, crc8_rows
+
+
+def vendor_crc(data):
+    crc = 0
+    for b in data:
+        crc = CRC8_TABLE[crc ^ (b & 0xFF)]
+    return crc
+
+
+def vendor_packetize(packetizer, frame):
+    """原本 send_image_to_ph6 內的封包組裝方式（不含 BLE 寫入）"""
+    buf = list(frame)
+    chunk = packetizer.chunk_size
+    pkg = bytearray(packetizer.packet_size)
+    pkg[0], pkg[1], pkg[3], pkg[4] = 0xFE, 0xEF, 0x57, 0x02
+    index = 0
+    current = 0
+    packets = []
+    for _ in range(BLOCK_COUNT):
+        for n in range(packetizer.packets_per_block):
+            is_last = n == packetizer.packets_per_block - 1
+            size = (packetizer.last_chunk_size if is_last else chunk) + HEADER_SIZE + 1
+            pkg[2], pkg[5], pkg[6], pkg[7] = size, current & 0xFF, (current >> 8) & 0xFF, 0x01 if is_last else 0x00
+            pkg[HEADER_SIZE:size - 1] = buf[index:index + size - HEADER_SIZE - 1]
+            pkg[size - 1] = vendor_crc(pkg[:size - 1])
+            packets.append(pkg[:size])
+            index += size - HEADER_SIZE - 1
+            current += 1
+    return packets
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(repeat, mtu):
+    frame = os.urandom(BLOCK_SIZE * BLOCK_COUNT)
+    packetizer = Ph6Packetizer(mtu)
+    packets = [bytes(p) for block in packetizer.packetize(frame).values() for p in block]
+    bodies = [p[:-1] for p in packets]
+
+    results = {
+        "packetize": {
+            "vendor": best_of(repeat, lambda: vendor_packetize(packetizer, frame)),
+            "python": best_of(repeat, lambda: packetizer.packetize(frame, use_numpy=False)),
+        },
+        "crc": {
+            "vendor": best_of(repeat, lambda: [vendor_crc(b) for b in bodies]),
+            "python": best_of(repeat, lambda: [crc8(b) for b in bodies]),
+        },
+    }
+    np = ph6_packetizer.load_numpy()
+    if np is not None:
+        # 一般封包與區塊最後一包長度不同，各自組成一個矩陣
+        groups = [
+            np.frombuffer(b"".join(g), dtype=np.uint8).reshape(len(g), -1)
+            for g in (bodies[n::packetizer.packets_per_block] for n in range(packetizer.packets_per_block))
+        ]
+        regular = np.concatenate(groups[:-1])
+        last = groups[-1]
+        results["packetize"]["numpy"] = best_of(repeat, lambda: packetizer.packetize(frame, use_numpy=True))
+        results["crc"]["numpy"] = best_of(repeat, lambda: (crc8_rows(regular), crc8_rows(last)))
+    return {
+        "mtu": mtu,
+        "packets": len(packets),
+        "ms_per_frame": {k: {m: round(t * 1000, 2) for m, t in v.items()} for k, v in results.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 bench_packetizer.py [選項]")
+    parser.add_argument("--repeat", type=int, default=5, help="每項重複次數，取最快一次 (預設 5)")
+    parser.add_argument("--mtu", type=int, default=ph6_packetizer.DEF_MTU, help="MTU (預設 247)")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    result = run(args.repeat, args.mtu)
+    print(f"📊 MTU {result['mtu']}, 每面 {result['packets']} 包")
+    for stage, timings in result["ms_per_frame"].items():
+        baseline = timings["vendor"]
+        print(f"{stage:>10}: " + ", ".join(
+            f"{mode} {ms:.2f}ms ({baseline / ms:.1f}x)" for mode, ms in timings.items()
+        ))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""管線化投圖（轉換與連線重疊）的模擬量測
+
+在模擬設備（可設定連線延遲）上分別以循序與管線化方式投同一張圖，
+比較各階段耗時與總時間。畫面快取會被關閉，每次都完整轉換圖片。
+
+使用方法: python3 bench_pipeline.py [圖片路徑] [--connect-latency 1.0] [--repeat 3]
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import sys
+import tempfile
+
+os.environ["PH6_FRAME_CACHE"] = "0"
+
+import cast_image_to_ph6_fixed as cast
+from ph6_simulator import FakeBleakClient
+
+
+def make_test_image(directory):
+    """產生需要縮放的隨機照片尺寸圖片"""
+    from PIL import Image
+
+    path = os.path.join(directory, "bench_pipeline.png")
+    Image.frombytes("RGB", (1600, 960), os.urandom(1600 * 960 * 3)).save(path)
+    return path
+
+
+async def cast_once(image_path, pipeline, args):
+    timings = {}
+    factory = functools.partial(FakeBleakClient, connect_latency=args.connect_latency)
+    ok = await cast.cast_image_fixed(
+        image_path, 2, "SIMULATED", simulate=False,
+        block_delay=0, prep_delay=0, packet_delay=0,
+        flow_control="ack", pipeline=pipeline, client_factory=factory, timings=timings,
+    )
+    return ok, {k: round(v, 3) for k, v in timings.items()}
+
+
+async def run(image_path, args):
+    results = {"sequential": [], "pipelined": []}
+    for _ in range(args.repeat):
+        for mode, pipeline in (("sequential", False), ("pipelined", True)):
+            ok, timings = await cast_once(image_path, pipeline, args)
+            if not ok:
+                raise RuntimeError(f"{mode} 投圖失敗")
+            results[mode].append(timings)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 bench_pipeline.py [圖片路徑] [選項]")
+    parser.add_argument("image_path", nargs="?", help="圖片路徑（省略時產生 1600x960 隨機圖片）")
+    parser.add_argument("--connect-latency", type=float, default=1.0, help="模擬連線與服務探索秒數 (預設 1.0)")
+    parser.add_argument("--repeat", type=int, default=3, help="每種模式重複次數 (預設 3)")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    cast.logger.setLevel("WARNING")
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = args.image_path or make_test_image(tmp)
+        # PROGRESS / TIMING 行改寫到 stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            results = asyncio.run(run(image_path, args))
+
+    for mode, runs in results.items():
+        best = min(runs, key=lambda t: t["total"])
+        phases = ", ".join(f"{k}={v:.3f}s" for k, v in best.items())
+        print(f"{mode:>10}: {phases}")
+    saved = min(r["total"] for r in results["sequential"]) - min(r["total"] for r in results["pipelined"])
+    print(f"⏱️ 管線化節省: {saved:.3f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
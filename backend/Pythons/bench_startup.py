@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""命令列冷啟動時間預算檢查
+
+後端每次投圖、掃描、ping 都會啟動新的 python3 程序。本腳本以子程序量測各進入點
+在參數解析 / 參數錯誤路徑上的牆鐘時間（不接觸 BLE），並以 -X importtime 列出
+進入點模組最重的直接匯入，同時檢查 PIL、numpy、bleak 沒有在匯入時被載入。
+超過預算或重量級模組在匯入時被載入即以非零結束碼回報。
+
+使用方法: python3 bench_startup.py [--repeat 7] [--scale 1.0] [--json 結果.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 名稱: (命令列參數, 進入點模組, 牆鐘時間預算毫秒)
+INVOCATIONS = {
+    "scan": (["backend_ble_scanner.py", "--help"], "backend_ble_scanner", 250),
+    "ping": (["backend_ble_scanner.py", "--ping"], "backend_ble_scanner", 250),  # 缺少地址的參數錯誤路徑
+    "cast": (["cast_image_to_ph6_fixed.py", "--help"], "cast_image_to_ph6_fixed", 300),
+}
+# 只應在實際需要的路徑上載入的模組
+HEAVY_MODULES = ("PIL", "numpy", "bleak")
+
+
+def wall_time(argv, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + argv, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def import_profile(module, top=5):
+    """回傳 (模組累計匯入毫秒, 最重的直接匯入, 匯入後已載入的重量級模組)"""
+    code = f"import sys, json, {module}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    total = 0
+    direct = []
+    children = []  # 子匯入列在父模組之前，遇到頂層模組時歸屬並重設
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            microseconds = int(cumulative)
+        except ValueError:  # 標題行
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == module:
+                total, direct = microseconds, children
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), microseconds))
+    direct.sort(key=lambda item: item[1], reverse=True)
+    heaviest = [{"module": name, "ms": round(us / 1000, 1)} for name, us in direct[:top]]
+    return round(total / 1000, 1), heaviest, json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 bench_startup.py [選項]")
+    parser.add_argument("--repeat", type=int, default=7, help="每個進入點啟動次數，取中位數 (預設 7)")
+    parser.add_argument("--scale", type=float, default=1.0, help="預算倍率，較慢的機器可放寬 (預設 1.0)")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    floor = wall_time(["-c", "pass"], args.repeat)
+    print(f"🐍 直譯器空啟動: {floor * 1000:.0f}ms")
+
+    results = {}
+    failed = False
+    for name, (argv, module, budget_ms) in INVOCATIONS.items():
+        wall = wall_time(argv, args.repeat)
+        import_ms, heaviest, heavy_loaded = import_profile(module)
+        budget = budget_ms * args.scale
+        ok = wall * 1000 <= budget and not heavy_loaded
+        failed |= not ok
+        results[name] = {
+            "wall_ms": round(wall * 1000, 1),
+            "budget_ms": budget,
+            "import_ms": import_ms,
+            "heaviest_imports": heaviest,
+            "heavy_modules_loaded": heavy_loaded,
+            "ok": ok,
+        }
+        print(f"{'✅' if ok else '❌'} {name:>5}: {wall * 1000:6.0f}ms / 預算 {budget:.0f}ms，匯入 {module} {import_ms}ms"
+              + (f"，匯入時已載入 {', '.join(heavy_loaded)}" if heavy_loaded else ""))
+        print("         " + ", ".join(f"{item['module']} {item['ms']}ms" for item in heaviest))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"interpreter_ms": round(floor * 1000, 1), "results": results}, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""投圖熱路徑的可重現基準測試組
+
+以固定的合成圖片（純色、漸層、類照片雜訊；800x480 原尺寸與需要 LANCZOS 縮放的
+大尺寸來源）量測:
+    convert   load_e6_frame 不經快取（解碼 + 縮放 + 量化；E6 調色盤 PNG 與 .epd 畫面走快速路徑）
+    crc       calculate_crc（每面 822 包）
+    send      send_image_to_ph6 對模擬設備產生並寫出所有封包（ACK 模式，不含固定延遲）
+    cast      完整 cast_image_fixed（模擬設備，畫面快取關閉）
+每項回報中位數耗時、ops/s 與 tracemalloc 峰值記憶體，結果與 JSON 基準比較，
+變慢或記憶體增加超過容許比例即以非零結束碼回報。
+
+使用方法: python3 bench_suite.py [--save] [--baseline PATH] [--tolerance 0.25] [--repeat 5] [--only convert,crc]
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ["PH6_FRAME_CACHE"] = "0"
+
+import cast_image_to_ph6_fixed as cast
+import e6_quantizer
+from ph6_packetizer import Ph6Packetizer
+from ph6_simulator import FakeBleakClient
+
+PATTERNS = ("solid", "gradient", "photo")
+SIZES = ((800, 480), (2400, 1440))
+SEED = 20240601
+
+
+def default_baseline_path():
+    return os.path.join(e6_quantizer.CACHE_DIR, "bench_baseline.json")
+
+
+def make_image(pattern, size):
+    """產生固定內容的合成圖片（同一 pattern/size 每次位元組相同）"""
+    from PIL import Image, ImageFilter
+
+    width, height = size
+    if pattern == "solid":
+        return Image.new("RGB", size, (40, 120, 200))
+    if pattern == "gradient":
+        horizontal = Image.linear_gradient("L").rotate(90).resize(size)
+        vertical = Image.linear_gradient("L").resize(size)
+        return Image.merge("RGB", (horizontal, vertical, Image.new("L", size, 128)))
+    rng = random.Random(f"{SEED}-{width}x{height}")
+    noise = Image.frombytes("RGB", size, rng.randbytes(width * height * 3))
+    # 模糊後的雜訊有大面積色塊與漸變，接近照片的色彩分布
+    return noise.filter(ImageFilter.GaussianBlur(max(1, width // 400)))
+
+
+def make_corpus(directory):
+    corpus = {}
+    for pattern in PATTERNS:
+        for size in SIZES:
+            path = os.path.join(directory, f"{pattern}_{size[0]}x{size[1]}.png")
+            make_image(pattern, size).save(path)
+            corpus[(pattern, size)] = path
+
+    # 渲染端已輸出 E6 六色的調色盤 PNG，以及預先打包的 .epd 畫面
+    from PIL import Image
+
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette([c for color in e6_quantizer.E6_COLORS for c in color])
+    photo = make_image("photo", SIZES[0]).quantize(palette=palette_image, dither=Image.Dither.NONE)
+    corpus[("palette", SIZES[0])] = os.path.join(directory, "palette_800x480.png")
+    photo.save(corpus[("palette", SIZES[0])])
+    corpus[("raw", SIZES[0])] = os.path.join(directory, "raw_800x480.epd")
+    with open(corpus[("raw", SIZES[0])], "wb") as f:
+        f.write(cast.convert_image_to_e6(corpus[("palette", SIZES[0])]))
+    return corpus
+
+
+def measure(fn, repeat):
+    """先暖身一次，之後取 repeat 次的中位數；另以 tracemalloc 量測單次峰值記憶體"""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        "median_s": round(median, 6),
+        "best_s": round(min(timings), 6),
+        "ops_per_s": round(1 / median, 2) if median > 0 else None,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+async def send_frame(frame):
+    client = FakeBleakClient()
+    async with client:
+        ble = cast.BleClientFixed(flow_control="ack")
+        ble.ble_connect = True
+        ok = await ble.send_image_to_ph6(client, frame, 1, 0, 0, 0, 5, sync_delay=0, refresh_wait=1.0)
+    if not ok or client.data_packet_count != Ph6Packetizer(client.mtu_size).total_packets:
+        raise RuntimeError("模擬傳輸失敗")
+
+
+async def cast_file(image_path):
+    ok = await cast.cast_image_fixed(
+        image_path, 1, "BENCH", simulate=False,
+        block_delay=0, prep_delay=0, packet_delay=0,
+        flow_control="ack", client_factory=FakeBleakClient,
+    )
+    if not ok:
+        raise RuntimeError("模擬投圖失敗")
+
+
+def run_suite(corpus, repeat, only=None):
+    def wanted(group):
+        return only is None or group in only
+
+    results = {}
+    if wanted("convert"):
+        for (pattern, size), path in corpus.items():
+            results[f"convert/{pattern}/{size[0]}x{size[1]}"] = measure(functools.partial(cast.load_e6_frame, path), repeat)
+
+    frame = bytes(cast.convert_image_to_e6(corpus[("photo", SIZES[0])]))
+    if wanted("crc"):
+        ble = cast.BleClientFixed()
+        bodies = [bytes(p[:-1]) for block in Ph6Packetizer(cast.DEF_MTU).packetize(frame).values() for p in block]
+        results["crc/frame"] = measure(lambda: [ble.calculate_crc(body) for body in bodies], repeat)
+    if wanted("send"):
+        results["send/frame"] = measure(lambda: asyncio.run(send_frame(frame)), repeat)
+    if wanted("cast"):
+        for pattern in PATTERNS:
+            path = corpus[(pattern, SIZES[-1])]
+            results[f"cast/{pattern}/{SIZES[-1][0]}x{SIZES[-1][1]}"] = measure(lambda: asyncio.run(cast_file(path)), max(1, repeat // 2))
+    return results
+
+
+def environment():
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """回傳退步項目列表：耗時或峰值記憶體超過基準 (1 + tolerance) 倍"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for field in ("median_s", "peak_kib"):
+            if previous.get(field) and current[field] > previous[field] * (1 + tolerance):
+                regressions.append({
+                    "benchmark": name,
+                    "field": field,
+                    "baseline": previous[field],
+                    "current": current[field],
+                    "ratio": round(current[field] / previous[field], 2),
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 bench_suite.py [選項]")
+    parser.add_argument("--baseline", default=None, help=f"JSON 基準檔 (預設 {default_baseline_path()})")
+    parser.add_argument("--save", action="store_true", help="將本次結果存為新的基準")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允許的退步比例 (預設 0.25)")
+    parser.add_argument("--repeat", type=int, default=5, help="每項重複次數，取中位數 (預設 5)")
+    parser.add_argument("--only", help="只執行指定群組，以逗號分隔 (convert,crc,send,cast)")
+    parser.add_argument("--json", help="將本次結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    cast.logger.setLevel("WARNING")
+    only = set(args.only.split(",")) if args.only else None
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = make_corpus(tmp)
+        # PROGRESS / TIMING 行改寫到 stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run_suite(corpus, args.repeat, only)
+
+    report = {
+        "environment": environment(),
+        "repeat": args.repeat,
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+    for name, r in results.items():
+        print(f"{name:>28}: {r['median_s'] * 1000:9.2f}ms  {r['ops_per_s']:8.2f} ops/s  峰值 {r['peak_kib']:9.1f} KiB")
+    print(f"📈 最大常駐記憶體: {report['max_rss_kib'] / 1024:.1f} MiB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baseline_path = args.baseline or default_baseline_path()
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 已保存基準: {baseline_path}")
+        return
+
+    try:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        print(f"ℹ️ 沒有基準檔，可用 --save 建立: {baseline_path}")
+        return
+
+    if baseline.get("environment") != report["environment"]:
+        print("⚠️ 基準建立時的環境不同，比較結果僅供參考")
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    for r in regressions:
+        print(f"❌ {r['benchmark']} {r['field']}: {r['baseline']} -> {r['current']} ({r['ratio']}x)")
+    if regressions:
+        sys.exit(1)
+    print(f"✅ 沒有超過 {args.tolerance:.0%} 的退步")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""多個本機藍牙介面卡 (HCI) 分攤掃描與投圖
+
+單一無線電限制了同時更新的桌牌數量。本模組把工作分散到多個介面卡:
+    AdapterScheduler       記錄每個介面卡看到各設備的平滑 RSSI，投圖時選擇訊號最好、
+                           且進行中傳輸未達上限的介面卡；連線失敗的 (設備, 介面卡) 暫時避開
+    MultiAdapterScanner    與 BleakScanner 相同的 start/stop 介面，每個介面卡各掃描一份並回報看到的 RSSI
+    ShardedConnectionPool  與 BleConnectionPool 相同的 connection(address) 介面，依排程選介面卡，
+                           連線失敗時自動改用下一個介面卡
+掃描程序把看到的結果寫入 CACHE_DIR/adapter_sightings.json，之後的投圖程序載入後即可依 RSSI 分配。
+
+介面卡清單以 --adapters hci0,hci1 或環境變數 PH6_BLE_ADAPTERS 指定；未指定時維持使用預設介面卡。
+
+使用方法: python3 ble_adapters.py --verify     # 以模擬介面卡驗證分配、平衡與故障轉移
+          python3 ble_adapters.py --stats      # 顯示已保存的各介面卡看到的設備
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+from ble_pool import BleConnectionPool
+from e6_quantizer import CACHE_DIR
+from frame_cache import atomic_write
+
+logger = logging.getLogger(__name__)
+
+
+def default_sightings_path():
+    return os.path.join(CACHE_DIR, "adapter_sightings.json")
+
+
+def parse_adapters(value=None):
+    """'hci0,hci1' -> ['hci0', 'hci1']；未指定時讀取 PH6_BLE_ADAPTERS，都沒有時回傳空列表"""
+    if value is None:
+        value = os.environ.get("PH6_BLE_ADAPTERS", "")
+    return [a.strip() for a in value.split(",") if a.strip()]
+
+
+def adapter_kwargs(adapter):
+    """BleakClient / BleakScanner 指定介面卡的參數（BlueZ；舊的 adapter= 參數已不建議使用）"""
+    return {"bluez": {"adapter": adapter}}
+
+
+class AdapterScheduler:
+    def __init__(self, adapters, max_in_flight=2, sighting_max_age=300.0, failure_cooldown=60.0, load_penalty=6.0, rssi_alpha=0.3, clock=time.time):
+        """max_in_flight: 每個介面卡同時進行的傳輸上限
+        sighting_max_age: 超過幾秒的 RSSI 紀錄不再用於分配
+        failure_cooldown: 連線失敗後幾秒內避開同一 (設備, 介面卡)
+        load_penalty: 每筆進行中的傳輸相當於扣多少 dB，訊號接近時優先選較空閒的介面卡"""
+        if not adapters:
+            raise ValueError("至少需要一個藍牙介面卡")
+        self.adapters = list(adapters)
+        self.max_in_flight = max_in_flight
+        self.sighting_max_age = sighting_max_age
+        self.failure_cooldown = failure_cooldown
+        self.load_penalty = load_penalty
+        self.rssi_alpha = rssi_alpha
+        self.clock = clock
+        self.in_flight = {a: 0 for a in self.adapters}
+        self.sightings = defaultdict(dict)  # address -> {adapter: {"rssi", "seen"}}
+        self.failures = {}  # (address, adapter) -> 失敗時間
+        self.counters = {a: {"assigned": 0, "connect_failures": 0, "failovers": 0} for a in self.adapters}
+        self._changed = None
+
+    @staticmethod
+    def _key(address):
+        return address.upper()
+
+    def observe(self, adapter, address, rssi):
+        """記錄介面卡看到設備的一次廣播"""
+        if adapter not in self.in_flight or rssi is None:
+            return
+        entry = self.sightings[self._key(address)].get(adapter)
+        now = self.clock()
+        if entry is None or now - entry["seen"] > self.sighting_max_age:
+            self.sightings[self._key(address)][adapter] = {"rssi": float(rssi), "seen": now}
+        else:
+            entry["rssi"] += self.rssi_alpha * (rssi - entry["rssi"])
+            entry["seen"] = now
+
+    def _fresh_rssi(self, address, now):
+        return {
+            adapter: entry["rssi"]
+            for adapter, entry in self.sightings.get(self._key(address), {}).items()
+            if adapter in self.in_flight and now - entry["seen"] <= self.sighting_max_age
+        }
+
+    def _cooling(self, address, adapter, now):
+        failed = self.failures.get((self._key(address), adapter))
+        return failed is not None and now - failed < self.failure_cooldown
+
+    def choose(self, address, exclude=(), prefer=None):
+        """選出目前最適合的介面卡；全部忙碌時回傳 None（需等待），沒有可用介面卡時拋出 LookupError
+
+        0. prefer（例如已保持閒置連線的介面卡）可用且未達上限時直接使用
+        1. 排除已嘗試過的介面卡；冷卻中的介面卡只在沒有其他選擇時使用
+        2. 有介面卡最近看到此設備時只考慮這些介面卡；都不可用（或從未看到）時才考慮其他介面卡
+        3. 在未達進行中上限的介面卡中取 RSSI - load_penalty × 進行中傳輸數 最高者
+        """
+        now = self.clock()
+        eligible = [a for a in self.adapters if a not in exclude]
+        if not eligible:
+            raise LookupError(f"沒有可用的藍牙介面卡: {address}")
+        if prefer in eligible and self.in_flight[prefer] < self.max_in_flight:
+            return prefer
+        eligible = [a for a in eligible if not self._cooling(address, a, now)] or eligible
+
+        rssi = self._fresh_rssi(address, now)
+        ranked = [a for a in eligible if a in rssi] or eligible
+        free = [a for a in ranked if self.in_flight[a] < self.max_in_flight]
+        if not free:
+            return None
+        # 沒有 RSSI 時視為相同訊號，只比較負載；同分時依介面卡順序
+        return max(free, key=lambda a: (rssi.get(a, 0.0) - self.load_penalty * self.in_flight[a], -self.adapters.index(a)))
+
+    async def acquire(self, address, exclude=(), prefer=None):
+        """等待並佔用一個介面卡的傳輸名額，回傳介面卡名稱"""
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        async with self._changed:
+            while True:
+                adapter = self.choose(address, exclude, prefer)
+                if adapter is not None:
+                    self.in_flight[adapter] += 1
+                    self.counters[adapter]["assigned"] += 1
+                    return adapter
+                await self._changed.wait()
+
+    async def release(self, adapter):
+        async with self._changed:
+            self.in_flight[adapter] -= 1
+            self._changed.notify_all()
+
+    def record_failure(self, address, adapter):
+        self.failures[(self._key(address), adapter)] = self.clock()
+        self.counters[adapter]["connect_failures"] += 1
+
+    def record_success(self, address, adapter):
+        self.failures.pop((self._key(address), adapter), None)
+
+    def stats(self):
+        now = self.clock()
+        return {
+            "adapters": {
+                a: dict(self.counters[a], in_flight=self.in_flight[a], devices_seen=sum(1 for s in self.sightings.values() if a in s))
+                for a in self.adapters
+            },
+            "devices": {
+                address: {a: round(e["rssi"], 1) for a, e in seen.items() if now - e["seen"] <= self.sighting_max_age}
+                for address, seen in sorted(self.sightings.items())
+            },
+        }
+
+    @staticmethod
+    def read_sightings(path=None):
+        try:
+            with open(path or default_sightings_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, path=None):
+        """載入其他程序（掃描）保存的 RSSI 紀錄"""
+        saved = self.read_sightings(path)
+        for address, seen in saved.items():
+            for adapter, entry in seen.items():
+                current = self.sightings[address].get(adapter)
+                if current is None or entry["seen"] > current["seen"]:
+                    self.sightings[address][adapter] = dict(entry)
+        return len(saved)
+
+    def save(self, path=None):
+        """與檔案中的紀錄合併（保留較新的）後原子寫入"""
+        path = path or default_sightings_path()
+        self.load(path)
+        now = self.clock()
+        fresh = {
+            address: {a: {"rssi": round(e["rssi"], 2), "seen": e["seen"]} for a, e in seen.items() if now - e["seen"] <= self.sighting_max_age}
+            for address, seen in self.sightings.items()
+        }
+        atomic_write(os.path.abspath(path), json.dumps({a: s for a, s in fresh.items() if s}, indent=1).encode())
+
+
+class MultiAdapterScanner:
+    """每個介面卡各一個掃描器；看到的 RSSI 交給 scheduler，廣播照常交給 detection_callback"""
+
+    def __init__(self, detection_callback=None, adapters=(), scheduler=None, scanner_factory=None):
+        if scanner_factory is None:
+            from bleak import BleakScanner
+            scanner_factory = BleakScanner
+        self.detection_callback = detection_callback
+        self.scheduler = scheduler
+        self._scanners = [scanner_factory(self._callback_for(a), **adapter_kwargs(a)) for a in adapters]
+
+    def _callback_for(self, adapter):
+        def callback(device, advertisement_data):
+            if self.scheduler is not None:
+                self.scheduler.observe(adapter, device.address, advertisement_data.rssi)
+            if self.detection_callback:
+                self.detection_callback(device, advertisement_data)
+        return callback
+
+    async def start(self):
+        for scanner in self._scanners:
+            await scanner.start()
+
+    async def stop(self):
+        for scanner in self._scanners:
+            with contextlib.suppress(Exception):
+                await scanner.stop()
+
+
+class ShardedConnectionPool:
+    """每個介面卡一個 BleConnectionPool，依 AdapterScheduler 分配；可直接取代 BleConnectionPool"""
+
+    def __init__(self, client_factory, scheduler, idle_timeout=0.0):
+        self.scheduler = scheduler
+        self.pools = {
+            a: BleConnectionPool(self._factory_for(client_factory, a), scheduler.max_in_flight, idle_timeout)
+            for a in scheduler.adapters
+        }
+        self.max_connections = scheduler.max_in_flight * len(scheduler.adapters)
+        self._address_locks = defaultdict(asyncio.Lock)
+
+    @staticmethod
+    def _factory_for(client_factory, adapter):
+        def factory(address):
+            return client_factory(address, **adapter_kwargs(adapter))
+        return factory
+
+    def _idle_adapter(self, address):
+        for adapter, pool in self.pools.items():
+            if address in pool.stats()["idle_addresses"]:
+                return adapter
+        return None
+
+    @contextlib.asynccontextmanager
+    async def connection(self, address):
+        """取得已連線的 client；連線失敗時換下一個介面卡，全部失敗才拋出最後的錯誤"""
+        async with self._address_locks[address]:
+            tried = set()
+            last_error = None
+            # 已在某個介面卡保持閒置連線時優先沿用（設備通常只接受一條連線）
+            idle = self._idle_adapter(address)
+            while True:
+                try:
+                    adapter = await self.scheduler.acquire(address, tried, prefer=idle)
+                except LookupError:
+                    raise last_error from None
+                tried.add(adapter)
+                try:
+                    async with contextlib.AsyncExitStack() as stack:
+                        try:
+                            client = await stack.enter_async_context(self.pools[adapter].connection(address))
+                        except Exception as e:
+                            self.scheduler.record_failure(address, adapter)
+                            last_error = e
+                            if len(tried) < len(self.pools):
+                                self.scheduler.counters[adapter]["failovers"] += 1
+                                logger.warning(f"⚠️ {address} 經 {adapter} 連線失敗，改用其他介面卡: {e}")
+                            continue
+                        self.scheduler.record_success(address, adapter)
+                        logger.info(f"📶 {address} 使用介面卡 {adapter}")
+                        yield client
+                        return
+                finally:
+                    await self.scheduler.release(adapter)
+
+    async def close_idle(self, max_idle=None):
+        for pool in self.pools.values():
+            await pool.close_idle(max_idle)
+
+    async def close_all(self):
+        for pool in self.pools.values():
+            await pool.close_all()
+
+    def stats(self):
+        pools = {a: pool.stats() for a, pool in self.pools.items()}
+        return {
+            "max_connections": self.max_connections,
+            "idle_connections": sum(p["idle_connections"] for p in pools.values()),
+            "idle_addresses": sorted(a for p in pools.values() for a in p["idle_addresses"]),
+            "adapters": self.scheduler.stats()["adapters"],
+        }
+
+
+def make_connection_pool(client_factory, adapters, max_connections=4, idle_timeout=0.0, sightings_path=None):
+    """指定多個介面卡時回傳 ShardedConnectionPool（載入已保存的 RSSI 紀錄），否則回傳一般連線池"""
+    if len(adapters) < 2:
+        if adapters:
+            client_factory = ShardedConnectionPool._factory_for(client_factory, adapters[0])
+        return BleConnectionPool(client_factory, max_connections, idle_timeout)
+    scheduler = AdapterScheduler(adapters, max_in_flight=max(1, max_connections // len(adapters)))
+    scheduler.load(sightings_path)
+    return ShardedConnectionPool(client_factory, scheduler, idle_timeout)
+
+
+async def _verify_scenarios():
+    """以模擬介面卡驗證排程：RSSI 分配、進行中傳輸平衡、連線失敗時故障轉移"""
+    from ph6_simulator import FakeBleakClient, FakeBleakScanner
+
+    results = []
+
+    def check(name, passed, **details):
+        results.append(dict(scenario=name, passed=bool(passed), **details))
+
+    # 1. 掃描：near 只被 hci1 清楚看到，far 兩邊都看得到但 hci0 較好
+    adapter_devices = {
+        "hci0": [("NEAR", "PH6-NEAR", None, -90, 0.02), ("FAR", "PH6-FAR", None, -60, 0.02)],
+        "hci1": [("NEAR", "PH6-NEAR", None, -50, 0.02), ("FAR", "PH6-FAR", None, -75, 0.02)],
+    }
+    scheduler = AdapterScheduler(["hci0", "hci1"])
+    seen = []
+
+    def scanner_factory(callback, bluez):
+        return FakeBleakScanner(callback, devices=adapter_devices[bluez["adapter"]], rssi_jitter=0)
+
+    scanner = MultiAdapterScanner(lambda device, adv: seen.append(device.address), ["hci0", "hci1"], scheduler, scanner_factory)
+    await scanner.start()
+    await asyncio.sleep(0.3)
+    await scanner.stop()
+    check("rssi", scheduler.choose("near") == "hci1" and scheduler.choose("FAR") == "hci0" and seen,
+          assignment={"NEAR": scheduler.choose("NEAR"), "FAR": scheduler.choose("FAR")})
+
+    # 2. 平衡：8 台設備都在 hci0 訊號最好，但每個介面卡同時最多 2 筆傳輸
+    scheduler = AdapterScheduler(["hci0", "hci1"], max_in_flight=2)
+    addresses = [f"DEV{i}" for i in range(8)]
+    for address in addresses:
+        scheduler.observe("hci0", address, -55)
+        scheduler.observe("hci1", address, -60)
+    peak = defaultdict(int)
+    pool = ShardedConnectionPool(FakeBleakClient, scheduler)
+
+    async def transfer(address):
+        async with pool.connection(address):
+            for adapter, n in scheduler.in_flight.items():
+                peak[adapter] = max(peak[adapter], n)
+            await asyncio.sleep(0.05)
+
+    await asyncio.gather(*(transfer(a) for a in addresses))
+    used = {a: c["assigned"] for a, c in scheduler.counters.items()}
+    check("balance", max(peak.values()) <= 2 and all(used.values()) and all(n == 0 for n in scheduler.in_flight.values()),
+          peak_in_flight=dict(peak), assigned=used)
+
+    # 3. 故障轉移：BROKEN 經 hci0 一律連線失敗，應改經 hci1 完成，之後冷卻期間直接選 hci1
+    scheduler = AdapterScheduler(["hci0", "hci1"])
+    scheduler.observe("hci0", "BROKEN", -50)
+    scheduler.observe("hci1", "BROKEN", -70)
+
+    def flaky_factory(address, bluez):
+        return FakeBleakClient(address, connect_failure_rate=1.0 if bluez["adapter"] == "hci0" else 0.0)
+
+    pool = ShardedConnectionPool(flaky_factory, scheduler)
+    async with pool.connection("BROKEN") as client:
+        connected = client.is_connected
+    check("failover", connected and scheduler.counters["hci0"]["connect_failures"] == 1 and scheduler.choose("BROKEN") == "hci1",
+          counters=scheduler.counters)
+
+    # 4. 所有介面卡都失敗時拋出連線錯誤，名額全部釋放
+    pool = ShardedConnectionPool(lambda address, bluez: FakeBleakClient(address, connect_failure_rate=1.0), AdapterScheduler(["hci0", "hci1"]))
+    try:
+        async with pool.connection("DEAD"):
+            raised = False
+    except ConnectionError:
+        raised = True
+    check("all-fail", raised and not any(pool.scheduler.in_flight.values()), counters=pool.scheduler.counters)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 ble_adapters.py (--verify | --stats)")
+    parser.add_argument("--verify", action="store_true", help="以模擬介面卡驗證排程邏輯")
+    parser.add_argument("--stats", action="store_true", help="顯示已保存的各介面卡 RSSI 紀錄")
+    parser.add_argument("--adapters", default=None, help="介面卡清單，例如 hci0,hci1 (預設 PH6_BLE_ADAPTERS)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    if args.verify:
+        results = asyncio.run(_verify_scenarios())
+        for r in results:
+            print(f"{'✅' if r['passed'] else '❌'} {r['scenario']}", file=sys.stderr)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        sys.exit(0 if all(r["passed"] for r in results) else 1)
+    if args.stats:
+        saved = AdapterScheduler.read_sightings()
+        adapters = parse_adapters(args.adapters) or sorted({a for seen in saved.values() for a in seen}) or ["hci0"]
+        scheduler = AdapterScheduler(adapters)
+        scheduler.load()
+        print(json.dumps(scheduler.stats(), ensure_ascii=False, indent=2))
+        return
+    parser.print_usage()
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""有上限的 BLE 連線池
+
+限制同時開啟的連線數，同一設備的使用會依序進行；idle_timeout > 0 時
+用完的連線保持開啟，下次投同一台設備可省去連線與服務探索時間。
+容量已滿時優先關閉最久未使用的閒置連線。
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class BleConnectionPool:
+    def __init__(self, client_factory, max_connections=4, idle_timeout=0.0):
+        self.client_factory = client_factory
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._slots = asyncio.Semaphore(max_connections)
+        self._idle = {}  # address -> (client, last_used)
+        self._address_locks = defaultdict(asyncio.Lock)
+
+    @contextlib.asynccontextmanager
+    async def connection(self, address):
+        """取得已連線的 client；可直接作為 cast_frame_to_device 的 client_factory 使用"""
+        async with self._address_locks[address]:
+            client = await self._take_idle(address)
+            if client is None:
+                await self._acquire_slot()
+                client = self.client_factory(address)
+                try:
+                    await client.connect()
+                except BaseException:
+                    self._slots.release()
+                    raise
+
+            reusable = False
+            try:
+                yield client
+                reusable = True
+            finally:
+                if reusable and self.idle_timeout > 0 and client.is_connected:
+                    self._idle[address] = (client, time.monotonic())
+                else:
+                    await self._close(client)
+
+    async def _take_idle(self, address):
+        entry = self._idle.pop(address, None)
+        if entry is None:
+            return None
+        client, _ = entry
+        if client.is_connected:
+            return client
+        await self._close(client)
+        return None
+
+    async def _acquire_slot(self):
+        while self._slots.locked() and self._idle:
+            oldest = min(self._idle, key=lambda a: self._idle[a][1])
+            client, _ = self._idle.pop(oldest)
+            logger.info(f"🔌 連線池已滿，關閉閒置連線: {oldest}")
+            await self._close(client)
+        await self._slots.acquire()
+
+    async def _close(self, client):
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.debug(f"關閉連線時發生錯誤: {e}")
+        finally:
+            self._slots.release()
+
+    async def close_idle(self, max_idle=None):
+        """關閉閒置超過 max_idle 秒（預設 idle_timeout）的連線"""
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        now = time.monotonic()
+        for address in [a for a, (_, used) in self._idle.items() if now - used >= max_idle]:
+            client, _ = self._idle.pop(address)
+            await self._close(client)
+
+    async def close_all(self):
+        await self.close_idle(0)
+
+    def stats(self):
+        return {
+            "max_connections": self.max_connections,
+            "idle_connections": len(self._idle),
+            "idle_addresses": sorted(self._idle),
+        }
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""持續掃描時的桌牌設備登錄表
+
+以 OriginalAddress 為鍵保存每台桌牌最後一次被看到的時間與平滑後的 RSSI，
+並在設備新增、明顯變化與逾時消失時產生事件：
+    {"event": "add",    "time": ..., "device": {...}}
+    {"event": "update", "time": ..., "device": {...}}
+    {"event": "expire", "time": ..., "device": {...}}
+snapshot() 直接從登錄表回傳目前在範圍內的設備（格式與單次掃描結果相同），
+不需重新掃描。
+"""
+import time
+
+
+class DeviceRegistry:
+    def __init__(self, expire_after=30.0, rssi_alpha=0.3, rssi_threshold=3.0, clock=time.time):
+        """expire_after: 超過幾秒未收到廣播即視為離開範圍
+        rssi_alpha: RSSI 指數平滑係數；rssi_threshold: 平滑 RSSI 變化超過此值才發出 update"""
+        self.expire_after = expire_after
+        self.rssi_alpha = rssi_alpha
+        self.rssi_threshold = rssi_threshold
+        self.clock = clock
+        self._devices = {}  # OriginalAddress -> entry
+
+    def observe(self, device_info):
+        """記錄一次廣播，回傳 add / update 事件或 None"""
+        now = self.clock()
+        address = device_info["OriginalAddress"]
+        rssi = device_info.get("SignalStrength")
+        entry = self._devices.get(address)
+
+        if entry is None:
+            entry = {"info": dict(device_info), "rssi": rssi, "reported_rssi": rssi, "last_seen": now}
+            self._devices[address] = entry
+            return self._event("add", entry, now)
+
+        entry["last_seen"] = now
+        if rssi is not None:
+            if entry["rssi"] is None:
+                entry["rssi"] = rssi
+            else:
+                entry["rssi"] += self.rssi_alpha * (rssi - entry["rssi"])
+
+        previous = entry["info"]
+        # 已取得的真實 MAC 不要被之後缺少服務數據的廣播（掃描回應）覆蓋
+        if previous.get("RealMacFound") and not device_info.get("RealMacFound"):
+            device_info = dict(device_info, BluetoothAddress=previous["BluetoothAddress"], RealMacFound=True)
+        changed = any(
+            device_info.get(key) != previous.get(key)
+            for key in ("Name", "BluetoothAddress", "RealMacFound")
+        )
+        entry["info"] = dict(device_info)
+
+        moved = (
+            entry["rssi"] is not None
+            and (entry["reported_rssi"] is None or abs(entry["rssi"] - entry["reported_rssi"]) >= self.rssi_threshold)
+        )
+        if changed or moved:
+            entry["reported_rssi"] = entry["rssi"]
+            return self._event("update", entry, now)
+        return None
+
+    def expire(self):
+        """移除逾時未見的設備，回傳 expire 事件列表"""
+        now = self.clock()
+        events = []
+        for address in [a for a, e in self._devices.items() if now - e["last_seen"] > self.expire_after]:
+            entry = self._devices.pop(address)
+            events.append(self._event("expire", entry, now))
+        return events
+
+    def get(self, address):
+        """依 OriginalAddress 或 BluetoothAddress（不分大小寫）查詢設備"""
+        target = address.upper()
+        for entry in self._devices.values():
+            info = entry["info"]
+            if target in (info["OriginalAddress"].upper(), str(info.get("BluetoothAddress", "")).upper()):
+                return self._device(entry)
+        return None
+
+    def snapshot(self):
+        return [self._device(e) for e in sorted(self._devices.values(), key=lambda e: e["info"]["OriginalAddress"])]
+
+    def __len__(self):
+        return len(self._devices)
+
+    @staticmethod
+    def _device(entry):
+        device = dict(entry["info"])
+        if entry["rssi"] is not None:
+            device["SignalStrength"] = round(entry["rssi"])
+        device["LastSeen"] = round(entry["last_seen"], 3)
+        return device
+
+    def _event(self, kind, entry, now):
+        return {"event": kind, "time": round(now, 3), "device": self._device(entry)}
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""批次投圖：在單一 asyncio 迴圈中同時推送多台桌牌
+
+讀取 (image, side, address) 工作清單，以可設定的上限限制同時開啟的
+BleakClient 連線數，失敗的設備以指數退避重試，最後輸出每台設備結果的 JSON 摘要。
+
+使用方法: python3 cast_batch.py <manifest.json> [--max-connections 4] [--retries 2] [--simulate]
+
+manifest 格式: [{"image": "front.png", "side": 1, "address": "6A42..."}, ...]
+或 {"jobs": [...]}
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import sys
+import time
+from functools import partial
+
+import cast_image_to_ph6_fixed as cast
+from ble_adapters import ShardedConnectionPool, make_connection_pool, parse_adapters
+from frame_cache import FrameCache, frame_cache_enabled
+from ph6_metrics import CastMetrics
+
+logger = cast.logger
+
+
+def load_manifest(path):
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    jobs = manifest["jobs"] if isinstance(manifest, dict) else manifest
+
+    for i, job in enumerate(jobs):
+        if "image" not in job or "address" not in job:
+            raise ValueError(f"第 {i} 筆工作缺少 image 或 address")
+        job.setdefault("side", 2)
+    return jobs
+
+
+class BatchCaster:
+    def __init__(self, client_factory, max_connections=4, retries=2, backoff=1.0, incremental=False, refresh_wait=5.0, flow_control="vendor", adaptive=False, pool=None, adapters=()):
+        """pool 可傳入既有的連線池（例如常駐程序共用的），否則自行建立；adapters 指定多個介面卡時分攤連線"""
+        self.pool = pool or make_connection_pool(client_factory, adapters, max_connections)
+        self.retries = retries
+        self.backoff = backoff
+        self.incremental = incremental
+        self.refresh_wait = refresh_wait
+        self.flow_control = flow_control
+        self.adaptive = adaptive
+        self.frame_cache = FrameCache() if frame_cache_enabled() else None
+        self._frames = {}
+
+    async def _frame_for(self, image_path):
+        """同一張圖片在批次中只轉換一次；轉換在執行緒中進行，不阻塞其他傳輸"""
+        if image_path not in self._frames:
+            loop = asyncio.get_running_loop()
+            self._frames[image_path] = loop.run_in_executor(None, cast.load_e6_frame, image_path, self.frame_cache)
+        return await self._frames[image_path]
+
+    async def cast_job(self, job):
+        result = {"image": job["image"], "side": job["side"], "address": job["address"], "success": False, "attempts": 0, "error": None}
+        started = time.perf_counter()
+
+        try:
+            frame = await self._frame_for(job["image"])
+        except Exception as e:
+            result["error"] = f"圖片轉換失敗: {e}"
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            return result
+
+        await self.deliver(frame, job, result)
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    async def deliver(self, frame, job, result):
+        """以重試與指數退避推送已轉換的畫面，結果寫入 result；job 可覆寫 incremental 等選項"""
+        for attempt in range(self.retries + 1):
+            result["attempts"] = attempt + 1
+            metrics = CastMetrics()
+            metrics.count("retries", attempt)
+            try:
+                ok = await cast.cast_frame_to_device(
+                    frame, job["side"], job["address"], self.pool.connection,
+                    incremental=job.get("incremental", self.incremental),
+                    refresh_wait=job.get("refresh_wait", self.refresh_wait),
+                    flow_control=job.get("flow_control", self.flow_control),
+                    adaptive=job.get("adaptive", self.adaptive),
+                    metrics=metrics,
+                )
+                if ok:
+                    result["success"] = True
+                    result["error"] = None
+                    break
+                result["error"] = "傳輸失敗"
+            except Exception as e:
+                result["error"] = str(e) or type(e).__name__
+
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"⚠️ {job['address']} 第 {attempt + 1} 次投圖失敗，{delay:.1f}s 後重試: {result['error']}")
+                await asyncio.sleep(delay)
+
+        # 只保留最後一次嘗試的精簡指標，完整直方圖見單張投圖的 METRICS 行
+        record = metrics.as_record()
+        result["metrics"] = {k: record[k] for k in ("phases", "packets_per_second", "bytes_per_second", "counters")}
+        return result
+
+    async def run(self, jobs):
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.cast_job(job) for job in jobs))
+        elapsed = time.perf_counter() - started
+        succeeded = sum(1 for r in results if r["success"])
+
+        summary = {
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "seconds": round(elapsed, 3),
+            "casts_per_minute": round(len(results) / elapsed * 60, 1) if elapsed > 0 else None,
+            "results": results,
+        }
+        if self.frame_cache is not None:
+            summary["frame_cache"] = self.frame_cache.stats()
+        if isinstance(self.pool, ShardedConnectionPool):
+            summary["adapters"] = self.pool.stats()["adapters"]
+        return summary
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(usage="python3 cast_batch.py <manifest.json> [選項]")
+    parser.add_argument("manifest", help="工作清單 JSON 檔")
+    parser.add_argument("--max-connections", type=int, default=4, help="同時開啟的 BLE 連線上限 (預設 4)")
+    parser.add_argument("--retries", type=int, default=2, help="失敗設備的重試次數 (預設 2)")
+    parser.add_argument("--backoff", type=float, default=1.0, help="重試退避基準秒數 (預設 1.0)")
+    parser.add_argument("--incremental", action="store_true", help="只傳送變更的區塊")
+    parser.add_argument("--flow-control", choices=("vendor", "ack"), default="vendor", help="vendor: 廠商固定延遲；ack: 等待設備ACK (預設 vendor)")
+    parser.add_argument("--adaptive", action="store_true", help="依設備回應自動調整並記住延遲參數")
+    parser.add_argument("--refresh-wait", type=float, default=5.0, help="刷新後等待秒數 (預設 5.0)")
+    parser.add_argument("--adapters", default=None, help="以逗號分隔的藍牙介面卡，例如 hci0,hci1 (預設 PH6_BLE_ADAPTERS)")
+    parser.add_argument("--simulate", action="store_true", help="使用模擬設備，不需實體桌牌")
+    parser.add_argument("--sim-write-latency", type=float, default=0.0, help="模擬每包寫入延遲秒數")
+    parser.add_argument("--sim-connect-latency", type=float, default=0.5, help="模擬連線延遲秒數")
+    parser.add_argument("--sim-failure-rate", type=float, default=0.0, help="模擬連線失敗機率 (0-1)")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    cast.configure_logging()
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except (OSError, ValueError, KeyError) as e:
+        print(json.dumps({"error": f"無法讀取工作清單: {e}"}, ensure_ascii=False))
+        sys.exit(1)
+
+    if args.simulate:
+        from ph6_simulator import FakeBleakClient
+        client_factory = partial(
+            FakeBleakClient,
+            write_latency=args.sim_write_latency,
+            connect_latency=args.sim_connect_latency,
+            connect_failure_rate=args.sim_failure_rate,
+        )
+    else:
+        from bleak import BleakClient
+        client_factory = BleakClient
+
+    caster = BatchCaster(
+        client_factory,
+        max_connections=args.max_connections,
+        retries=args.retries,
+        backoff=args.backoff,
+        incremental=args.incremental,
+        refresh_wait=args.refresh_wait,
+        flow_control=args.flow_control,
+        adaptive=args.adaptive,
+        adapters=parse_adapters(args.adapters),
+    )
+    # 各設備的 PROGRESS 行改寫到 stderr，stdout 只保留最後的 JSON 摘要
+    with contextlib.redirect_stdout(sys.stderr):
+        summary = asyncio.run(caster.run(jobs))
+
+    if args.simulate:
+        from ph6_simulator import FakeBleakClient
+        summary["peak_connections"] = FakeBleakClient.peak_connections
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    sys.exit(0 if summary["failed"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,58 @@
 #!/usr/bin/env python3
+# PIL 與 bleak 只在需要的路徑上才載入（參數錯誤、模擬模式、畫面快取命中時不必付出匯入成本），
+# 型別註記因此延後求值
+from __future__ import annotations
+
+import argparse
 import asyncio
+import contextlib
+import io
 import logging
 import math
 import sys
 import os
-from PIL import Image
-from bleak import BleakClient
+import time
+from typing import TYPE_CHECKING
+
+import e6_quantizer
+from frame_cache import DEFAULT_RESUME_WINDOW, FRAME_SUFFIX, RESIZE_MODE, DeviceFrameStore, FrameCache, TransferCheckpointStore, frame_cache_enabled
+from frame_pack import default_pack
+from ph6_metrics import CastMetrics
+from ph6_pacing import AdaptivePacer, FixedPacing, PacingStore
+from ph6_packetizer import DEF_MTU, Ph6Packetizer, crc8, negotiated_mtu
+
+if TYPE_CHECKING:
+    from bleak import BleakClient
 
 # 配置參數
 DEVICE_ADDRESS = "6A422DCC-2730-B0E8-E8B8-1C513A0D7B10"
 COMMAND_CHAR_UUID = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"
 ACK_CHAR_UUID = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
 
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
 logger = logging.getLogger(__name__)
 
-# 常量定義
-DEF_MTU = 247
+def configure_logging(level=logging.INFO):
+    """命令列進入點呼叫；被其他模組匯入時不更動呼叫端的日誌設定"""
+    logging.basicConfig(
+        level=level,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+# 常量定義（DEF_MTU 與 CRC8_TABLE 定義在 ph6_packetizer）
 SEND_PIC_DATA_NO_RES = 2
 SEND_PIC_DATA_BLOCK = 3
+SEND_PIC_REFRESH = 5
+SIMULATED_REFRESH_WAIT = 0.5  # 模擬模式的刷新等待秒數（模擬設備即時刷新）
+# .epd 畫面中合法的位元組：高低 4 位元都是設備顏色索引
+VALID_FRAME_BYTES = bytes(hi << 4 | lo for hi in e6_quantizer.VENDOR_INDEX_MAP for lo in e6_quantizer.VENDOR_INDEX_MAP)
+# 單次轉換的解碼上限（JPEG 以解碼時縮小後的尺寸計算）：超過時不解碼，直接拒絕
+MAX_IMAGE_PIXELS = int(os.environ.get("PH6_MAX_IMAGE_PIXELS", str(40_000_000)))
+MAX_DECODE_BYTES = int(os.environ.get("PH6_MAX_DECODE_MB", "160")) * 1024 * 1024
+# 解碼時已縮小 (draft) 的 JPEG 在 LANCZOS 縮放前先以整數倍 reduce 縮小到目標的 2 倍以內；
+# 其他圖片維持廠商的完整 LANCZOS 縮放，輸出與廠商流程逐位元相同
+REDUCING_GAP = 2.0
 
-CRC8_TABLE = [
-    0, 94, 188, 226, 97, 63, 221, 131, 194, 156, 126, 32, 163, 253, 31, 65,
-    157, 195, 33, 127, 252, 162, 64, 30, 95, 1, 227, 189, 62, 96, 130, 220,
-    35, 125, 159, 193, 66, 28, 254, 160, 225, 191, 93, 3, 128, 222, 60, 98,
-    190, 224, 2, 92, 223, 129, 99, 61, 124, 34, 192, 158, 29, 67, 161, 255,
-    70, 24, 250, 164, 39, 121, 155, 197, 132, 218, 56, 102, 229, 187, 89, 7,
-    219, 133, 103, 57, 186, 228, 6, 88, 25, 71, 165, 251, 120, 38, 196, 154,
-    101, 59, 217, 135, 4, 90, 184, 230, 167, 249, 27, 69, 198, 152, 122, 36,
-    248, 166, 68, 26, 153, 199, 37, 123, 58, 100, 134, 216, 91, 5, 231, 185,
-    140, 210, 48, 110, 237, 179, 81, 15, 78, 16, 242, 172, 47, 113, 147, 205,
-    17, 79, 173, 243, 112, 46, 204, 146, 211, 141, 111, 49, 178, 236, 14, 80,
-    175, 241, 19, 77, 206, 144, 114, 44, 109, 51, 209, 143, 12, 82, 176, 238,
-    50, 108, 142, 208, 83, 13, 239, 177, 240, 174, 76, 18, 145, 207, 45, 115,
-    202, 148, 118, 40, 171, 245, 23, 73, 8, 86, 180, 234, 105, 55, 213, 139,
-    87, 9, 235, 181, 54, 104, 138, 212, 149, 203, 41, 119, 244, 170, 72, 22,
-    233, 183, 85, 11, 136, 214, 52, 106, 43, 117, 151, 201, 74, 20, 246, 168,
-    116, 42, 200, 150, 21, 75, 169, 247, 182, 232, 10, 84, 215, 137, 107, 53
-]
 
 def color_distance(c1, c2):
     dr = c1[0] - c2[0]
@@ -75,27 +85,72 @@ def find_nearest_color(target, colors):
         return 2        
     return nearest_index
 
-def convert_image_to_e6(image_path):
-    """完全按照廠商算法"""
-    buf_size = 192000
-    buff = [0]*buf_size  # 保持 list 格式
-    colors = [
-        (0, 0, 0),#black
-        (255, 255, 255),#white
-        (0, 255, 0),#green
-        (0, 0, 255),#blue
-        (255, 0, 0),#red
-        (255, 255, 0),#yellow
-    ]
-    rgb_image = Image.open(image_path).convert("RGB")
-    
+def prepare_e6_rgb_image(image, reducing_gap=None):
+    """轉為 RGB 並調整為 800x480（與廠商流程相同）
+
+    reducing_gap 傳給 Image.resize；None 為廠商流程的完整 LANCZOS 縮放。
+    """
+    from PIL import Image
+
+    # 已是 RGB 時不複製，大尺寸來源可省下一份完整畫面的記憶體
+    rgb_image = image if image.mode == "RGB" else image.convert("RGB")
+
     if rgb_image.size != (800, 480):
         logger.info(f"調整圖片尺寸從 {rgb_image.size} 到 (800, 480)")
-        rgb_image = rgb_image.resize((800, 480), Image.Resampling.LANCZOS)
-    
+        rgb_image = rgb_image.resize((800, 480), Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+
     width, height = rgb_image.size
     logger.info(f"處理圖片尺寸: {width}x{height}")
-    
+    return rgb_image
+
+def decode_cost(image):
+    """估計解碼並轉為 RGB 需要的記憶體（位元組）：解碼後的像素加上 RGB 副本
+
+    PIL 的 1/L/P 模式每像素 1 位元組，其餘模式（含 RGB）每像素佔 4 位元組。
+    """
+    width, height = image.size
+    pixel_bytes = 1 if image.mode in ("1", "L", "P") else 4
+    return width * height * (pixel_bytes + (0 if image.mode == "RGB" else 4))
+
+def open_bounded_image(source, max_pixels=None, max_decode_bytes=None):
+    """開啟圖片並在解碼前套用像素與記憶體上限，超過時拋出 ValueError；回傳 (image, 是否已於解碼時縮小)
+
+    比 800x480 大的 JPEG 以 draft 在解碼時直接縮小 1/2、1/4 或 1/8（仍不小於
+    800x480），只解碼接近目標尺寸的像素。上限套用在實際要解碼的尺寸上：能在解碼時
+    縮小的格式以縮小後的尺寸計算，其他格式以完整尺寸計算。
+    """
+    from PIL import Image
+
+    max_pixels = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    max_decode_bytes = MAX_DECODE_BYTES if max_decode_bytes is None else max_decode_bytes
+    image = Image.open(source)
+    reduced = False
+    try:
+        width, height = image.size
+        if width > e6_quantizer.EPD_WIDTH and height > e6_quantizer.EPD_HEIGHT:
+            image.draft("RGB", (e6_quantizer.EPD_WIDTH, e6_quantizer.EPD_HEIGHT))
+            if image.size != (width, height):
+                reduced = True
+                logger.info(f"📉 解碼時縮小 {width}x{height} -> {image.size[0]}x{image.size[1]}")
+        decoded_width, decoded_height = image.size
+        if decoded_width * decoded_height > max_pixels:
+            raise ValueError(f"圖片 {width}x{height} 需解碼 {decoded_width}x{decoded_height}，超過像素上限 {max_pixels}")
+        cost = decode_cost(image)
+        if cost > max_decode_bytes:
+            raise ValueError(f"圖片 {width}x{height} 解碼約需 {cost / 1024 / 1024:.0f}MB，超過上限 {max_decode_bytes / 1024 / 1024:.0f}MB")
+        image.load()
+    except BaseException:
+        image.close()
+        raise
+    return image, reduced
+
+def convert_rgb_image_to_e6_reference(rgb_image):
+    """完全按照廠商算法（逐像素版本，作為向量化量化器的對照基準）"""
+    buf_size = 192000
+    buff = bytearray(buf_size)  # 每位元組兩個像素，與向量化版本相同的輸出型別
+    colors = list(e6_quantizer.E6_COLORS)
+    width, height = rgb_image.size
+
     for y in range(height): 
         for x in range(width):
             r, g, b = rgb_image.getpixel((x, y))
@@ -113,173 +168,306 @@ def convert_image_to_e6(image_path):
     
     return buff
 
+def convert_image_to_e6(image_path, timings=None):
+    """廠商算法的向量化版本，輸出與逐像素算法逐位元相同
+
+    timings 為 dict 時寫入 image_load（解碼）、resize、quantize 耗時（秒）。
+    已是 800x480 的調色盤 (P) / 灰階 (L) 圖片以 256 項表直接對應設備顏色，略過 RGB 轉換與量化。
+    解碼受 MAX_IMAGE_PIXELS / MAX_DECODE_BYTES 限制，大尺寸 JPEG 在解碼時即縮小，
+    只有這類圖片以 REDUCING_GAP 縮放；其餘輸出與廠商流程逐位元相同（e6_quantizer.py --verify 驗證）。
+    """
+    metrics = CastMetrics(timings)
+    with metrics.span("image_load"):
+        image, reduced = open_bounded_image(image_path)
+    if image.mode in e6_quantizer.INDEXED_MODES and image.size == (e6_quantizer.EPD_WIDTH, e6_quantizer.EPD_HEIGHT):
+        logger.info(f"🎨 {image.mode} 模式圖片，以 256 項色表直接轉換")
+        with metrics.span("quantize"):
+            return e6_quantizer.quantize_indexed_image(image)
+    with metrics.span("resize"):
+        rgb_image = prepare_e6_rgb_image(image, REDUCING_GAP if reduced else None)
+
+    with metrics.span("quantize"):
+        if e6_quantizer.numpy_available():
+            return e6_quantizer.quantize_image_to_e6(rgb_image)
+
+        logger.warning("⚠️ 未安裝 numpy，改用逐像素廠商算法")
+        return convert_rgb_image_to_e6_reference(rgb_image)
+
+def is_raw_frame_path(path):
+    return isinstance(path, (str, os.PathLike)) and os.fspath(path).lower().endswith(FRAME_SUFFIX)
+
+def read_raw_frame(path):
+    """讀取預先打包的 .epd 畫面：192000 位元組，每位元組兩個設備顏色索引（偶數 x 在高 4 位元）"""
+    with open(path, "rb") as f:
+        frame = f.read(e6_quantizer.EPD_BUF_SIZE + 1)
+    if len(frame) != e6_quantizer.EPD_BUF_SIZE:
+        raise ValueError(f"{path} 不是有效的 .epd 畫面：長度必須為 {e6_quantizer.EPD_BUF_SIZE} 位元組")
+    invalid = frame.translate(None, VALID_FRAME_BYTES)
+    if invalid:
+        raise ValueError(f"{path} 含有非設備顏色索引的像素值: 0x{invalid[0]:02x}")
+    return frame
+
+def load_e6_frame(image_path, frame_cache=None, timings=None):
+    """先查預編譯畫面包與畫面快取，命中時完全跳過 PIL 解碼；未命中才轉換並寫回快取
+
+    .epd 檔為已打包的畫面，直接讀出，不經 PIL 也不寫入快取。
+    """
+    if is_raw_frame_path(image_path):
+        logger.info(f"📄 使用預先打包的畫面: {image_path}")
+        return read_raw_frame(image_path)
+    if frame_cache is None:
+        # 預編譯畫面包是唯讀的建置產物，不受 PH6_FRAME_CACHE 開關影響
+        frame = default_pack().lookup(image_path)
+        if frame is not None:
+            logger.info(f"📦 預編譯畫面包命中: {image_path}")
+            return frame
+        return convert_image_to_e6(image_path, timings)
+
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+
+    key = FrameCache.make_key(image_bytes, RESIZE_MODE)
+    frame = default_pack().get(key)
+    if frame is not None:
+        logger.info(f"📦 預編譯畫面包命中: {key[:12]}")
+        return frame
+
+    frame = frame_cache.get(key)
+    if frame is not None:
+        logger.info(f"⚡ 畫面快取命中: {key[:12]}")
+        return frame
+
+    logger.info(f"🧊 畫面快取未命中: {key[:12]}")
+    frame = convert_image_to_e6(io.BytesIO(image_bytes), timings)
+    try:
+        frame_cache.put(key, frame)
+    except OSError as e:
+        logger.warning(f"⚠️ 無法寫入畫面快取: {e}")
+    return frame
+
 class BleClientFixed:
-    def __init__(self):
+    def __init__(self, flow_control="vendor", ack_window=8, mtu=None, metrics=None):
+        """flow_control="vendor" 保留廠商的固定延遲時序；"ack" 改為等待設備實際的 ACK 通知，
+        並每 ack_window 包以需回應的寫入作為流量屏障，不再使用固定延遲。
+        mtu 為 None 時使用連線協商的 MTU（不低於 DEF_MTU），否則強制使用指定值。
+        metrics 為 CastMetrics 時記錄寫入延遲、區塊耗時與 ACK 逾時"""
         self.ble_connect = False
         self.ble_send_busy = False
         self.ack_event = asyncio.Event()
         self.ack_received = False
         self.last_ack_data = None
+        self.packets_sent = 0
+        self.flow_control = flow_control
+        self.ack_window = max(1, ack_window)
+        self.notifications = asyncio.Queue()
+        self.pacing = None
+        self.mtu = mtu
+        self.notify_client = None
+        self.metrics = metrics if metrics is not None else CastMetrics()
+        self.request_ack = None  # 本次請求的設備回應
+        # ACK 模式下 wait_for_ack 確實等到該區塊 ACK 的區塊；廠商模式不等待 ACK，永遠為空
+        self.confirmed_blocks = []
+        self.restarted = False  # 只傳部分區塊時設備未保留緩衝區，已改為整面傳送
+        self.block_ack_seen = False  # 廠商模式：本區塊最後一包送出後是否收到旗標 0x01 的區塊 ACK
+
+    async def buffer_retained(self, timeout=1.0):
+        """只傳部分區塊（差異上傳或續傳）前確認設備仍保留緩衝區：請求回應旗標 0x01
+        表示緩衝區仍在，0x00 或沒有回應表示設備已重置，需整面傳送"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.request_ack is None and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        return self.request_ack is not None and len(self.request_ack) >= 6 and self.request_ack[5] == 0x01
 
     def safe_byte(self, value):
         return value & 0xFF
 
     def calculate_crc(self, data):
-        crc = 0
-        for b in data:
-            crc = CRC8_TABLE[crc ^ self.safe_byte(b)]
-        return crc
+        return crc8(data)
+
+    async def send_image_to_ph6(self, client: BleakClient, epd_display_buf, side: int, block_delay=0.001, prep_delay=0.001, packet_delay=0.001, sync_interval=5, blocks=None, sync_delay=0.1, refresh_wait=5.0, pacing=None):
+        """修復版本的圖片傳送，完全採用廠商邏輯，支援動態延遲參數
+
+        blocks 為要傳送的區塊編號 (1-6)，None 表示整面傳送；略過的區塊仍保留
+        原本的包序號與緩衝區位移，設備依包序號定位資料。
+        pacing 為 AdaptivePacer 時，延遲參數會在傳輸過程中依觀察到的延遲即時調整。
+        blocks 不含全部區塊時先確認設備仍保留緩衝區，否則改為整面傳送，避免顯示新舊混合的畫面。
+        """
+        if pacing is None:
+            pacing = FixedPacing(block_delay, prep_delay, packet_delay, sync_interval, sync_delay)
+        self.pacing = pacing
 
-    async def send_image_to_ph6(self, client: BleakClient, epd_display_buf, side: int, block_delay=0.001, prep_delay=0.001, packet_delay=0.001, sync_interval=5):
-        """修復版本的圖片傳送，完全採用廠商邏輯，支援動態延遲參數"""
         logger.info("🚀 開始發送圖片到 PH6 - 修復版本（完全廠商邏輯）")
-        logger.info(f"⚙️ 延遲參數: 區塊={block_delay}s, 準備={prep_delay}s, 包間={packet_delay}s, 同步間隔={sync_interval}")
+        logger.info(f"⚙️ 延遲參數: 區塊={pacing.block_delay}s, 準備={pacing.prep_delay}s, 包間={pacing.packet_delay}s, 同步間隔={pacing.sync_interval}")
         
-        # 關鍵修復：確保數據類型與廠商一致
-        if isinstance(epd_display_buf, bytes):
-            epd_display_buf = list(epd_display_buf)
-            logger.info("⚠️ 轉換 bytes 為 list 格式以匹配廠商期待")
-        elif not isinstance(epd_display_buf, list):
-            logger.error("❌ 錯誤的數據類型，期待 list 或 bytes")
+        # 封包直接從 bytes / memoryview 畫面產生；廠商逐像素算法輸出的 list 先轉為 bytes
+        if isinstance(epd_display_buf, list):
+            epd_display_buf = bytes(epd_display_buf)
+        elif not isinstance(epd_display_buf, (bytes, bytearray, memoryview)):
+            logger.error("❌ 錯誤的數據類型，期待 list、bytes 或 bytearray")
             return False
 
-        total_pkg_in_block = (32000 // (DEF_MTU - 9 - 3)) + 1
-        totalPkg = total_pkg_in_block * 6
-        index_in_epd_buf = 0
-        currentPkg = 0
+        packetizer = Ph6Packetizer(self.mtu or negotiated_mtu(client))
+        total_pkg_in_block = packetizer.packets_per_block
+        totalPkg = packetizer.total_packets
+
+        logger.info(f"📊 傳輸參數: MTU={packetizer.mtu}, 總包數={totalPkg}, 每塊包數={total_pkg_in_block}")
 
-        logger.info(f"📊 傳輸參數: 總包數={totalPkg}, 每塊包數={total_pkg_in_block}")
+        # 傳輸前一次產生所有要傳送區塊的數據包（含 CRC），傳輸迴圈只負責寫出
+        metrics = self.metrics
+        metrics.labels["mtu"] = packetizer.mtu
+        with metrics.span("packetize"):
+            frame_packets = packetizer.packetize(epd_display_buf, blocks=[j for j in range(1, 7) if blocks is None or j in blocks])
+        logger.info(f"🧱 封包預先產生完成: {metrics.phases['packetize'] * 1000:.1f}ms")
+        # 傳輸迴圈內的除錯日誌只在啟用 DEBUG 時才格式化
+        debug = logger.isEnabledFor(logging.DEBUG)
 
         # Step1: 請求寫整面圖片指令
-        data_request = bytearray([0xFE, 0xEF, 0x09, 0x57, 0x01, side, 0xFF, 0xFF, 0xFF])
-        data_request[6] = totalPkg & 0xFF
-        data_request[7] = (totalPkg >> 8) & 0xFF
-        data_request[8] = self.calculate_crc(data_request[:8])
+        data_request = packetizer.request_packet(side)
         
+        ack_mode = self.flow_control == "ack"
+        partial = blocks is not None and not set(range(1, 7)) <= set(blocks)
+        if ack_mode or partial:
+            # 先訂閱通知再送出請求，避免錯過設備的第一個回應（只傳部分區塊時需要請求回應的旗標）
+            await self.start_notifications(client)
+        if ack_mode:
+            self.drain_notifications()
+
         logger.info(f"📤 發送初始請求: side={side}")
+        self.request_ack = None
         await self.ble_send_msg(client, data_request, response=False)
 
         # 等待初始回應
         if await self.waitting_for_reply(client, SEND_PIC_DATA_NO_RES, 1000):
             logger.info("✅ 初始請求確認成功")
 
-            # Step2: 發送圖片數據 - 分6個區塊
-            data_send_pkg = bytearray(DEF_MTU - 3)
-            data_send_pkg[0] = 0xFE
-            data_send_pkg[1] = 0xEF
-            data_send_pkg[3] = 0x57
-            data_send_pkg[4] = 0x02
-
-            # 分6個區塊傳輸
-            for j in range(1, 7):  
-                # 輸出區塊開始進度
-                block_start_progress = ((j - 1) / 6) * 100
-                print(f"PROGRESS|BLOCK_{j}_START|0/{total_pkg_in_block}|{block_start_progress:.1f}%")
-                logger.info(f"📦 開始傳輸區塊 {j}/6")
+            if partial and not await self.buffer_retained():
+                logger.warning("⚠️ 設備未保留緩衝區，改為整面傳送")
+                metrics.count("buffer_restarts")
+                self.restarted = True
+                blocks = None
+                with metrics.span("packetize"):
+                    frame_packets = packetizer.packetize(epd_display_buf)
+
+            # Step2: 發送圖片數據 - 分6個區塊（data_write 階段只涵蓋資料寫入，供吞吐量計算）
+            with metrics.data_span():
+                for j in range(1, 7):  
+                    if blocks is not None and j not in blocks:
+                        # 略過的區塊不產生封包，包序號由 packetizer 依區塊編號計算
+                        print(f"PROGRESS|BLOCK_{j}_SKIPPED|0/{total_pkg_in_block}|{(j / 6) * 100:.1f}%")
+                        logger.info(f"⏭️ 區塊 {j}/6 未變更，略過")
+                        continue
+
+                    # 輸出區塊開始進度
+                    block_start_progress = ((j - 1) / 6) * 100
+                    print(f"PROGRESS|BLOCK_{j}_START|0/{total_pkg_in_block}|{block_start_progress:.1f}%")
+                    logger.info(f"📦 開始傳輸區塊 {j}/6")
+                    block_started = time.perf_counter()
                 
-                # 關鍵修復：區塊開始前等待設備準備就緒
-                if j > 1:  # 第一個區塊不需要等待
-                    logger.info(f"⏳ 等待設備準備接收區塊 {j}...")
-                    await asyncio.sleep(prep_delay)
+                    # 關鍵修復：區塊開始前等待設備準備就緒
+                    if j > 1 and not ack_mode:  # 第一個區塊不需要等待；ACK 模式已由區塊ACK同步
+                        if debug:
+                            logger.debug(f"⏳ 等待設備準備接收區塊 {j}...")
+                        await asyncio.sleep(pacing.prep_delay)
                 
-                is_send_down = False
-                current_pkg_in_block = 0
+                    block_packets = frame_packets[j]
+                    current_pkg_in_block = 0
                 
-                while not is_send_down and self.ble_connect:
-                    self.ble_send_busy = True
+                    while current_pkg_in_block < total_pkg_in_block and self.ble_connect:
+                        self.ble_send_busy = True
+                        data_send_pkg = block_packets[current_pkg_in_block]
                     
-                    # 每個區塊的最後一包需要ACK確認
-                    if current_pkg_in_block == (total_pkg_in_block - 1):
-                        # 最後一個數據包
-                        data_size = 32000 - (current_pkg_in_block * (DEF_MTU - 9 - 3)) + 9
-                        data_send_pkg[2] = data_size
-                        data_send_pkg[5] = currentPkg & 0xFF
-                        data_send_pkg[6] = (currentPkg >> 8) & 0xFF
-                        data_send_pkg[7] = 0x01  # 需要確認
-
-                        # 複製數據並計算CRC
-                        data_send_pkg[8:8 + (data_size - 9)] = \
-                            epd_display_buf[index_in_epd_buf : index_in_epd_buf + (data_size - 9)]
-                        data_send_pkg[data_size - 1] = \
-                            self.calculate_crc(data_send_pkg[:data_size - 1])
-
-                        logger.info(f"📤 發送區塊 {j} 最後包 (需要ACK)")
-                        await self.ble_send_msg(client, data_send_pkg[:data_size], response=True)
-                        index_in_epd_buf += (data_size - 9)
-
-                        # 廠商的區塊ACK邏輯：不真正等待，但有關鍵的同步延遲
-                        if not await self.waitting_for_reply(client, SEND_PIC_DATA_BLOCK, 500):
-                            await self.close_connection(client)
-                            return False
-                        else:
-                            logger.info(f"✅ 區塊 {j} 上傳完成")
-                        
-                        is_send_down = True
+                        # 每個區塊的最後一包需要ACK確認
+                        if current_pkg_in_block == (total_pkg_in_block - 1):
+                            if debug:
+                                logger.debug(f"📤 發送區塊 {j} 最後包 (需要ACK)")
+                            self.drain_notifications()
+                            self.block_ack_seen = False
+                            block_ack_started = time.perf_counter()
+                            await self.ble_send_msg(client, data_send_pkg, response=True)
+
+                            # 廠商的區塊ACK邏輯：不真正等待，但有關鍵的同步延遲
+                            block_acked = await self.waitting_for_reply(client, SEND_PIC_DATA_BLOCK, 500)
+                            device_acked = block_acked
+                            if not ack_mode and pacing.needs_block_ack:
+                                # 自適應節奏需要設備實際的區塊 ACK 作為回饋；廠商流程照舊不因此中斷
+                                device_acked = await self.wait_block_ack(0.5)
+                                if not device_acked:
+                                    metrics.count("ack_timeouts")
+                            pacing.on_block(device_acked, time.perf_counter() - block_ack_started)
+                            if not block_acked:
+                                metrics.record_block(j, time.perf_counter() - block_started)
+                                await self.close_connection(client)
+                                return False
+                            else:
+                                if ack_mode:
+                                    self.confirmed_blocks.append(j)
+                                logger.info(f"✅ 區塊 {j} 上傳完成")
                         
-                        # 關鍵修復：區塊間必須有足夠延遲讓設備處理
-                        await asyncio.sleep(block_delay)
+                            # 關鍵修復：區塊間必須有足夠延遲讓設備處理
+                            if not ack_mode:
+                                await asyncio.sleep(pacing.block_delay)
                         
-                    else:
-                        # 常規數據包
-                        data_send_pkg[2] = DEF_MTU - 3
-                        data_send_pkg[5] = currentPkg & 0xFF
-                        data_send_pkg[6] = (currentPkg >> 8) & 0xFF
-                        data_send_pkg[7] = 0x00  # 不需要確認
-
-                        chunk_size = DEF_MTU - 3 - 9
-                        data_send_pkg[8:8 + chunk_size] = \
-                            epd_display_buf[index_in_epd_buf : index_in_epd_buf + chunk_size]
-                        data_send_pkg[DEF_MTU - 3 - 1] = \
-                            self.calculate_crc(data_send_pkg[:DEF_MTU - 3 - 1])
-
-                        # 完全按照廠商的response邏輯
-                        if side != 0:
-                            if side == 2 and j == 1 and current_pkg_in_block <= 5:
+                        else:
+                            # 常規數據包，完全按照廠商的response邏輯
+                            if ack_mode and (current_pkg_in_block + 1) % self.ack_window == 0:
+                                # 需回應的寫入完成時，之前所有不需回應的封包都已送達設備
                                 await self.ble_send_msg(client, data_send_pkg, response=True)
-                                # 等待回應
-                                await asyncio.sleep(0.01)
+                            elif side != 0:
+                                if side == 2 and j == 1 and current_pkg_in_block <= 5:
+                                    await self.ble_send_msg(client, data_send_pkg, response=True)
+                                    # 等待回應
+                                    await asyncio.sleep(0.01)
+                                else:
+                                    await self.ble_send_msg(client, data_send_pkg, response=False)
                             else:
                                 await self.ble_send_msg(client, data_send_pkg, response=False)
-                        else:
-                            await self.ble_send_msg(client, data_send_pkg, response=False)
 
-                        index_in_epd_buf += chunk_size
-
-                    await self.waitting_ble_busy()
-                    current_pkg_in_block += 1
-                    currentPkg += 1
+                        await self.waitting_ble_busy()
+                        current_pkg_in_block += 1
                     
-                    # 關鍵修復：包間延遲要與廠商行為一致
-                    # 廠商沒有包間延遲，但我們需要少量延遲避免設備溢出
-                    await asyncio.sleep(packet_delay)
+                        # 關鍵修復：包間延遲要與廠商行為一致
+                        # 廠商沒有包間延遲，但我們需要少量延遲避免設備溢出
+                        if not ack_mode:
+                            await asyncio.sleep(pacing.packet_delay)
                     
-                    # 在特定同步點添加額外延遲並回報進度
-                    if current_pkg_in_block % sync_interval == 0:  # 每sync_interval個包額外同步
-                        # 計算當前進度百分比
-                        block_progress = (current_pkg_in_block / total_pkg_in_block) * 100
-                        overall_progress = ((j - 1) / 6) * 100 + (block_progress / 6)
+                        # 在特定同步點添加額外延遲並回報進度
+                        if current_pkg_in_block % pacing.sync_interval == 0:  # 每sync_interval個包額外同步
+                            # 計算當前進度百分比
+                            block_progress = (current_pkg_in_block / total_pkg_in_block) * 100
+                            overall_progress = ((j - 1) / 6) * 100 + (block_progress / 6)
                         
-                        # 輸出結構化進度資訊
-                        print(f"PROGRESS|BLOCK_{j}|{current_pkg_in_block}/{total_pkg_in_block}|{overall_progress:.1f}%")
-                        logger.info(f"🔄 中間同步點: 區塊{j}, 包{current_pkg_in_block}/{total_pkg_in_block}, 總進度: {overall_progress:.1f}%")
-                        await asyncio.sleep(0.1)
+                            # 輸出結構化進度資訊
+                            print(f"PROGRESS|BLOCK_{j}|{current_pkg_in_block}/{total_pkg_in_block}|{overall_progress:.1f}%")
+                            if debug:
+                                logger.debug(f"🔄 中間同步點: 區塊{j}, 包{current_pkg_in_block}/{total_pkg_in_block}, 總進度: {overall_progress:.1f}%")
+                            if not ack_mode:
+                                await asyncio.sleep(pacing.sync_delay)
                 
-                # 區塊完成進度回報
-                block_complete_progress = (j / 6) * 100
-                print(f"PROGRESS|BLOCK_{j}_COMPLETE|{total_pkg_in_block}/{total_pkg_in_block}|{block_complete_progress:.1f}%")
-                logger.info(f"✅ 區塊 {j}/6 傳輸完成，總進度: {block_complete_progress:.1f}%")
+                    # 區塊完成進度回報
+                    metrics.record_block(j, time.perf_counter() - block_started)
+                    block_complete_progress = (j / 6) * 100
+                    print(f"PROGRESS|BLOCK_{j}_COMPLETE|{total_pkg_in_block}/{total_pkg_in_block}|{block_complete_progress:.1f}%")
+                    logger.info(f"✅ 區塊 {j}/6 傳輸完成，總進度: {block_complete_progress:.1f}%")
             
             logger.info("🎉 所有數據傳送完成！")
             
             # 關鍵修復：發送刷新顯示命令
             logger.info("📺 發送刷新顯示命令...")
-            refresh_cmd = bytearray([0xFE, 0xEF, 0x05, 0x57, 0x05, side, 0xFF])
-            refresh_cmd[6] = self.calculate_crc(refresh_cmd[:6])
+            refresh_cmd = packetizer.refresh_packet(side)
+            self.drain_notifications()
             await self.ble_send_msg(client, refresh_cmd, response=False)
             
             # 關鍵修復：等待設備完成顯示刷新
             logger.info("⏳ 等待設備完成顯示刷新...")
-            await asyncio.sleep(5.0)  # 極端等待：5秒讓設備完全完成刷新
+            with metrics.span("refresh_wait"):
+                if ack_mode:
+                    # 以設備的刷新通知判斷完成，最多等待 refresh_wait 秒
+                    if not await self.wait_for_ack(SEND_PIC_REFRESH, refresh_wait):
+                        metrics.count("ack_timeouts")
+                        logger.warning(f"⚠️ {refresh_wait}s 內未收到刷新完成通知")
+                else:
+                    await asyncio.sleep(refresh_wait)  # 極端等待：預設5秒讓設備完全完成刷新
             logger.info("✅ 設備刷新完成")
             
             return True
@@ -288,22 +476,39 @@ class BleClientFixed:
             return False
 
     async def ble_send_msg(self, client: BleakClient, data: bytes, response: bool):
+        started = time.perf_counter()
         await client.write_gatt_char(COMMAND_CHAR_UUID, data, response=response)
+        latency = time.perf_counter() - started
+        self.metrics.record_write(latency, len(data), response)
+        if self.pacing is not None:
+            self.pacing.on_write(latency, response)
+        self.packets_sent += 1
         self.ble_send_busy = False
 
     async def notification_handler(self, sender, data):
-        """完全採用廠商的 ACK 處理邏輯（有缺陷但設備期待的行為）"""
+        """完全採用廠商的 ACK 處理邏輯（有缺陷但設備期待的行為）；ACK 模式則交給 wait_for_ack 處理"""
         ack_data = bytes(data)
+        self.last_ack_data = ack_data
+        if len(ack_data) >= 6 and ack_data[4] == 0x01:
+            # 兩種模式都記錄請求回應，只傳部分區塊時據此確認設備仍保留緩衝區
+            self.request_ack = ack_data
+        if self.flow_control == "ack":
+            self.notifications.put_nowait(ack_data)
+            return
+
         if len(ack_data) >= 6 and ack_data[5] == 0x01:
             self.ack_event.set()
+            if ack_data[4] != 0x01 and self.ack_matches(SEND_PIC_DATA_BLOCK, ack_data):
+                self.block_ack_seen = True
             logger.info(f"📥 最後一個數據包ACK: {ack_data.hex()}")
-        else:
-            logger.info(f"📥 其他數據包ACK: {ack_data.hex()}")
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📥 其他數據包ACK: {ack_data.hex()}")
         # 廠商的關鍵錯誤：立即清除事件 - 但設備可能依賴這個時序
         self.ack_event.clear()
 
-    async def waitting_for_reply(self, client: BleakClient, expected_response: int, timeout: int) -> bool:
-        """採用廠商的簡化邏輯 - 只啟動通知但不真正等待"""
+    async def start_notifications(self, client: BleakClient):
+        if self.notify_client is client:
+            return
         try:
             # 啟動通知監聽（如果尚未啟動）
             await client.start_notify(ACK_CHAR_UUID, self.notification_handler)
@@ -312,6 +517,65 @@ class BleClientFixed:
                 pass  # 已經啟動，忽略
             else:
                 raise e
+        self.notify_client = client
+
+    async def stop_notifications(self, client: BleakClient):
+        self.notify_client = None
+        try:
+            await client.stop_notify(ACK_CHAR_UUID)
+        except Exception:
+            pass
+
+    async def wait_block_ack(self, timeout):
+        """廠商模式：等待本區塊旗標 0x01 的 ACK（旗標 0x00 的通知可能是其他數據包的回應，不算失敗）"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.block_ack_seen and loop.time() < deadline:
+            await asyncio.sleep(0.002)
+        return self.block_ack_seen
+
+    def drain_notifications(self):
+        """丟棄尚未處理的舊通知，確保之後等到的是本次請求的回應"""
+        while not self.notifications.empty():
+            self.notifications.get_nowait()
+
+    @staticmethod
+    def ack_matches(expected_response, ack_data):
+        """通知格式: FE EF len 57 <指令> <旗標> ...；旗標 0x01 表示區塊最後一包已確認"""
+        if expected_response == SEND_PIC_DATA_NO_RES:
+            return True
+        if len(ack_data) < 6:
+            return False
+        if expected_response == SEND_PIC_REFRESH:
+            return ack_data[4] == 0x05
+        return ack_data[5] == 0x01 and ack_data[4] != 0x05
+
+    async def wait_for_ack(self, expected_response: int, timeout: float) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                ack_data = await asyncio.wait_for(self.notifications.get(), remaining)
+            except asyncio.TimeoutError:
+                return False
+            if self.ack_matches(expected_response, ack_data):
+                return True
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📥 略過其他通知: {ack_data.hex()}")
+
+    async def waitting_for_reply(self, client: BleakClient, expected_response: int, timeout: int) -> bool:
+        """廠商模式只啟動通知但不真正等待；ACK 模式等待設備回應，timeout 單位為毫秒"""
+        await self.start_notifications(client)
+
+        if self.flow_control == "ack":
+            if await self.wait_for_ack(expected_response, timeout / 1000):
+                return True
+            self.metrics.count("ack_timeouts")
+            logger.error(f"❌ {timeout}ms 內未收到設備回應 (預期 {expected_response})")
+            return False
         
         # 廠商版本總是返回 True - 不等待實際ACK
         # 但加入短暫延遲確保通知系統就緒
@@ -326,59 +590,243 @@ class BleClientFixed:
         await client.disconnect()
         self.ble_connect = False
 
-async def cast_image_fixed(image_path, side=2, device_address=None, simulate=True, block_delay=0.001, prep_delay=0.001, packet_delay=0.001, sync_interval=5):
-    """修復版本的投圖函數 - 使用最佳優化參數配置"""
+def plan_incremental_blocks(frame_store, address, side, epd_data):
+    blocks = frame_store.plan_blocks(address, side, epd_data)
+    if blocks is None:
+        logger.info("📦 無可用的推送紀錄或全部區塊皆變更，改為整面上傳")
+    elif not blocks:
+        logger.info("✅ 畫面與設備上次推送相同，略過傳輸")
+    else:
+        logger.info(f"📦 差異上傳區塊: {blocks}")
+    return blocks
+
+async def cast_frame_to_device(epd_data, side, address, client_factory, block_delay=0.001, prep_delay=0.001, packet_delay=0.001, sync_interval=5, incremental=False, sync_delay=0.1, refresh_wait=5.0, flow_control="vendor", ack_window=8, adaptive=False, mtu=None, timings=None, metrics=None, resume_window=None, max_reconnects=3):
+    """連接設備並推送已轉換的畫面；傳輸失敗回傳 False，連線錯誤直接拋出例外
+
+    client_factory 接受設備地址並回傳可 async with 的 BleakClient 相容物件
+    （例如模擬設備，或 BleConnectionPool.connection 提供的保持連線 client）。
+    adaptive=True 時從該設備保存的節奏參數開始，傳輸中自動調整並於結束後保存。
+    epd_data 也可以是尚在轉換中的 asyncio.Future：先連線並訂閱通知，之後才等待轉換結果。
+    timings 為 dict 時寫入各階段耗時（秒）: connect、notify、wait_frame、transfer。
+    metrics 為 CastMetrics 時另外記錄寫入延遲、區塊耗時與吞吐量（此時 timings 即 metrics.phases）。
+    傳輸中連線中斷時，resume_window 秒內（預設 PH6_RESUME_WINDOW，0 表示停用）最多重新連線
+    max_reconnects 次，只補傳設備尚未確認的區塊；已確認的區塊另存檔，下次投同一畫面時也會略過。
+    續傳只在 flow_control="ack" 時啟用（廠商模式不等待區塊 ACK，無法確認哪些區塊已送達）。
+    """
+    if metrics is None:
+        metrics = CastMetrics(timings)
+    timings = metrics.phases
+    metrics.labels.update(address=address, side=side, flow_control=flow_control)
+    pending_frame = asyncio.isfuture(epd_data)
+    if resume_window is None:
+        resume_window = DEFAULT_RESUME_WINDOW
+
+    pacing = None
+    pacing_store = None
+    if adaptive:
+        pacing_store = PacingStore()
+        profile = pacing_store.load(address)
+        if profile:
+            pacing = AdaptivePacer.from_profile(profile)
+            logger.info(f"📈 使用已學習的節奏參數: {pacing.as_dict()}")
+        else:
+            pacing = AdaptivePacer(block_delay, prep_delay, packet_delay, sync_interval, sync_delay)
+
+    frame_store = DeviceFrameStore() if frame_cache_enabled() else None
+    # 只有 ACK 模式能確認哪些區塊設備已完整收到；廠商模式不續傳
+    checkpoints = TransferCheckpointStore() if resume_window > 0 and flow_control == "ack" else None
+    blocks = None
+    if incremental and frame_store is not None and not pending_frame:
+        blocks = plan_incremental_blocks(frame_store, address, side, epd_data)
+        if blocks == []:
+            return True
+
+    confirmed = None  # 設備已確認的區塊，取得畫面後才從檢查點載入
+    interrupted_at = None
+    reconnects = 0
+    phase_started = time.perf_counter()
+    try:
+        while True:
+            ble = BleClientFixed(flow_control, ack_window, mtu, metrics)
+            link_lost = False
+            try:
+                async with client_factory(address) as client:
+                    timings["reconnect" if reconnects else "connect"] = time.perf_counter() - phase_started
+                    ble.ble_connect = True
+                    
+                    logger.info("✅ 成功連接到真實設備")
+
+                    phase_started = time.perf_counter()
+                    await ble.start_notifications(client)
+                    timings["notify"] = time.perf_counter() - phase_started
+
+                    if pending_frame:
+                        phase_started = time.perf_counter()
+                        epd_data = await epd_data
+                        pending_frame = False
+                        timings["wait_frame"] = time.perf_counter() - phase_started
+                        if len(epd_data) != 192000:
+                            raise ValueError(f"無效圖像數據長度: {len(epd_data)}")
+                        if incremental and frame_store is not None:
+                            blocks = plan_incremental_blocks(frame_store, address, side, epd_data)
+                            if blocks == []:
+                                await ble.stop_notifications(client)
+                                return True
+
+                    if confirmed is None:
+                        confirmed = checkpoints.load(address, side, epd_data, resume_window) if checkpoints is not None else set()
+                    send_blocks = blocks
+                    skipped = confirmed.intersection(blocks or range(1, 7))
+                    if skipped:
+                        send_blocks = [j for j in (blocks or range(1, 7)) if j not in confirmed]
+                        metrics.count("resumed_blocks", len(skipped))
+                        logger.info(f"⏯️ 續傳中斷的投圖：略過設備已確認的區塊 {sorted(skipped)}")
+                    
+                    phase_started = time.perf_counter()
+                    try:
+                        success = await ble.send_image_to_ph6(client, epd_data, side, block_delay, prep_delay, packet_delay, sync_interval, blocks=send_blocks, sync_delay=sync_delay, refresh_wait=refresh_wait, pacing=pacing)
+                    except Exception:
+                        link_lost = not getattr(client, "is_connected", False)
+                        if pacing_store is not None:
+                            pacing.on_failure()
+                            pacing_store.save(address, pacing)
+                        raise
+                    finally:
+                        timings["transfer"] = timings.get("transfer", 0.0) + time.perf_counter() - phase_started
+                    metrics.success = success
+
+                    if pacing_store is not None:
+                        if not success:
+                            pacing.on_failure()
+                        pacing_store.save(address, pacing)
+                        logger.info(f"📈 保存節奏參數: {pacing.as_dict()}")
+                    
+                    if success:
+                        logger.info(f"🎉 真實設備投圖完成！共傳送 {ble.packets_sent} 包")
+                        if frame_store is not None:
+                            frame_store.save(address, side, epd_data)
+                        if checkpoints is not None:
+                            checkpoints.forget(address, side)
+                        # 連線可能被連線池保留重用，解除本次的通知處理函式
+                        await ble.stop_notifications(client)
+                    else:
+                        logger.error("❌ 真實設備投圖失敗")
+                        if frame_store is not None:
+                            frame_store.forget(address, side)
+                        save_checkpoint(checkpoints, address, side, epd_data, confirmed, ble)
+                    return success
+            except Exception as exc:
+                # 只有傳輸中斷線（或續傳時重新連線失敗）才續傳，其餘錯誤照舊拋出
+                if checkpoints is None or not (link_lost or interrupted_at is not None):
+                    raise
+                confirmed = save_checkpoint(checkpoints, address, side, epd_data, confirmed, ble)
+                if interrupted_at is None:
+                    interrupted_at = time.monotonic()
+                if reconnects >= max_reconnects or time.monotonic() - interrupted_at > resume_window:
+                    logger.error(f"❌ 重新連線 {reconnects} 次仍無法完成投圖，已確認區塊 {sorted(confirmed)} 保留供下次續傳")
+                    raise
+                reconnects += 1
+                metrics.count("reconnects")
+                delay = min(2.0, 0.25 * 2 ** (reconnects - 1))
+                logger.warning(f"🔌 傳輸中斷 ({exc})，{delay:.2f}s 後第 {reconnects} 次重新連線，已確認區塊 {sorted(confirmed)}")
+                await asyncio.sleep(delay)
+                phase_started = time.perf_counter()
+    finally:
+        if pending_frame:
+            # 連線失敗時不再需要轉換結果
+            epd_data.cancel()
+
+def save_checkpoint(checkpoints, address, side, epd_data, confirmed, ble):
+    """合併本次連線中設備確認的區塊並存檔，回傳目前已確認的區塊集合
+
+    設備未保留緩衝區而整面重傳時，先前確認的區塊已失效，只採用本次的確認。
+    """
+    confirmed = set(ble.confirmed_blocks) | (set() if ble.restarted or confirmed is None else confirmed)
+    if checkpoints is not None:
+        if confirmed:
+            checkpoints.save(address, side, epd_data, confirmed)
+        else:
+            checkpoints.forget(address, side)
+    return confirmed
+
+def load_e6_frame_timed(image_path, frame_cache, timings):
+    started = time.perf_counter()
+    frame = load_e6_frame(image_path, frame_cache, timings)
+    timings["convert"] = time.perf_counter() - started
+    return frame
+
+def report_phase_timings(timings):
+    """輸出各階段耗時；管線化時 overlap_saved 為轉換與連線重疊所省下的時間"""
+    sequential = sum(timings.get(k, 0.0) for k in ("convert", "connect", "notify"))
+    ready = timings.get("connect", 0.0) + timings.get("notify", 0.0) + timings.get("wait_frame", 0.0)
+    if "wait_frame" in timings:
+        timings["overlap_saved"] = max(0.0, sequential - ready)
+    rounded = {k: round(v, 3) for k, v in timings.items()}
+    print("TIMING|" + "|".join(f"{k}={v:.3f}" for k, v in rounded.items()))
+    logger.info(f"⏱️ 階段耗時: {rounded}")
+    return rounded
+
+async def cast_image_fixed(image_path, side=2, device_address=None, simulate=True, block_delay=0.001, prep_delay=0.001, packet_delay=0.001, sync_interval=5, incremental=False, flow_control="vendor", ack_window=8, adaptive=False, mtu=None, pipeline=True, client_factory=None, timings=None, metrics=None, resume_window=None):
+    """修復版本的投圖函數 - 使用最佳優化參數配置
+
+    incremental=True 時與該設備此面上次推送的畫面逐區塊比對，只傳送變更的區塊。
+    pipeline=True 時圖片在背景執行緒轉換，同時連線設備並訂閱通知。
+    metrics 為 CastMetrics 時記錄結構化指標（結束後由呼叫端 emit）。
+    resume_window 為斷線後從已確認區塊續傳的時間窗（秒，None 使用 PH6_RESUME_WINDOW）。
+    """
+    if metrics is None:
+        metrics = CastMetrics(timings)
+    timings = metrics.phases
+    started = time.perf_counter()
     try:
         logger.info(f"🚀 開始修復版本投圖: {image_path}")
         logger.info(f"⚙️ 使用最佳優化參數: 區塊={block_delay}s, 準備={prep_delay}s, 包間={packet_delay}s, 同步={sync_interval}")
         logger.info(f"🎯 配置說明: 極速1ms延遲 + 高頻率同步間隔")
         
-        # 轉換圖片
-        epd_data = convert_image_to_e6(image_path)
-        if len(epd_data) != 192000:
-            logger.error(f"❌ 無效圖像數據長度: {len(epd_data)}")
-            return False
-        
-        logger.info(f"✅ 圖片轉換完成: {len(epd_data)} 字節")
-        
-        if simulate or device_address is None:
-            # 模擬投圖（因為設備連接問題）
-            logger.info("🔄 模擬投圖傳輸過程...")
-            
-            # 模擬6個分塊的傳輸
-            for i in range(1, 7):
-                logger.info(f"📦 模擬傳輸區塊 {i}/6")
-                await asyncio.sleep(0.2)  # 模擬傳輸時間
-                
-                if i in [2, 4, 6]:  # 模擬某些區塊的ACK處理
-                    logger.info(f"✅ 區塊 {i} ACK 確認")
-                    await asyncio.sleep(0.05)
+        # 轉換圖片（優先使用畫面快取）
+        frame_cache = FrameCache() if frame_cache_enabled() else None
+        real_device = not simulate and device_address is not None
+        if pipeline and real_device:
+            logger.info("⚡ 管線化投圖：背景轉換圖片，同時連線設備")
+            epd_data = asyncio.get_running_loop().run_in_executor(None, load_e6_frame_timed, image_path, frame_cache, timings)
+        else:
+            epd_data = load_e6_frame_timed(image_path, frame_cache, timings)
+            if frame_cache is not None:
+                logger.info(f"📊 畫面快取統計: {frame_cache.stats()}")
+            if len(epd_data) != 192000:
+                logger.error(f"❌ 無效圖像數據長度: {len(epd_data)}")
+                return False
             
-            logger.info("🎉 模擬投圖完成！")
+            logger.info(f"✅ 圖片轉換完成: {len(epd_data)} 字節")
+        
+        if not real_device:
+            # 模擬投圖：以模擬設備跑完整協定，並比對設備重組後顯示的畫面
+            from ph6_simulator import EmulatedPh6Client
+
+            logger.info("🔄 模擬投圖：傳送到本機模擬設備...")
+            emulator = EmulatedPh6Client("SIMULATED")
+            if not await cast_frame_to_device(epd_data, side, "SIMULATED", lambda _address: emulator, block_delay, prep_delay, packet_delay, sync_interval, sync_delay=0, refresh_wait=SIMULATED_REFRESH_WAIT, flow_control=flow_control, ack_window=ack_window, mtu=mtu, metrics=metrics, resume_window=resume_window):
+                return False
+            if emulator.device.displays.get(side) != bytes(epd_data):
+                logger.error(f"❌ 模擬設備顯示的畫面與送出的畫面不一致: {emulator.device.stats}")
+                return False
+            logger.info(f"🎉 模擬投圖完成！設備統計: {emulator.device.stats}")
         else:
             # 真實設備連接
             logger.info(f"📡 開始連接真實設備: {device_address}")
             
-            from bleak import BleakClient
+            if client_factory is None:
+                from bleak import BleakClient
+                client_factory = BleakClient
             
             try:
                 # 使用傳入的device_address而不是hardcode的地址
                 actual_address = device_address if device_address else DEVICE_ADDRESS
                 logger.info(f"🎯 實際使用地址: {actual_address}")
-                async with BleakClient(actual_address) as client:
-                    ble = BleClientFixed()
-                    ble.ble_connect = True
-                    
-                    logger.info("✅ 成功連接到真實設備")
-                    
-                    # 執行真實投圖，傳遞延遲參數
-                    success = await ble.send_image_to_ph6(client, epd_data, side, block_delay, prep_delay, packet_delay, sync_interval)
-                    
-                    if success:
-                        logger.info("🎉 真實設備投圖完成！")
-                    else:
-                        logger.error("❌ 真實設備投圖失敗")
-                        return False
+
+                # 執行真實投圖，傳遞延遲參數
+                if not await cast_frame_to_device(epd_data, side, actual_address, client_factory, block_delay, prep_delay, packet_delay, sync_interval, incremental=incremental, flow_control=flow_control, ack_window=ack_window, adaptive=adaptive, mtu=mtu, metrics=metrics, resume_window=resume_window):
+                    return False
             except Exception as e:
                 logger.error(f"❌ 無法連接到真實設備: {e}")
                 logger.error("🚨 這將導致橫條紋問題！真實設備連接是必須的！")
@@ -394,21 +842,147 @@ async def cast_image_fixed(image_path, side=2, device_address=None, simulate=Tru
         logger.info("  • 最佳1ms包間延遲")
         logger.info(f"  • 高頻率{sync_interval}包同步間隔")
         
+        metrics.success = True
         return True
         
     except Exception as e:
         logger.error(f"❌ 投圖失敗: {e}")
         return False
+    finally:
+        if metrics.success is None:
+            metrics.success = False
+        timings["total"] = time.perf_counter() - started
+        report_phase_timings(timings)
+
+async def convert_after(previous, image_path, frame_cache, timings):
+    """等 previous 完成後才開始轉換，讓前一面的轉換獨佔 CPU，本面的轉換與前一面的傳輸重疊"""
+    await asyncio.wait([previous])
+    return await asyncio.get_running_loop().run_in_executor(None, load_e6_frame_timed, image_path, frame_cache, timings)
+
+async def cast_images_dual(images, device_address, client_factory=None, timings=None, metrics=None, **cast_options):
+    """以同一個連線依序投多面圖片（例如正反兩面）
+
+    images 為 [(side, 圖片路徑), ...]。第一面在連線時轉換，之後每一面在前一面
+    轉換完成後開始轉換（與前一面的傳輸重疊）；所有面共用一次連線與服務探索。
+    cast_options 會傳給 cast_frame_to_device（incremental、flow_control 等）。
+    回傳 {side: 是否成功}，前一面失敗時之後的面不再傳送。
+    metrics 為 dict 時填入 {side: CastMetrics}。
+    """
+    timings = {} if timings is None else timings
+    metrics = {} if metrics is None else metrics
+    if client_factory is None:
+        from bleak import BleakClient
+        client_factory = BleakClient
+
+    frame_cache = FrameCache() if frame_cache_enabled() else None
+    frames = []
+    previous = None
+    for side, image_path in images:
+        side_timings = timings.setdefault(side, {})
+        metrics[side] = CastMetrics(side_timings)
+        if previous is None:
+            frame = asyncio.get_running_loop().run_in_executor(None, load_e6_frame_timed, image_path, frame_cache, side_timings)
+        else:
+            frame = asyncio.ensure_future(convert_after(previous, image_path, frame_cache, side_timings))
+        frames.append((side, frame))
+        previous = frame
+
+    results = {side: False for side, _ in images}
+    started = time.perf_counter()
+    try:
+        async with client_factory(device_address) as client:
+            connect_time = time.perf_counter() - started
+            # 每一面沿用同一個已連線的 client；傳輸中斷線時由續傳流程以同一個 client 重新連線
+            @contextlib.asynccontextmanager
+            async def shared_client(_address):
+                if not client.is_connected:
+                    await client.connect()
+                yield client
+
+            for i, (side, frame) in enumerate(frames):
+                logger.info(f"📱 開始投第 {side} 面 ({i + 1}/{len(frames)})")
+                side_timings = timings[side]
+                results[side] = await cast_frame_to_device(frame, side, device_address, shared_client, metrics=metrics[side], **cast_options)
+                if i == 0:
+                    side_timings["connect"] = connect_time
+                if not results[side]:
+                    logger.error(f"❌ 第 {side} 面投圖失敗，停止後續傳送")
+                    break
+    finally:
+        for _, frame in frames:
+            frame.cancel()
+        timings["total"] = time.perf_counter() - started
+    return results
+
+def emit_metrics(metrics, json_path=None, prometheus_path=None):
+    """輸出 METRICS| 行，並可另存 JSON 紀錄與 Prometheus textfile"""
+    if metrics.success is None:
+        metrics.success = False
+    try:
+        metrics.emit(json_path)
+        if prometheus_path:
+            metrics.write_prometheus(prometheus_path)
+    except OSError as e:
+        logger.warning(f"⚠️ 無法寫入指標檔案: {e}")
+
+def side_path(path, side):
+    """兩面投圖時每面各自一個指標檔（metrics.prom -> metrics_side1.prom）"""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_side{side}{ext}"
+
+async def cast_both_sides(args):
+    """命令列 --other-image：兩面共用一次連線"""
+    images = [(args.side, args.image_path), (3 - args.side, args.other_image)]
+    timings = {}
+    metrics = {}
+    try:
+        results = await cast_images_dual(
+            images, args.device_address, timings=timings, metrics=metrics,
+            incremental=args.incremental, flow_control=args.flow_control,
+            ack_window=args.ack_window, adaptive=args.adaptive, mtu=args.mtu,
+            resume_window=args.resume_window,
+        )
+    except Exception as e:
+        logger.error(f"❌ 無法連接到真實設備: {e}")
+        return False
+    finally:
+        for side, _ in images:
+            if side in timings:
+                print(f"TIMING|side={side}|" + "|".join(f"{k}={v:.3f}" for k, v in timings[side].items()))
+            if side in metrics:
+                emit_metrics(metrics[side], side_path(args.metrics_json, side), side_path(args.prometheus_textfile, side))
+        if "total" in timings:
+            logger.info(f"⏱️ 兩面總耗時: {timings['total']:.3f}s")
+    return all(results.values())
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        usage="python3 cast_image_to_ph6_fixed.py <圖片路徑或 .epd 畫面> [side] [device_address] [--incremental] [--flow-control {vendor,ack}]",
+        epilog="範例: python3 cast_image_to_ph6_fixed.py solid_white_test.png 2 6A422DCC-2730-B0E8-E8B8-1C513A0D7B10",
+    )
+    parser.add_argument("image_path", help="圖片路徑；.epd 為已打包的 192000 位元組畫面，直接傳送不經轉換")
+    parser.add_argument("side", nargs="?", type=int, default=2, help="面板 (預設 2)")
+    parser.add_argument("device_address", nargs="?", default=None, help="設備地址；省略時為模擬模式")
+    parser.add_argument("--incremental", action="store_true", help="只傳送與上次推送相比有變更的區塊")
+    parser.add_argument("--flow-control", choices=("vendor", "ack"), default="vendor", help="vendor: 廠商固定延遲；ack: 等待設備ACK (預設 vendor)")
+    parser.add_argument("--ack-window", type=int, default=8, help="ACK 模式下每幾包使用需回應的寫入 (預設 8)")
+    parser.add_argument("--adaptive", action="store_true", help="依設備回應自動調整並記住延遲參數")
+    parser.add_argument("--other-image", help="同一次連線接著投另一面 (3 - side) 的圖片")
+    parser.add_argument("--no-pipeline", action="store_true", help="先完成圖片轉換再連線設備（關閉管線化）")
+    parser.add_argument("--metrics-json", help="將本次投圖的結構化指標寫入 JSON 檔")
+    parser.add_argument("--prometheus-textfile", help="將指標寫成 Prometheus textfile（例如 node_exporter 的 textfile 目錄下的 .prom 檔）")
+    parser.add_argument("--mtu", type=int, default=None, help=f"強制使用的 MTU（預設使用協商值，不低於 {DEF_MTU}）")
+    parser.add_argument("--resume-window", type=float, default=None, help="傳輸中斷線後在此秒數內重新連線續傳，0 表示停用 (預設 PH6_RESUME_WINDOW 或 30)")
+    return parser.parse_args(argv)
 
 def main():
-    if len(sys.argv) < 2:
-        print("使用方法: python3 cast_image_to_ph6_fixed.py <圖片路徑> [side] [device_address]")
-        print("範例: python3 cast_image_to_ph6_fixed.py solid_white_test.png 2 6A422DCC-2730-B0E8-E8B8-1C513A0D7B10")
-        sys.exit(1)
-    
-    image_path = sys.argv[1]
-    side = int(sys.argv[2]) if len(sys.argv) > 2 else 2
-    device_address = sys.argv[3] if len(sys.argv) > 3 else None
+    args = parse_args(sys.argv[1:])
+    configure_logging()
+    image_path = args.image_path
+    side = args.side
+    device_address = args.device_address
     
     # 如果有設備地址，使用真實設備；否則模擬
     simulate = device_address is None
@@ -421,9 +995,20 @@ def main():
     print(f"   📱 面板: {side}")
     print(f"   🔗 設備: {'真實設備 ' + device_address if device_address else '模擬模式'}")
     print(f"   ⚡ 最佳參數: 1ms延遲配置")
+    if args.incremental:
+        print(f"   🧩 差異上傳: 只傳送變更的區塊")
+    if args.other_image:
+        print(f"   📸 第 {3 - side} 面圖片: {args.other_image}（同一次連線）")
     
     # 執行修復版本投圖
-    success = asyncio.run(cast_image_fixed(image_path, side, device_address, simulate))
+    if args.other_image and not simulate:
+        success = asyncio.run(cast_both_sides(args))
+    elif args.other_image:
+        success = all(asyncio.run(cast_image_fixed(path, panel, None, True)) for panel, path in ((side, image_path), (3 - side, args.other_image)))
+    else:
+        metrics = CastMetrics(address=device_address, side=side)
+        success = asyncio.run(cast_image_fixed(image_path, side, device_address, simulate, incremental=args.incremental, flow_control=args.flow_control, ack_window=args.ack_window, adaptive=args.adaptive, mtu=args.mtu, pipeline=not args.no_pipeline, metrics=metrics, resume_window=args.resume_window))
+        emit_metrics(metrics, args.metrics_json, args.prometheus_textfile)
     
     if success:
         print("✅ 修復版本投圖成功!")
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""持久化投圖工作佇列：同一設備同一面只推送最新的畫面
+
+操作人員連續編輯同一張桌牌、或前一次群組部署尚未完成又再部署時，後端會對同一
+(address, side) 啟動多個重疊的投圖程序，彼此搶同一條 BLE 連線並推送已過時的畫面。
+本模組把投圖工作存入 SQLite（CACHE_DIR/cast_queue.sqlite3，多程序共用）:
+    合併   入列時同一 (address, side) 尚未開始的舊工作標記為 superseded，只保留最新一筆；
+           執行中的工作轉換完畫面後若已有更新的工作入列，也直接放棄不傳輸
+    序列化 同一設備（兩面共用一條連線）同時只執行一筆工作，不同設備依連線上限並行
+    指標   佇列深度、各設備待處理數、最久等待時間、等待時間與畫面轉換耗時直方圖
+           （--stats，可輸出 Prometheus textfile）
+
+工作狀態: pending → running → done | failed；被較新工作取代者為 superseded。
+
+使用方法:
+    python3 cast_queue.py <image> <address> [--side 2] [選項]   # 入列；沒有工作程序時由本程序執行到佇列清空
+    python3 cast_queue.py --worker [--simulate]                  # 常駐工作程序
+    python3 cast_queue.py --stats [--prometheus-textfile PATH]
+    python3 cast_queue.py --status JOB_ID
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from functools import partial
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，不檢查是否已有工作程序
+    fcntl = None
+
+import cast_image_to_ph6_fixed as cast
+from ble_adapters import parse_adapters
+from cast_batch import BatchCaster
+from e6_quantizer import CACHE_DIR
+from frame_cache import atomic_write
+from ph6_metrics import Histogram
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SUPERSEDED = "superseded"
+FINISHED_STATES = (DONE, FAILED, SUPERSEDED)
+
+# 等待時間直方圖上界（秒）
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# 畫面轉換耗時直方圖上界（秒）：預編譯包/快取命中約數毫秒，大圖解碼與量化約數秒
+CONVERT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_OPTIONS = ("incremental", "flow_control", "adaptive", "refresh_wait")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    address TEXT NOT NULL,
+    side INTEGER NOT NULL,
+    image TEXT NOT NULL,
+    options TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    first_enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    superseded_by INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, address, side);
+"""
+
+logger = cast.logger
+
+
+def default_queue_path():
+    return os.environ.get("PH6_CAST_QUEUE", os.path.join(CACHE_DIR, "cast_queue.sqlite3"))
+
+
+class CastJobQueue:
+    def __init__(self, db_path=None, clock=time.time):
+        self.db_path = db_path or default_queue_path()
+        self.clock = clock
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # isolation_level=None: 交易由 _transaction 以 BEGIN IMMEDIATE 明確控制，多個程序同時入列時依序取得寫入鎖
+        self._db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job.update(json.loads(job.pop("options")))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    def enqueue(self, image, address, side=2, **options):
+        """加入工作並取代同一 (address, side) 尚未開始的舊工作，回傳 (工作編號, 被取代的工作數)"""
+        address = address.upper()
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"未知的工作選項: {', '.join(sorted(unknown))}")
+        now = self.clock()
+        with self._transaction() as db:
+            older = db.execute(
+                "SELECT id, first_enqueued_at FROM jobs WHERE state = ? AND address = ? AND side = ?",
+                (PENDING, address, side),
+            ).fetchall()
+            # 被合併的工作從最早一次請求就開始等待，first_enqueued_at 沿用最早的時間
+            first = min([row["first_enqueued_at"] for row in older] + [now])
+            job_id = db.execute(
+                "INSERT INTO jobs (address, side, image, options, state, enqueued_at, first_enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (address, side, os.path.abspath(image), json.dumps(options), PENDING, now, first),
+            ).lastrowid
+            db.executemany(
+                "UPDATE jobs SET state = ?, superseded_by = ?, finished_at = ? WHERE id = ?",
+                [(SUPERSEDED, job_id, now, row["id"]) for row in older],
+            )
+        if older:
+            logger.info(f"🔀 {address} 第 {side} 面: 工作 #{job_id} 取代 {len(older)} 筆尚未開始的舊工作")
+        return job_id, len(older)
+
+    def claim(self):
+        """取出最早入列、且該設備沒有執行中工作的待處理工作；沒有可執行的工作時回傳 None"""
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE state = ? AND address NOT IN (SELECT address FROM jobs WHERE state = ?) ORDER BY id LIMIT 1",
+                (PENDING, RUNNING),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET state = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, self.clock(), row["id"]),
+            )
+        return self.get(row["id"])
+
+    def newer_job(self, job):
+        """同一 (address, side) 在此工作之後入列的待處理工作編號（沒有時回傳 None）"""
+        row = self._db.execute(
+            "SELECT MAX(id) FROM jobs WHERE state = ? AND address = ? AND side = ? AND id > ?",
+            (PENDING, job["address"], job["side"], job["id"]),
+        ).fetchone()
+        return row[0]
+
+    def supersede(self, job_id, newer_id):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = ?, superseded_by = ?, finished_at = ? WHERE id = ?",
+                (SUPERSEDED, newer_id, self.clock(), job_id),
+            )
+
+    def finish(self, job_id, result):
+        """以 BatchCaster 的結果 dict 結束工作"""
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, error = ?, result = ? WHERE id = ?",
+                (DONE if result["success"] else FAILED, self.clock(), result.get("error"), json.dumps(result, ensure_ascii=False), job_id),
+            )
+
+    def recover(self):
+        """工作程序啟動時呼叫：上次中斷時仍在執行的工作重新排入（已有更新的工作時直接取代），回傳處理筆數"""
+        with self._transaction() as db:
+            rows = db.execute("SELECT id, address, side FROM jobs WHERE state = ?", (RUNNING,)).fetchall()
+            for row in rows:
+                newer = db.execute(
+                    "SELECT MAX(id) FROM jobs WHERE state = ? AND address = ? AND side = ? AND id > ?",
+                    (PENDING, row["address"], row["side"], row["id"]),
+                ).fetchone()[0]
+                if newer is None:
+                    db.execute("UPDATE jobs SET state = ?, started_at = NULL WHERE id = ?", (PENDING, row["id"]))
+                else:
+                    db.execute(
+                        "UPDATE jobs SET state = ?, superseded_by = ?, finished_at = ? WHERE id = ?",
+                        (SUPERSEDED, newer, self.clock(), row["id"]),
+                    )
+        return len(rows)
+
+    def prune(self, max_age=7 * 24 * 3600):
+        """刪除結束超過 max_age 秒的工作紀錄"""
+        with self._transaction() as db:
+            return db.execute(
+                f"DELETE FROM jobs WHERE state IN ({','.join('?' * len(FINISHED_STATES))}) AND finished_at < ?",
+                FINISHED_STATES + (self.clock() - max_age,),
+            ).rowcount
+
+    def get(self, job_id):
+        return self._job(self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def depth(self):
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (PENDING,)).fetchone()[0]
+
+    def stats(self, window=3600.0):
+        """佇列深度與最近 window 秒內開始執行的工作等待時間、畫面轉換耗時"""
+        now = self.clock()
+        states = {state: 0 for state in (PENDING, RUNNING) + FINISHED_STATES}
+        states.update(dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()))
+        devices = {}
+        oldest = None
+        for row in self._db.execute("SELECT address, first_enqueued_at FROM jobs WHERE state = ?", (PENDING,)):
+            devices[row["address"]] = devices.get(row["address"], 0) + 1
+            oldest = row["first_enqueued_at"] if oldest is None else min(oldest, row["first_enqueued_at"])
+
+        wait = Histogram(WAIT_BUCKETS)
+        first_wait = Histogram(WAIT_BUCKETS)
+        convert = Histogram(CONVERT_BUCKETS)
+        for row in self._db.execute(
+            "SELECT started_at - enqueued_at, started_at - first_enqueued_at, result FROM jobs WHERE started_at >= ?",
+            (now - window,),
+        ):
+            wait.observe(max(0.0, row[0]))
+            first_wait.observe(max(0.0, row[1]))
+            seconds = json.loads(row[2]).get("convert_seconds") if row[2] else None
+            if seconds is not None:
+                convert.observe(seconds)
+
+        return {
+            "depth": states[PENDING],
+            "running": states[RUNNING],
+            "states": states,
+            "pending_by_device": devices,
+            "oldest_pending_seconds": round(now - oldest, 3) if oldest is not None else None,
+            "window_seconds": window,
+            "wait_seconds": wait.as_dict(),
+            "first_request_wait_seconds": first_wait.as_dict(),
+            "convert_seconds": convert.as_dict(),
+        }
+
+
+def prometheus_text(stats):
+    lines = [
+        "# HELP ph6_queue_depth Pending cast jobs.",
+        "# TYPE ph6_queue_depth gauge",
+        f"ph6_queue_depth {stats['depth']}",
+        "# TYPE ph6_queue_running gauge",
+        f"ph6_queue_running {stats['running']}",
+        "# TYPE ph6_queue_jobs gauge",
+    ]
+    lines += [f'ph6_queue_jobs{{state="{state}"}} {n}' for state, n in sorted(stats["states"].items())]
+    lines += ["# TYPE ph6_queue_device_depth gauge"]
+    lines += [f'ph6_queue_device_depth{{address="{a}"}} {n}' for a, n in sorted(stats["pending_by_device"].items())]
+    lines += [
+        "# TYPE ph6_queue_oldest_pending_seconds gauge",
+        f"ph6_queue_oldest_pending_seconds {stats['oldest_pending_seconds'] or 0:.3f}",
+    ]
+    for name, key in (
+        ("ph6_queue_wait_seconds", "wait_seconds"),
+        ("ph6_queue_first_request_wait_seconds", "first_request_wait_seconds"),
+        ("ph6_queue_convert_seconds", "convert_seconds"),
+    ):
+        histogram = stats[key]
+        lines += [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for upper, n in histogram["buckets"].items():
+            cumulative += n
+            lines.append(f'{name}_bucket{{le="{upper}"}} {cumulative}')
+        lines += [f"{name}_sum {histogram['sum']:.6f}", f"{name}_count {histogram['count']}"]
+    return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def worker_lock(db_path, blocking=False):
+    """同一佇列只允許一個工作程序；取得時 yield True，已有其他工作程序時 yield False"""
+    if fcntl is None:
+        yield True
+        return
+    with open(db_path + ".lock", "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class QueueWorker:
+    def __init__(self, queue, caster, max_parallel=None, poll_interval=0.5):
+        """caster: BatchCaster，提供連線池、重試與投圖參數；max_parallel 預設為連線池上限"""
+        self.queue = queue
+        self.caster = caster
+        self.max_parallel = max_parallel or caster.pool.max_connections
+        self.poll_interval = poll_interval
+        self.wakeup = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.running = set()
+        self.completed = 0
+
+    async def execute(self, job):
+        result = {"image": job["image"], "side": job["side"], "address": job["address"], "success": False, "attempts": 0, "error": None}
+        started = time.perf_counter()
+        wait = job["started_at"] - job["enqueued_at"]
+        logger.info(f"📤 工作 #{job['id']} {job['address']} 第 {job['side']} 面（等待 {wait:.2f}s）")
+        timings = {}
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                frame = await loop.run_in_executor(None, cast.load_e6_frame_timed, job["image"], self.caster.frame_cache, timings)
+            except Exception as e:
+                result["error"] = f"圖片轉換失敗: {e}"
+            else:
+                newer = self.queue.newer_job(job)
+                if newer is not None:
+                    # 轉換期間已有更新的畫面入列，這一張不必再傳
+                    logger.info(f"🔀 工作 #{job['id']} 已被 #{newer} 取代，略過傳輸")
+                    self.queue.supersede(job["id"], newer)
+                    return
+                await self.caster.deliver(frame, job, result)
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            result["wait_seconds"] = round(wait, 3)
+            if "convert" in timings:
+                # 與 BLE 傳輸分開計時，區分慢在畫面轉換還是傳輸
+                result["convert_seconds"] = round(timings["convert"], 3)
+            self.queue.finish(job["id"], result)
+            if result["success"]:
+                logger.info(f"✅ 工作 #{job['id']} 完成 ({result['seconds']}s)")
+            else:
+                logger.error(f"❌ 工作 #{job['id']} 失敗: {result['error']}")
+        finally:
+            self.completed += 1
+            self.wakeup.set()
+
+    def _start_ready_jobs(self):
+        while len(self.running) < self.max_parallel:
+            job = self.queue.claim()
+            if job is None:
+                return
+            task = asyncio.create_task(self.execute(job))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def run(self, drain=False):
+        """drain=True 時佇列清空且沒有執行中工作即結束，否則執行到 stopping 被設定"""
+        recovered = self.queue.recover()
+        if recovered:
+            logger.warning(f"⚠️ 重新排入 {recovered} 筆上次中斷的工作")
+        self.queue.prune()
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            self._start_ready_jobs()
+            if drain and not self.running and self.queue.depth() == 0:
+                break
+            # 其他程序入列時不會通知本程序，以輪詢間隔上限檢查新工作
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+        if self.running:
+            await asyncio.gather(*self.running)
+
+
+async def run_until_drained(queue, caster):
+    """沒有其他工作程序時執行佇列直到清空；釋放鎖後再檢查一次，避免與剛入列的程序互相以為對方會處理"""
+    while True:
+        with worker_lock(queue.db_path) as acquired:
+            if not acquired:
+                return False
+            await QueueWorker(queue, caster).run(drain=True)
+        if queue.depth() == 0:
+            return True
+
+
+async def wait_for_job(queue, job_id, poll_interval=0.5, stopping=None):
+    """等待工作結束；stopping 被設定時不再等待尚未開始的工作（留在佇列中，下次啟動再執行）"""
+    while True:
+        job = queue.get(job_id)
+        if job["state"] in FINISHED_STATES or (stopping is not None and stopping.is_set() and job["state"] == PENDING):
+            return job
+        await asyncio.sleep(poll_interval)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(usage="python3 cast_queue.py <image> <address> [--side 2] [選項] | --worker | --stats | --status ID")
+    parser.add_argument("image", nargs="?", help="要投送的圖片")
+    parser.add_argument("address", nargs="?", help="設備地址")
+    parser.add_argument("--side", type=int, choices=(1, 2), default=2, help="桌牌面 (預設 2)")
+    parser.add_argument("--queue", default=None, help=f"佇列資料庫路徑 (預設 {default_queue_path()})")
+    parser.add_argument("--worker", action="store_true", help="以常駐工作程序執行佇列")
+    parser.add_argument("--no-wait", action="store_true", help="只入列，不等待結果（需另有 --worker 執行中）")
+    parser.add_argument("--stats", action="store_true", help="輸出佇列深度、等待時間與畫面轉換耗時指標")
+    parser.add_argument("--status", type=int, help="查詢工作狀態")
+    parser.add_argument("--prometheus-textfile", help="--stats 時另寫出 Prometheus textfile")
+    parser.add_argument("--max-connections", type=int, default=4, help="同時投圖的設備數上限 (預設 4)")
+    parser.add_argument("--retries", type=int, default=2, help="失敗時的重試次數 (預設 2)")
+    parser.add_argument("--incremental", action="store_true", help="只傳送變更的區塊")
+    parser.add_argument("--flow-control", choices=("vendor", "ack"), default="vendor", help="vendor: 廠商固定延遲；ack: 等待設備ACK (預設 vendor)")
+    parser.add_argument("--adaptive", action="store_true", help="依設備回應自動調整並記住延遲參數")
+    parser.add_argument("--refresh-wait", type=float, default=5.0, help="刷新後等待秒數 (預設 5.0)")
+    parser.add_argument("--adapters", default=None, help="以逗號分隔的藍牙介面卡，例如 hci0,hci1 (預設 PH6_BLE_ADAPTERS)")
+    parser.add_argument("--simulate", action="store_true", help="使用模擬設備，不需實體桌牌")
+    args = parser.parse_args(argv)
+    if not (args.worker or args.stats or args.status is not None) and not (args.image and args.address):
+        parser.error("需要 <image> <address>，或指定 --worker / --stats / --status")
+    return args
+
+
+def make_caster(args):
+    if args.simulate:
+        from ph6_simulator import FakeBleakClient
+        client_factory = partial(FakeBleakClient, connect_latency=0.1)
+    else:
+        from bleak import BleakClient
+        client_factory = BleakClient
+    return BatchCaster(
+        client_factory, max_connections=args.max_connections, retries=args.retries,
+        refresh_wait=args.refresh_wait, adapters=parse_adapters(args.adapters),
+    )
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    cast.configure_logging()
+    queue = CastJobQueue(args.queue)
+
+    if args.stats:
+        stats = queue.stats()
+        if args.prometheus_textfile:
+            atomic_write(os.path.abspath(args.prometheus_textfile), prometheus_text(stats).encode())
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return
+    if args.status is not None:
+        job = queue.get(args.status)
+        print(json.dumps(job or {"error": f"找不到工作: {args.status}"}, ensure_ascii=False, indent=2))
+        sys.exit(0 if job else 1)
+
+    if args.worker:
+        with worker_lock(queue.db_path) as acquired:
+            if not acquired:
+                print(json.dumps({"error": "已有其他工作程序在執行此佇列"}, ensure_ascii=False))
+                sys.exit(1)
+            # PROGRESS 行改寫到 stderr
+            with contextlib.redirect_stdout(sys.stderr):
+                asyncio.run(QueueWorker(queue, make_caster(args)).run())
+        return
+
+    options = {"incremental": args.incremental, "flow_control": args.flow_control, "adaptive": args.adaptive, "refresh_wait": args.refresh_wait}
+    job_id, superseded = queue.enqueue(args.image, args.address, args.side, **options)
+    if args.no_wait:
+        print(json.dumps({"id": job_id, "superseded": superseded, "depth": queue.depth()}, ensure_ascii=False))
+        return
+
+    async def submit():
+        if not await run_until_drained(queue, make_caster(args)):
+            logger.info(f"⏳ 已有工作程序在執行佇列，等待工作 #{job_id}")
+        return await wait_for_job(queue, job_id)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        job = asyncio.run(submit())
+    print(json.dumps(job, ensure_ascii=False, indent=2))
+    # 被較新的畫面取代不算失敗：設備最後會顯示較新的畫面
+    sys.exit(1 if job["state"] == FAILED else 0)
+
+
+if __name__ == "__main__":
+    main()
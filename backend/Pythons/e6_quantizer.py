@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""E6 六色電子紙的批次量化引擎
+
+以陣列運算一次計算整張 800x480 畫面的最近色索引，
+取代 convert_image_to_e6 中逐像素 getpixel + find_nearest_color 的迴圈。
+輸出與廠商逐像素算法逐位元相同（可用 --verify 驗證）。
+
+量化透過預先計算的 256³ RGB -> 設備顏色索引查找表完成，查找表每個
+程序只建立一次，並以記憶體映射方式從磁碟快取載入（可用 --verify-lut 驗證）。
+已是 800x480 的調色盤 (P) 或灰階 (L) 圖片每個像素只有 256 種可能，改以
+256 項的像素值 -> 設備顏色索引表直接對應，不需轉 RGB、不需 numpy。
+"""
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+
+np = None  # 由 numpy_available() 第一次呼叫時載入；沒有 numpy 時由呼叫端退回廠商逐像素算法
+_numpy_checked = False
+
+EPD_WIDTH = 800
+EPD_HEIGHT = 480
+EPD_BUF_SIZE = EPD_WIDTH * EPD_HEIGHT // 2  # 每個位元組存放兩個 4-bit 像素
+
+# 調色盤順序必須與廠商算法一致（平手時取較前面的顏色）
+E6_COLORS = (
+    (0, 0, 0),        # black
+    (255, 255, 255),  # white
+    (0, 255, 0),      # green
+    (0, 0, 255),      # blue
+    (255, 0, 0),      # red
+    (255, 255, 0),    # yellow
+)
+
+# 廠商映射：調色盤索引 -> 設備顏色索引
+VENDOR_INDEX_MAP = (0, 1, 6, 5, 3, 2)
+
+# 像素值本身即可決定顏色的模式，可用 256 項表直接對應
+INDEXED_MODES = ("P", "L")
+
+# 調色盤版本：調色盤或廠商映射變動時自動使快取失效
+PALETTE_VERSION = hashlib.sha1(repr((E6_COLORS, VENDOR_INDEX_MAP)).encode()).hexdigest()[:12]
+
+CACHE_DIR = os.environ.get(
+    "PH6_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+
+logger = logging.getLogger(__name__)
+
+_lut = None
+
+
+def numpy_available():
+    """第一次呼叫時才匯入 numpy，掃描、ping 等只需要常數的路徑不必付出匯入成本"""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+        # 載入完成後才標記，轉換執行緒同時呼叫時不會誤判為沒有 numpy
+        _numpy_checked = True
+    return np is not None
+
+
+def _require_numpy():
+    if not numpy_available():
+        raise RuntimeError("需要安裝 numpy")
+
+
+def quantize_rgb_array(rgb):
+    """將 (H, W, 3) uint8 陣列量化為設備顏色索引 (H, W) uint8
+
+    使用整數平方距離取代 math.sqrt：sqrt 單調遞增，且在 0..3*255² 範圍內
+    不同整數的平方根不會相等，因此 argmin（取第一個最小值）與廠商的
+    嚴格小於比較完全一致。
+    """
+    _require_numpy()
+    palette = np.asarray(E6_COLORS, dtype=np.int32)
+    vendor_lut = np.asarray(VENDOR_INDEX_MAP, dtype=np.uint8)
+
+    pixels = np.asarray(rgb, dtype=np.int32)
+    diff = pixels[..., np.newaxis, :] - palette  # (H, W, 6, 3)
+    distances = np.einsum("...ij,...ij->...i", diff, diff)
+    nearest = np.argmin(distances, axis=-1)
+    return vendor_lut[nearest]
+
+
+def pack_e6_indices(indices):
+    """將設備顏色索引打包成每位元組兩個像素（偶數 x 在高 4 位元）"""
+    _require_numpy()
+    flat = np.ascontiguousarray(indices, dtype=np.uint8).reshape(-1)
+    packed = (flat[0::2] << 4) | flat[1::2]
+    return bytearray(packed.tobytes())
+
+
+def build_e6_lut():
+    """建立 256³ 查找表，索引為 (r << 16) | (g << 8) | b"""
+    _require_numpy()
+    lut = np.empty(256 ** 3, dtype=np.uint8)
+    levels = np.arange(256, dtype=np.uint8)
+    plane = np.empty((256, 256, 3), dtype=np.uint8)
+    plane[..., 1] = levels[:, np.newaxis]
+    plane[..., 2] = levels[np.newaxis, :]
+
+    for r in range(256):
+        plane[..., 0] = r
+        lut[r << 16:(r + 1) << 16] = quantize_rgb_array(plane).reshape(-1)
+    return lut
+
+
+def lut_cache_path():
+    return os.path.join(CACHE_DIR, f"e6_lut_{PALETTE_VERSION}.npy")
+
+
+def load_e6_lut():
+    """取得本程序共用的查找表；優先記憶體映射磁碟快取，不存在時建立並原子寫入"""
+    global _lut
+    _require_numpy()
+    if _lut is not None:
+        return _lut
+
+    path = lut_cache_path()
+    try:
+        # 驗證通過才設定 _lut，其他轉換執行緒不會拿到格式不符的查找表
+        cached = np.load(path, mmap_mode="r")
+        if cached.shape != (256 ** 3,) or cached.dtype != np.uint8:
+            raise ValueError(f"查找表格式不符: {cached.shape} {cached.dtype}")
+        _lut = cached
+        return _lut
+    except (OSError, ValueError) as e:
+        if os.path.exists(path):
+            logger.warning(f"⚠️ 查找表快取無效，重新建立: {e}")
+
+    lut = build_e6_lut()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, lut)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        _lut = np.load(path, mmap_mode="r")
+    except OSError as e:
+        logger.warning(f"⚠️ 無法寫入查找表快取，改用記憶體內查找表: {e}")
+        _lut = lut
+    return _lut
+
+
+def quantize_image_to_e6(rgb_image):
+    """將已調整為 800x480 的 RGB PIL 圖片轉換為 192000 位元組的 EPD 緩衝區"""
+    _require_numpy()
+    rgb = np.asarray(rgb_image, dtype=np.uint8)
+    if rgb.shape != (EPD_HEIGHT, EPD_WIDTH, 3):
+        raise ValueError(f"圖片尺寸必須為 {EPD_WIDTH}x{EPD_HEIGHT} RGB，實際為 {rgb.shape}")
+
+    keys = (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+    return pack_e6_indices(load_e6_lut()[keys])
+
+
+def nearest_vendor_index(rgb):
+    """單一顏色的設備顏色索引，與 find_nearest_color 相同（整數平方距離，平手取較前面的顏色）"""
+    r, g, b = rgb
+    distances = [(r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2 for pr, pg, pb in E6_COLORS]
+    return VENDOR_INDEX_MAP[distances.index(min(distances))]
+
+
+def indexed_color_table(image):
+    """P / L 模式圖片的 256 項 像素值 -> 設備顏色索引 表（bytes）；其他模式回傳 None
+
+    調色盤不足 256 色時與 PIL 的 convert("RGB") 一樣，未定義的索引視為黑色。
+    """
+    if image.mode == "L":
+        colors = [(v, v, v) for v in range(256)]
+    elif image.mode == "P":
+        palette = list(image.getpalette() or [])[:768]
+        palette += [0] * (768 - len(palette))
+        colors = [tuple(palette[i:i + 3]) for i in range(0, 768, 3)]
+    else:
+        return None
+    return bytes(nearest_vendor_index(color) for color in colors)
+
+
+def quantize_indexed_image(image):
+    """將 800x480 的 P / L 模式圖片直接查表轉為 192000 位元組的 EPD 緩衝區
+
+    輸出與 convert("RGB") 後量化逐位元相同。偶數 x 的像素以高 4 位元表、奇數 x 以
+    低 4 位元表各自 translate，再以整數 OR 合併成每位元組兩個像素。
+    """
+    if image.size != (EPD_WIDTH, EPD_HEIGHT):
+        raise ValueError(f"圖片尺寸必須為 {EPD_WIDTH}x{EPD_HEIGHT}，實際為 {image.size}")
+    table = indexed_color_table(image)
+    if table is None:
+        raise ValueError(f"不支援的圖片模式: {image.mode}")
+
+    pixels = image.tobytes()
+    high = pixels[0::2].translate(bytes(v << 4 for v in table))
+    low = pixels[1::2].translate(table)
+    packed = int.from_bytes(high, "big") | int.from_bytes(low, "big")
+    return bytearray(packed.to_bytes(EPD_BUF_SIZE, "big"))
+
+
+def _verification_corpus():
+    """產生驗證用的合成圖片（涵蓋純色、漸層、雜訊、平手色與需縮放的尺寸）"""
+    _require_numpy()
+    from PIL import Image
+
+    rng = np.random.default_rng(20250611)
+    corpus = []
+
+    for color in E6_COLORS:
+        corpus.append((f"solid_{color}", Image.new("RGB", (EPD_WIDTH, EPD_HEIGHT), color)))
+
+    x = np.linspace(0, 255, EPD_WIDTH, dtype=np.float64)
+    y = np.linspace(0, 255, EPD_HEIGHT, dtype=np.float64)
+    gradient = np.zeros((EPD_HEIGHT, EPD_WIDTH, 3), dtype=np.uint8)
+    gradient[..., 0] = x[np.newaxis, :].astype(np.uint8)
+    gradient[..., 1] = y[:, np.newaxis].astype(np.uint8)
+    gradient[..., 2] = (255 - x[np.newaxis, :]).astype(np.uint8)
+    corpus.append(("gradient", Image.fromarray(gradient, "RGB")))
+
+    noise = rng.integers(0, 256, size=(EPD_HEIGHT, EPD_WIDTH, 3), dtype=np.uint8)
+    corpus.append(("noise", Image.fromarray(noise, "RGB")))
+
+    # 綠/藍 (g == b) 與 紅/綠 (r == g) 的等距平手像素
+    ties = rng.integers(0, 256, size=(EPD_HEIGHT, EPD_WIDTH, 3), dtype=np.uint8)
+    ties[: EPD_HEIGHT // 2, :, 2] = ties[: EPD_HEIGHT // 2, :, 1]
+    ties[EPD_HEIGHT // 2:, :, 1] = ties[EPD_HEIGHT // 2:, :, 0]
+    corpus.append(("ties", Image.fromarray(ties, "RGB")))
+
+    oversized = rng.integers(0, 256, size=(768, 1024, 3), dtype=np.uint8)
+    corpus.append(("oversized_noise", Image.fromarray(oversized, "RGB")))
+
+    # 調色盤與灰階圖片：E6 調色盤、任意 256 色調色盤、不足 256 色的調色盤
+    e6_palette = Image.new("P", (EPD_WIDTH, EPD_HEIGHT))
+    e6_palette.putpalette([c for color in E6_COLORS for c in color])
+    e6_palette.frombytes(rng.integers(0, len(E6_COLORS), size=EPD_WIDTH * EPD_HEIGHT, dtype=np.uint8).tobytes())
+    corpus.append(("palette_e6", e6_palette))
+    random_palette = Image.new("P", (EPD_WIDTH, EPD_HEIGHT))
+    random_palette.putpalette(rng.integers(0, 256, size=768, dtype=np.uint8).tolist())
+    random_palette.frombytes(rng.integers(0, 256, size=EPD_WIDTH * EPD_HEIGHT, dtype=np.uint8).tobytes())
+    corpus.append(("palette_random", random_palette))
+    short_palette = random_palette.copy()
+    short_palette.putpalette(rng.integers(0, 256, size=48, dtype=np.uint8).tolist())
+    corpus.append(("palette_short", short_palette))
+    corpus.append(("grayscale", Image.fromarray(noise[..., 0], "L")))
+
+    return corpus
+
+
+def verify_against_reference(image_paths=()):
+    """以廠商逐像素算法驗證向量化輸出逐位元相同，回傳是否全部通過"""
+    from PIL import Image
+    import cast_image_to_ph6_fixed as cast
+
+    samples = _verification_corpus()
+    for path in image_paths:
+        samples.append((path, Image.open(path)))
+
+    all_passed = True
+    for name, image in samples:
+        rgb_image = cast.prepare_e6_rgb_image(image)
+        expected = bytes(cast.convert_rgb_image_to_e6_reference(rgb_image))
+        actual = bytes(quantize_image_to_e6(rgb_image))
+        passed = expected == actual
+        path = "vectorized"
+        if passed and image.mode in INDEXED_MODES and image.size == (EPD_WIDTH, EPD_HEIGHT):
+            passed = bytes(quantize_indexed_image(image)) == expected
+            path = "indexed"
+        all_passed = all_passed and passed
+        print(f"{'✅' if passed else '❌'} {name}: {len(actual)} bytes ({path})")
+
+    return verify_conversion_pipeline() and all_passed
+
+
+# 解碼時縮小的 JPEG 與廠商完整解碼流程之間容許的像素差異比例
+DRAFT_PIXEL_TOLERANCE = 0.05
+
+
+def _pixel_differences(a, b):
+    """兩個打包畫面中顏色索引不同的像素數"""
+    return sum((x >> 4 != y >> 4) + (x & 0x0F != y & 0x0F) for x, y in zip(a, b) if x != y)
+
+
+def verify_conversion_pipeline():
+    """以實際投圖流程 convert_image_to_e6（含解碼上限、draft 與縮放）驗證編碼後的大尺寸圖片
+
+    PNG/BMP 必須與廠商流程逐位元相同；JPEG 於解碼時縮小，須與相同解碼與 REDUCING_GAP
+    的逐像素算法逐位元相同，且與廠商完整解碼流程的像素差異不超過 DRAFT_PIXEL_TOLERANCE。
+    """
+    _require_numpy()
+    import io
+
+    from PIL import Image, ImageFilter
+    import cast_image_to_ph6_fixed as cast
+
+    rng = np.random.default_rng(20250611)
+    # 4 倍於畫面尺寸：若誤用 REDUCING_GAP 會先以 reduce 縮小，輸出即與廠商流程不同
+    noise = Image.fromarray(rng.integers(0, 256, size=(1920, 3200, 3), dtype=np.uint8), "RGB")
+    small = Image.fromarray(rng.integers(0, 256, size=(120, 200, 3), dtype=np.uint8), "RGB")
+    photo = small.filter(ImageFilter.GaussianBlur(2)).resize((2000, 1200), Image.Resampling.BICUBIC)
+
+    def encode(image, fmt):
+        buf = io.BytesIO()
+        image.save(buf, fmt)
+        return buf.getvalue()
+
+    def vendor(data):
+        return bytes(cast.convert_rgb_image_to_e6_reference(cast.prepare_e6_rgb_image(Image.open(io.BytesIO(data)))))
+
+    all_passed = True
+    for fmt in ("PNG", "BMP"):
+        data = encode(noise, fmt)
+        passed = bytes(cast.convert_image_to_e6(io.BytesIO(data))) == vendor(data)
+        all_passed = all_passed and passed
+        print(f"{'✅' if passed else '❌'} oversized_{fmt.lower()}: 3200x1920 (convert_image_to_e6 與廠商流程逐位元相同)")
+
+    data = encode(photo, "JPEG")
+    actual = bytes(cast.convert_image_to_e6(io.BytesIO(data)))
+    image, reduced = cast.open_bounded_image(io.BytesIO(data))
+    expected = bytes(cast.convert_rgb_image_to_e6_reference(cast.prepare_e6_rgb_image(image, cast.REDUCING_GAP)))
+    ratio = _pixel_differences(actual, vendor(data)) / (EPD_WIDTH * EPD_HEIGHT)
+    passed = reduced and actual == expected and ratio <= DRAFT_PIXEL_TOLERANCE
+    all_passed = all_passed and passed
+    print(f"{'✅' if passed else '❌'} oversized_jpeg: 2000x1200 解碼縮小為 {image.size[0]}x{image.size[1]}，"
+          f"與廠商完整解碼差異 {ratio:.2%}（上限 {DRAFT_PIXEL_TOLERANCE:.0%}）")
+    return all_passed
+
+
+def verify_lut(samples=100000):
+    """驗證查找表與 find_nearest_color 的歐氏距離及平手規則完全一致
+
+    全表以浮點 sqrt 距離重新計算（argmin 取第一個最小值，等同廠商的嚴格小於比較），
+    另隨機抽樣以 find_nearest_color 本身逐一比對。
+    """
+    _require_numpy()
+    import cast_image_to_ph6_fixed as cast
+
+    lut = load_e6_lut()
+    palette = np.asarray(E6_COLORS, dtype=np.float64)
+    vendor_lut = np.asarray(VENDOR_INDEX_MAP, dtype=np.uint8)
+    levels = np.arange(256, dtype=np.float64)
+    gb = np.stack(np.meshgrid(levels, levels, indexing="ij"), axis=-1).reshape(-1, 2)
+
+    mismatches = 0
+    for r in range(256):
+        pixels = np.column_stack([np.full(len(gb), r, dtype=np.float64), gb])
+        distances = np.sqrt(((pixels[:, np.newaxis, :] - palette) ** 2).sum(axis=-1))
+        expected = vendor_lut[np.argmin(distances, axis=-1)]
+        mismatches += int(np.count_nonzero(lut[r << 16:(r + 1) << 16] != expected))
+    print(f"{'✅' if mismatches == 0 else '❌'} 全表浮點距離比對: {mismatches} 個不一致")
+
+    rng = np.random.default_rng(20250611)
+    colors = list(E6_COLORS)
+    sample_mismatches = 0
+    for key in rng.integers(0, 256 ** 3, size=samples):
+        key = int(key)
+        rgb = ((key >> 16) & 0xFF, (key >> 8) & 0xFF, key & 0xFF)
+        if cast.find_nearest_color(rgb, colors) != lut[key]:
+            sample_mismatches += 1
+    print(f"{'✅' if sample_mismatches == 0 else '❌'} find_nearest_color 抽樣比對 ({samples} 筆): {sample_mismatches} 個不一致")
+
+    return mismatches == 0 and sample_mismatches == 0
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("--verify", "--verify-lut"):
+        print("使用方法: python3 e6_quantizer.py --verify [圖片路徑 ...]")
+        print("          python3 e6_quantizer.py --verify-lut")
+        sys.exit(1)
+
+    if not numpy_available():
+        print("❌ 需要安裝 numpy 才能驗證向量化量化器")
+        sys.exit(1)
+
+    if sys.argv[1] == "--verify-lut":
+        sys.exit(0 if verify_lut() else 1)
+    sys.exit(0 if verify_against_reference(sys.argv[2:]) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""已打包 EPD 畫面的內容定址磁碟快取
+
+以來源圖片位元組、縮放模式與調色盤版本的雜湊為鍵，保存 192000 位元組的
+打包畫面。寫入採暫存檔 + os.replace 原子替換，多個由 BluetoothController
+啟動的 python3 程序可安全共用；超過容量上限時依最後使用時間 (mtime) 淘汰。
+
+DeviceFrameStore 另外記錄每個設備地址與面最後成功推送的畫面，供差異
+（dirty-block）上傳只傳送變更的區塊；TransferCheckpointStore 記錄中斷傳輸
+已確認的區塊，重新連線後從中斷處續傳。
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，統計計數改為不加鎖
+    fcntl = None
+
+from e6_quantizer import CACHE_DIR, EPD_BUF_SIZE, PALETTE_VERSION
+
+DEFAULT_MAX_BYTES = int(os.environ.get("PH6_FRAME_CACHE_MAX_MB", "128")) * 1024 * 1024
+FRAME_SUFFIX = ".epd"
+# 畫面鍵中的縮放流程名稱：縮放方式改變（例如解碼時先縮小）時舊的畫面不再命中
+RESIZE_MODE = "LANCZOS-draft"
+
+# 設備端一面畫面分 6 個 32000 位元組區塊傳輸
+BLOCK_SIZE = 32000
+BLOCK_COUNT = EPD_BUF_SIZE // BLOCK_SIZE
+
+# 超過此時間的推送紀錄不再信任（設備可能已被其他工具更新）
+DEFAULT_HISTORY_MAX_AGE = float(os.environ.get("PH6_INCREMENTAL_MAX_AGE", str(24 * 3600)))
+
+# 中斷的傳輸在此時間內重新連線才從已確認的區塊續傳，0 表示停用續傳
+DEFAULT_RESUME_WINDOW = float(os.environ.get("PH6_RESUME_WINDOW", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def atomic_writer(path, fsync=False):
+    """以檔案物件逐段寫入暫存檔，結束時以 os.replace 原子替換；例外時刪除暫存檔
+
+    大檔案（例如預編譯畫面包）可邊產生邊寫入，不必先在記憶體組出完整內容。
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def atomic_write(path, data):
+    """寫入暫存檔後以 os.replace 原子替換，讀取端不會看到半寫入的檔案"""
+    with atomic_writer(path) as f:
+        f.write(data)
+
+
+def changed_blocks(previous, current):
+    """回傳內容不同的區塊編號 (1-6)"""
+    return [
+        j + 1
+        for j in range(BLOCK_COUNT)
+        if previous[j * BLOCK_SIZE:(j + 1) * BLOCK_SIZE] != current[j * BLOCK_SIZE:(j + 1) * BLOCK_SIZE]
+    ]
+
+
+def frame_cache_enabled():
+    return os.environ.get("PH6_FRAME_CACHE", "1") != "0"
+
+
+class FrameCache:
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or os.path.join(CACHE_DIR, "frames")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_bytes, resize_mode=RESIZE_MODE):
+        """畫面內容與 side 無關，因此鍵只包含來源內容、縮放模式與調色盤版本"""
+        digest = hashlib.sha256()
+        digest.update(image_bytes)
+        digest.update(f"|{resize_mode}|{PALETTE_VERSION}".encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + FRAME_SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                frame = f.read()
+        except FileNotFoundError:
+            frame = None
+
+        if frame is not None and len(frame) != EPD_BUF_SIZE:
+            logger.warning(f"⚠️ 快取畫面長度錯誤，忽略: {path}")
+            frame = None
+
+        if frame is None:
+            self.misses += 1
+            self._record("misses")
+            return None
+
+        try:
+            os.utime(path)  # 更新 mtime 作為 LRU 的最後使用時間
+        except OSError:
+            pass
+        self.hits += 1
+        self._record("hits")
+        return frame
+
+    def put(self, key, frame):
+        if len(frame) != EPD_BUF_SIZE:
+            raise ValueError(f"畫面長度必須為 {EPD_BUF_SIZE}，實際為 {len(frame)}")
+
+        atomic_write(self._path(key), frame)
+        self.evict()
+
+    def evict(self):
+        """依 mtime 由舊到新刪除，直到總大小不超過上限"""
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(FRAME_SUFFIX):
+                        try:
+                            st = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+        except FileNotFoundError:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # 其他程序已刪除
+            total -= size
+
+    def _record(self, field):
+        """累加跨程序共用的命中/未命中計數"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, "stats.json"), "a+") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    stats = json.loads(f.read() or "{}")
+                except ValueError:
+                    stats = {}
+                stats[field] = stats.get(field, 0) + 1
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(stats))
+        except OSError as e:
+            logger.debug(f"無法更新快取統計: {e}")
+
+    def stats(self):
+        try:
+            with open(os.path.join(self.cache_dir, "stats.json")) as f:
+                totals = json.load(f)
+        except (OSError, ValueError):
+            totals = {}
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0),
+            "total_misses": totals.get("misses", 0),
+        }
+
+
+class DeviceFrameStore:
+    """記錄每個 (設備地址, 面) 最後成功推送的畫面"""
+
+    def __init__(self, store_dir=None, max_age=DEFAULT_HISTORY_MAX_AGE):
+        self.store_dir = store_dir or os.path.join(CACHE_DIR, "devices")
+        self.max_age = max_age
+
+    def _path(self, address, side):
+        safe_address = re.sub(r"[^0-9A-Za-z]", "", address).upper()
+        return os.path.join(self.store_dir, f"{safe_address}_side{side}{FRAME_SUFFIX}")
+
+    def load(self, address, side):
+        path = self._path(address, side)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, "rb") as f:
+                frame = f.read()
+        except OSError:
+            return None
+        return frame if len(frame) == EPD_BUF_SIZE else None
+
+    def save(self, address, side, frame):
+        atomic_write(self._path(address, side), bytes(frame))
+
+    def forget(self, address, side):
+        try:
+            os.remove(self._path(address, side))
+        except FileNotFoundError:
+            pass
+
+    def plan_blocks(self, address, side, frame):
+        """決定要傳送的區塊：None 表示整面上傳，空列表表示設備畫面已是最新
+
+        沒有可信的推送紀錄，或所有區塊都變更時退回整面上傳。
+        """
+        previous = self.load(address, side)
+        if previous is None:
+            return None
+
+        blocks = changed_blocks(previous, bytes(frame))
+        if len(blocks) == BLOCK_COUNT:
+            return None
+        return blocks
+
+
+class TransferCheckpointStore:
+    """記錄中斷的傳輸中設備已確認（區塊 ACK 旗標 0x01）的區塊
+
+    以畫面內容雜湊區分，只有同一個畫面在 max_age 秒內重新傳送時才沿用；
+    任何一次成功推送或改推其他畫面都會使紀錄失效。
+    """
+
+    def __init__(self, store_dir=None):
+        self.store_dir = store_dir or os.path.join(CACHE_DIR, "devices")
+
+    def _path(self, address, side):
+        safe_address = re.sub(r"[^0-9A-Za-z]", "", address).upper()
+        return os.path.join(self.store_dir, f"{safe_address}_side{side}.resume.json")
+
+    @staticmethod
+    def _digest(frame):
+        return hashlib.sha256(bytes(frame)).hexdigest()
+
+    def load(self, address, side, frame, max_age):
+        """回傳可略過的區塊編號集合；沒有紀錄、畫面不同或已過期時回傳空集合"""
+        try:
+            with open(self._path(address, side), encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if checkpoint.get("frame") != self._digest(frame) or time.time() - checkpoint.get("saved_at", 0) > max_age:
+            return set()
+        return {b for b in checkpoint.get("blocks", []) if 1 <= b <= BLOCK_COUNT}
+
+    def save(self, address, side, frame, blocks):
+        checkpoint = {"frame": self._digest(frame), "blocks": sorted(blocks), "saved_at": time.time()}
+        atomic_write(self._path(address, side), json.dumps(checkpoint).encode())
+
+    def forget(self, address, side):
+        try:
+            os.remove(self._path(address, side))
+        except FileNotFoundError:
+            pass
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("--stats", "--clear"):
+        print("使用方法: python3 frame_cache.py --stats | --clear")
+        sys.exit(1)
+
+    cache = FrameCache()
+    if sys.argv[1] == "--clear":
+        cache.max_bytes = 0
+        cache.evict()
+    print(json.dumps(cache.stats(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
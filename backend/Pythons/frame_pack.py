@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""預編譯畫面包：將背景、元素圖片與模板批次轉換為單一可記憶體映射的打包檔
+
+frames.pack 依序存放 192000 位元組的打包畫面（開頭 16 位元組為檔頭），
+frames.pack.json 為索引：
+    {"generation": ..., "frames": {畫面鍵: 位移}, "sources": {來源路徑: {"key", "size", "mtime"}}}
+畫面鍵與 FrameCache.make_key 相同（來源內容 + 縮放模式 + 調色盤版本），
+投圖時 load_e6_frame 以鍵查表後直接從 mmap 依位移讀出畫面，完全不需解碼。
+
+轉換以多程序 (ProcessPoolExecutor) 使用所有 CPU 核心；已在包內的內容直接沿用。
+
+使用方法: python3 frame_pack.py <目錄|清單.json|清單.txt|圖片 ...> [--pack PATH] [--workers N] [--rebuild]
+          python3 frame_pack.py --stats [--pack PATH]
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import e6_quantizer
+from e6_quantizer import CACHE_DIR, EPD_BUF_SIZE
+from frame_cache import RESIZE_MODE, FrameCache, atomic_write, atomic_writer
+
+PACK_MAGIC = b"PH6PACK\x01"
+HEADER_SIZE = 16  # PACK_MAGIC + 8 位元組世代編號，索引與打包檔世代不符時不使用
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+logger = logging.getLogger(__name__)
+
+
+def default_pack_path():
+    return os.environ.get("PH6_FRAME_PACK", os.path.join(CACHE_DIR, "frames.pack"))
+
+
+def index_path(pack_path):
+    return pack_path + ".json"
+
+
+class FramePack:
+    """唯讀開啟打包檔；索引檔更新（重新預編譯）後下次查詢自動重新載入
+
+    可由多個執行緒共用：索引與 mmap 以 (index, map) 元組一次替換，查詢端取得元組後
+    不受其他執行緒重新載入影響；舊的 mmap 不主動關閉，最後一個參照釋放時才關閉。
+    """
+
+    def __init__(self, pack_path=None):
+        self.pack_path = pack_path or default_pack_path()
+        self.hits = 0
+        self._state = None  # (index, map)，只以單一賦值替換
+        self._index_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        state = self._state
+        return state[0] if state is not None else None
+
+    def _load(self):
+        """回傳目前有效的 (index, map)，索引檔變更時重新載入；無法使用時回傳 None"""
+        with self._lock:
+            try:
+                mtime = os.stat(index_path(self.pack_path)).st_mtime_ns
+            except OSError:
+                self._state = None
+                self._index_mtime = None
+                return None
+            if mtime == self._index_mtime:
+                return self._state
+
+            self._state = None
+            self._index_mtime = mtime
+            try:
+                with open(index_path(self.pack_path), encoding="utf-8") as f:
+                    index = json.load(f)
+                with open(self.pack_path, "rb") as f:
+                    pack_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ 無法開啟預編譯畫面包: {e}")
+                return None
+
+            if pack_map[:HEADER_SIZE] != PACK_MAGIC + bytes.fromhex(index.get("generation", "")):
+                # 打包檔與索引不是同一次預編譯的產物（例如正在重建）
+                logger.warning(f"⚠️ 預編譯畫面包與索引不符，忽略: {self.pack_path}")
+                pack_map.close()
+                return None
+
+            self._state = (index, pack_map)
+            return self._state
+
+    def close(self):
+        """放棄目前的 mmap（仍在讀取的查詢持有參照，讀完後才真正關閉）"""
+        with self._lock:
+            self._state = None
+            self._index_mtime = None
+
+    def get(self, key):
+        """依畫面鍵回傳畫面，不在包內時回傳 None"""
+        state = self._load()
+        return self._read(state, key) if state is not None else None
+
+    def _read(self, state, key):
+        index, pack_map = state
+        offset = index["frames"].get(key)
+        if offset is None:
+            return None
+        self.hits += 1
+        return pack_map[offset:offset + EPD_BUF_SIZE]
+
+    def lookup(self, image_path):
+        """依來源路徑查詢；大小與修改時間未變時不需讀取與雜湊圖片"""
+        state = self._load()
+        if state is None:
+            return None
+        source = state[0]["sources"].get(os.path.abspath(image_path))
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return None
+        if source is not None and source["size"] == st.st_size and source["mtime"] == st.st_mtime_ns:
+            return self._read(state, source["key"])
+        with open(image_path, "rb") as f:
+            return self._read(state, FrameCache.make_key(f.read(), RESIZE_MODE))
+
+    def __len__(self):
+        state = self._load()
+        return len(state[0]["frames"]) if state is not None else 0
+
+
+_default_pack = None
+
+
+_default_pack_lock = threading.Lock()
+
+
+def default_pack():
+    """本程序共用的預設畫面包（不存在時查詢一律回傳 None）"""
+    global _default_pack
+    with _default_pack_lock:
+        if _default_pack is None:
+            _default_pack = FramePack()
+        return _default_pack
+
+
+def collect_sources(inputs):
+    """展開目錄（遞迴）、JSON 清單（路徑字串或含 image 欄位的工作）與文字清單（每行一個路徑）"""
+    sources = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                sources.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif item.lower().endswith(".json"):
+            with open(item, encoding="utf-8") as f:
+                manifest = json.load(f)
+            entries = manifest["jobs"] if isinstance(manifest, dict) else manifest
+            base = os.path.dirname(os.path.abspath(item))
+            for entry in entries:
+                path = entry["image"] if isinstance(entry, dict) else entry
+                sources.append(os.path.join(base, path))
+        elif item.lower().endswith(".txt"):
+            base = os.path.dirname(os.path.abspath(item))
+            with open(item, encoding="utf-8") as f:
+                sources.extend(os.path.join(base, line.strip()) for line in f if line.strip() and not line.startswith("#"))
+        else:
+            sources.append(item)
+
+    unique = {}
+    for path in sources:
+        unique.setdefault(os.path.abspath(path), None)
+    return list(unique)
+
+
+def _init_worker():
+    # 工作程序不輸出逐張轉換日誌，由主程序統一報告
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _convert_source(path):
+    """工作程序：轉換單張圖片（在子程序中匯入轉換器，每個程序各自載入一次查找表）"""
+    import io
+
+    from cast_image_to_ph6_fixed import convert_image_to_e6
+
+    with open(path, "rb") as f:
+        image_bytes = f.read()
+    return bytes(convert_image_to_e6(io.BytesIO(image_bytes)))
+
+
+def build_pack(inputs, pack_path=None, workers=None, rebuild=False):
+    """預編譯所有來源圖片並原子寫入打包檔與索引，回傳統計摘要
+
+    畫面邊取得邊寫入暫存打包檔（沿用的畫面從舊包的 mmap 複製，新轉換的畫面在完成時寫入），
+    記憶體用量不隨畫面庫大小成長。
+    """
+    pack_path = pack_path or default_pack_path()
+    started = time.perf_counter()
+    sources = collect_sources(inputs)
+
+    existing = None if rebuild else FramePack(pack_path)
+    offsets = {}  # 畫面鍵 -> 新打包檔中的位移
+    source_index = {}
+    pending = {}  # 畫面鍵 -> 來源路徑（相同內容只轉換一次）
+    failed = []
+    reused = converted = 0
+    generation = os.urandom(HEADER_SIZE - len(PACK_MAGIC))
+
+    # 先替換打包檔再替換索引；兩者之間的讀取端會因世代不符而忽略打包檔
+    with atomic_writer(pack_path, fsync=True) as out:
+        out.write(PACK_MAGIC + generation)
+
+        def append(key, frame):
+            offsets[key] = out.tell()
+            out.write(frame)
+
+        for path in sources:
+            try:
+                st = os.stat(path)
+                with open(path, "rb") as f:
+                    key = FrameCache.make_key(f.read(), RESIZE_MODE)
+            except OSError as e:
+                failed.append({"source": path, "error": str(e)})
+                continue
+            source_index[path] = {"key": key, "size": st.st_size, "mtime": st.st_mtime_ns}
+            if key in offsets or key in pending:
+                continue
+            frame = existing.get(key) if existing is not None else None
+            if frame is not None:
+                append(key, frame)
+                reused += 1
+            else:
+                pending[key] = path
+        if existing is not None:
+            # 舊包在替換前釋放（Windows 無法取代仍被映射的檔案）
+            existing.close()
+
+        convert_started = time.perf_counter()
+        if pending:
+            if e6_quantizer.numpy_available():
+                # 先在主程序載入查找表（必要時建立），避免每個工作程序各自重建
+                e6_quantizer.load_e6_lut()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = {executor.submit(_convert_source, path): key for key, path in pending.items()}
+                for future in as_completed(futures):
+                    # 取出後不再持有 future，已寫入的畫面可立即釋放
+                    key = futures.pop(future)
+                    try:
+                        frame = future.result()
+                        if len(frame) != EPD_BUF_SIZE:
+                            raise ValueError(f"畫面長度錯誤: {len(frame)}")
+                        append(key, frame)
+                        converted += 1
+                    except Exception as e:
+                        failed.append({"source": pending[key], "error": str(e)})
+                        logger.warning(f"⚠️ 預編譯失敗 {pending[key]}: {e}")
+        convert_seconds = time.perf_counter() - convert_started
+
+    # 轉換失敗的來源不寫入索引
+    source_index = {path: entry for path, entry in source_index.items() if entry["key"] in offsets}
+    index = {
+        "generation": generation.hex(),
+        "frame_size": EPD_BUF_SIZE,
+        "resize_mode": RESIZE_MODE,
+        "frames": offsets,
+        "sources": source_index,
+    }
+    atomic_write(index_path(pack_path), json.dumps(index, ensure_ascii=False, indent=1).encode())
+
+    elapsed = time.perf_counter() - started
+    return {
+        "pack": pack_path,
+        "sources": len(sources),
+        "frames": len(offsets),
+        "converted": converted,
+        "reused": reused,
+        "failed": failed,
+        "workers": workers or os.cpu_count(),
+        "convert_seconds": round(convert_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "images_per_second": round(converted / convert_seconds, 2) if converted else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 frame_pack.py <目錄|清單.json|清單.txt|圖片 ...> [選項]")
+    parser.add_argument("inputs", nargs="*", help="要預編譯的圖片、目錄或清單")
+    parser.add_argument("--pack", default=None, help=f"打包檔路徑 (預設 {default_pack_path()})")
+    parser.add_argument("--workers", type=int, default=None, help="轉換程序數 (預設 CPU 核心數)")
+    parser.add_argument("--rebuild", action="store_true", help="忽略既有打包檔，全部重新轉換")
+    parser.add_argument("--stats", action="store_true", help="顯示打包檔內容統計")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    if args.stats:
+        pack = FramePack(args.pack)
+        print(json.dumps({"pack": pack.pack_path, "frames": len(pack), "sources": len(pack.index["sources"]) if pack.index else 0}, ensure_ascii=False))
+        return
+    if not args.inputs:
+        parser.print_usage()
+        sys.exit(1)
+
+    summary = build_pack(args.inputs, args.pack, args.workers, args.rebuild)
+    rate = summary["images_per_second"]
+    print(
+        f"📦 {summary['sources']} 張來源 → {summary['frames']} 個畫面"
+        f"（轉換 {summary['converted']}、沿用 {summary['reused']}、失敗 {len(summary['failed'])}）"
+        + (f"，{rate} 張/秒 ({summary['workers']} 程序)" if rate else ""),
+        file=sys.stderr,
+    )
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    sys.exit(0 if not summary["failed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
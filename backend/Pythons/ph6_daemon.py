@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""常駐投圖/掃描工作程序
+
+啟動時一次載入 PIL、bleak、E6 查找表，並保持 BLE 連線，之後以 JSON-lines
+協定接受 cast / scan / ping 工作，省去每次投圖啟動 Python 直譯器與匯入模組的時間。
+
+使用方法:
+    python3 ph6_daemon.py --stdio                       # 從 stdin 讀取請求，回應寫到 stdout
+    python3 ph6_daemon.py --socket /tmp/ph6.sock        # 監聽 Unix socket
+    python3 ph6_daemon.py --stdio --watch-scan          # 背景持續掃描，scan/snapshot 直接回傳登錄表
+    python3 ph6_daemon.py --stdio --queue               # 同時執行持久化投圖佇列 (cast_queue.py)
+
+請求（每行一個 JSON）:
+    {"id": 1, "op": "cast", "image": "card.png", "side": 2, "address": "6A42...", "incremental": false, "flow_control": "vendor", "adaptive": false}
+    {"id": 2, "op": "scan", "verify": false}              # --watch-scan 時等同 snapshot；verify 以 GATT 驗證
+    {"id": 6, "op": "snapshot"}                           # 持續掃描登錄表中目前在範圍內的設備
+    {"id": 3, "op": "ping"}                               # 工作程序健康檢查
+    {"id": 4, "op": "ping", "address": "6A42...", "timeout": 10}  # 檢查設備是否在範圍內，看到即回應
+    {"id": 7, "op": "enqueue", "image": "card.png", "side": 2, "address": "6A42...", "wait": false}  # 需 --queue；同設備同面只保留最新畫面
+    {"id": 8, "op": "job", "job": 12}                     # 查詢佇列工作狀態
+    {"id": 9, "op": "queue_stats"}                        # 佇列深度與等待時間
+    {"id": 5, "op": "shutdown"}
+
+回應: {"id": 1, "ok": true, "result": {...}} 或 {"id": 1, "ok": false, "error": "..."}
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from functools import partial
+
+import backend_ble_scanner as scanner
+import cast_image_to_ph6_fixed as cast
+import cast_queue
+import e6_quantizer
+from ble_adapters import MultiAdapterScanner, ShardedConnectionPool, make_connection_pool, parse_adapters
+from ble_registry import DeviceRegistry
+from cast_batch import BatchCaster
+from frame_cache import FrameCache, frame_cache_enabled
+from ph6_metrics import CastMetrics
+from ph6_packetizer import load_numpy
+
+logger = cast.logger
+
+
+class Ph6Daemon:
+    def __init__(self, client_factory, max_connections=4, idle_timeout=30.0, registry=None, scanner_factory=None, adapters=()):
+        """registry 不為 None 時表示背景持續掃描中，掃描與 ping 直接查詢登錄表
+        adapters 指定介面卡時掃描在每個介面卡進行，多個介面卡時投圖依 RSSI 與負載分攤"""
+        self.pool = make_connection_pool(client_factory, adapters, max_connections, idle_timeout)
+        self.registry = registry
+        if scanner_factory is None:
+            from bleak import BleakScanner
+            scanner_factory = BleakScanner
+        if adapters:
+            # 多個介面卡時掃描看到的 RSSI 直接更新投圖排程
+            scheduler = self.pool.scheduler if isinstance(self.pool, ShardedConnectionPool) else None
+            scanner_factory = partial(MultiAdapterScanner, adapters=adapters, scheduler=scheduler, scanner_factory=scanner_factory)
+        self.scanner_factory = scanner_factory
+        self.client_factory = client_factory
+        self.verification_cache = scanner.VerificationCache()
+        self.frame_cache = FrameCache() if frame_cache_enabled() else None
+        self.started = time.monotonic()
+        self.jobs_done = 0
+        self.stopping = asyncio.Event()
+        self.queue_worker = None
+
+    def attach_queue(self, queue):
+        """以常駐程序的連線池執行持久化投圖佇列"""
+        caster = BatchCaster(self.client_factory, pool=self.pool)
+        caster.frame_cache = self.frame_cache
+        self.queue_worker = cast_queue.QueueWorker(queue, caster)
+        self.queue_worker.stopping = self.stopping
+        return self.queue_worker
+
+    def warm_up(self):
+        # 投圖模組改為延遲匯入 PIL 與 numpy，常駐程序在啟動時一次載入，第一個工作不必等待
+        import PIL.Image  # noqa: F401
+
+        if e6_quantizer.numpy_available():
+            e6_quantizer.load_e6_lut()
+        load_numpy()
+        logger.info("🔥 常駐工作程序已就緒")
+
+    async def handle(self, request):
+        op = request.get("op")
+        if op == "cast":
+            result = await self.cast(request)
+        elif op == "scan":
+            result = await self.scan(bool(request.get("verify", False)))
+        elif op == "snapshot":
+            if self.registry is None:
+                raise RuntimeError("未啟用持續掃描 (--watch-scan)")
+            result = self.registry.snapshot()
+        elif op == "ping":
+            result = await self.ping(request.get("address"), float(request.get("timeout", 10.0)))
+        elif op in ("enqueue", "job", "queue_stats"):
+            result = await self.queue_op(op, request)
+        elif op == "shutdown":
+            self.stopping.set()
+            result = {"stopping": True}
+        else:
+            raise ValueError(f"未知的操作: {op}")
+        self.jobs_done += 1
+        return result
+
+    async def cast(self, request):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        metrics = CastMetrics()
+        frame = await loop.run_in_executor(None, cast.load_e6_frame_timed, request["image"], self.frame_cache, metrics.phases)
+        success = await cast.cast_frame_to_device(
+            frame, int(request.get("side", 2)), request["address"], self.pool.connection,
+            incremental=bool(request.get("incremental", False)),
+            flow_control=request.get("flow_control", "vendor"),
+            adaptive=bool(request.get("adaptive", False)),
+            metrics=metrics,
+        )
+        if not success:
+            raise RuntimeError("傳輸失敗")
+        return {"seconds": round(time.perf_counter() - started, 3), "metrics": metrics.as_record()}
+
+    async def queue_op(self, op, request):
+        if self.queue_worker is None:
+            raise RuntimeError("未啟用投圖佇列 (--queue)")
+        queue = self.queue_worker.queue
+        if op == "queue_stats":
+            return queue.stats()
+        if op == "job":
+            job = queue.get(int(request["job"]))
+            if job is None:
+                raise LookupError(f"找不到工作: {request['job']}")
+            return job
+
+        options = {k: request[k] for k in cast_queue.JOB_OPTIONS if k in request}
+        job_id, superseded = queue.enqueue(request["image"], request["address"], int(request.get("side", 2)), **options)
+        self.queue_worker.wakeup.set()
+        if not request.get("wait"):
+            return {"job": job_id, "superseded": superseded, "depth": queue.depth()}
+        return await cast_queue.wait_for_job(queue, job_id, stopping=self.stopping)
+
+    async def scan(self, verify=False):
+        if self.registry is None:
+            return await scanner.scan_for_nameplates(verify=verify, cache=self.verification_cache, scanner_factory=self.scanner_factory)
+        devices = self.registry.snapshot()
+        if verify:
+            await scanner.verify_candidates(devices, cache=self.verification_cache, client_factory=self.client_factory)
+            devices = [d for d in devices if d["Verified"] is not False]
+        return devices
+
+    async def ping(self, address, timeout=10.0):
+        if not address:
+            return {
+                "uptime": round(time.monotonic() - self.started, 1),
+                "jobs_done": self.jobs_done,
+                "pid": os.getpid(),
+                "pool": self.pool.stats(),
+            }
+
+        if self.registry is not None:
+            device = self.registry.get(address)
+            if device is None:
+                raise LookupError(f"找不到設備: {address}")
+            return {"found": True, "rssi": device["SignalStrength"], "last_seen": device["LastSeen"]}
+
+        result, = await scanner.ping_nameplates([address], timeout, self.scanner_factory)
+        if not result["Found"]:
+            raise LookupError(f"找不到設備: {address}")
+        return {"found": True, "rssi": result["SignalStrength"], "latency": result["LatencySeconds"]}
+
+    async def respond(self, request, write):
+        response = {"id": request.get("id")}
+        try:
+            response["result"] = await self.handle(request)
+            response["ok"] = True
+        except Exception as e:
+            response["ok"] = False
+            response["error"] = str(e) or type(e).__name__
+        await write(response)
+
+    async def serve_lines(self, reader, write):
+        """讀取 JSON-lines 請求，每個請求獨立執行，回應依完成順序寫出"""
+        tasks = set()
+        stop_wait = asyncio.create_task(self.stopping.wait())
+        while True:
+            read = asyncio.create_task(reader.readline())
+            await asyncio.wait({read, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                read.cancel()
+                break
+            line = read.result()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                await write({"id": None, "ok": False, "error": f"無效的 JSON: {e}"})
+                continue
+            task = asyncio.create_task(self.respond(request, write))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        stop_wait.cancel()
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def reap_idle_connections(self):
+        while not self.stopping.is_set():
+            await asyncio.sleep(5)
+            await self.pool.close_idle()
+
+
+async def run_stdio(daemon, out):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    async def write(response):
+        out.write(json.dumps(response, ensure_ascii=False) + "\n")
+        out.flush()
+
+    await daemon.serve_lines(reader, write)
+
+
+async def run_socket(daemon, path):
+    async def on_client(reader, writer):
+        lock = asyncio.Lock()
+
+        async def write(response):
+            async with lock:
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode())
+                await writer.drain()
+
+        try:
+            await daemon.serve_lines(reader, write)
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(on_client, path=path)
+    logger.info(f"🔌 監聽 Unix socket: {path}")
+    async with server:
+        await daemon.stopping.wait()
+    os.unlink(path)
+
+
+async def run_queue(daemon, queue):
+    with cast_queue.worker_lock(queue.db_path) as acquired:
+        if not acquired:
+            logger.error(f"❌ 已有其他工作程序在執行佇列，不啟用 --queue: {queue.db_path}")
+            return
+        logger.info(f"🗂️ 投圖佇列: {queue.db_path}")
+        await daemon.attach_queue(queue).run()
+
+
+async def run(args, out):
+    if args.simulate:
+        from ph6_simulator import FakeBleakClient, FakeBleakScanner
+        client_factory = FakeBleakClient
+        scanner_factory = FakeBleakScanner
+    else:
+        from bleak import BleakClient, BleakScanner
+        client_factory = BleakClient
+        scanner_factory = BleakScanner
+
+    registry = DeviceRegistry(expire_after=args.expire_after) if args.watch_scan else None
+    daemon = Ph6Daemon(client_factory, args.max_connections, args.idle_timeout, registry, scanner_factory, parse_adapters(args.adapters))
+    daemon.warm_up()
+    reaper = asyncio.create_task(daemon.reap_idle_connections())
+    queue_task = None
+    if args.queue is not None:
+        queue_task = asyncio.create_task(run_queue(daemon, cast_queue.CastJobQueue(args.queue or None)))
+    watcher = None
+    if registry is not None:
+        def log_event(event):
+            logger.info(f"📡 {event['event']}: {event['device']['Name']} ({event['device']['OriginalAddress']})")
+
+        watcher = asyncio.create_task(
+            scanner.watch_nameplates(registry, log_event, daemon.stopping, scanner_factory=daemon.scanner_factory)
+        )
+    try:
+        if args.socket:
+            await run_socket(daemon, args.socket)
+        else:
+            await run_stdio(daemon, out)
+    finally:
+        reaper.cancel()
+        if queue_task is not None:
+            daemon.stopping.set()
+            await queue_task
+        if watcher is not None:
+            daemon.stopping.set()
+            await watcher
+        await daemon.pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 ph6_daemon.py (--stdio | --socket PATH) [選項]")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--stdio", action="store_true", help="以 stdin/stdout 傳遞 JSON-lines")
+    mode.add_argument("--socket", help="監聽的 Unix socket 路徑")
+    parser.add_argument("--max-connections", type=int, default=4, help="同時開啟的 BLE 連線上限 (預設 4)")
+    parser.add_argument("--idle-timeout", type=float, default=30.0, help="閒置連線保留秒數 (預設 30)")
+    parser.add_argument("--simulate", action="store_true", help="使用模擬設備")
+    parser.add_argument("--adapters", default=None, help="以逗號分隔的藍牙介面卡，例如 hci0,hci1 (預設 PH6_BLE_ADAPTERS)")
+    parser.add_argument("--watch-scan", action="store_true", help="背景持續掃描，scan/snapshot/ping 直接查詢設備登錄表")
+    parser.add_argument("--queue", nargs="?", const="", default=None, help="執行持久化投圖佇列，可指定資料庫路徑 (預設 cast_queue 的路徑)")
+    parser.add_argument("--expire-after", type=float, default=30.0, help="持續掃描時幾秒未見即視為離開 (預設 30)")
+    args = parser.parse_args()
+    cast.configure_logging()
+
+    # stdout 保留給協定回應，投圖過程的 PROGRESS 行改寫到 stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    asyncio.run(run(args, out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""投圖的結構化計時與吞吐量指標
+
+CastMetrics 收集一次投圖的:
+    phases      各階段耗時（秒）：image_load、resize、quantize、convert、connect、notify、
+                wait_frame、packetize、transfer、data_write、refresh_wait、total（與既有 timings dict 共用）
+                data_write 只涵蓋區塊資料寫入，不含封包化與刷新等待
+    blocks      每個區塊的傳輸耗時
+    writes      寫入延遲直方圖（依是否需回應分開），封包數、位元組數
+    counters    retries、ack_timeouts 等
+最後以 as_record() 輸出單筆 JSON 紀錄（命令列印出 METRICS|{...} 一行），
+並可寫成 Prometheus node_exporter textfile collector 格式。
+"""
+import bisect
+import contextlib
+import json
+import os
+import time
+
+from frame_cache import atomic_write
+
+# 寫入延遲直方圖上界（秒），最後一格為 +Inf
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """以所在區間上界估計分位數（超過最後上界時回傳觀察到的最大值）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for upper, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return round(min(upper, self.max), 6)
+        return round(self.max, 6)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": {str(upper): n for upper, n in zip(self.buckets + ("+Inf",), self.counts)},
+        }
+
+
+class CastMetrics:
+    def __init__(self, phases=None, **labels):
+        """phases 可傳入既有的 timings dict，各階段耗時會直接寫入其中；labels 例如 address、side"""
+        self.phases = {} if phases is None else phases
+        self.labels = dict(labels)
+        self.blocks = {}
+        self.counters = {"retries": 0, "ack_timeouts": 0}
+        self.packets = 0
+        self.bytes = 0
+        self.data_packets = 0
+        self.data_bytes = 0
+        self.write_latency = {True: Histogram(), False: Histogram()}
+        self.success = None
+
+    @contextlib.contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    @contextlib.contextmanager
+    def data_span(self):
+        """資料寫入階段：計入 data_write，並記下期間寫出的封包數與位元組數"""
+        packets, size = self.packets, self.bytes
+        try:
+            with self.span("data_write"):
+                yield
+        finally:
+            self.data_packets += self.packets - packets
+            self.data_bytes += self.bytes - size
+
+    def record_write(self, latency, size, response):
+        self.packets += 1
+        self.bytes += size
+        self.write_latency[bool(response)].observe(latency)
+
+    def record_block(self, block, seconds):
+        self.blocks[block] = seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def throughput(self):
+        """以 data_write 階段計算資料封包的每秒封包數與位元組數
+
+        transfer 含封包化與刷新等待（廠商模式固定 5 秒），不能作為吞吐量分母
+        """
+        seconds = self.phases.get("data_write")
+        if not seconds or not self.data_packets:
+            return None, None
+        return self.data_packets / seconds, self.data_bytes / seconds
+
+    def as_record(self):
+        packets_per_s, bytes_per_s = self.throughput()
+        return {
+            "labels": self.labels,
+            "success": self.success,
+            "phases": {k: round(v, 6) for k, v in self.phases.items()},
+            "blocks": {str(k): round(v, 6) for k, v in sorted(self.blocks.items())},
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "packets_per_second": round(packets_per_s, 1) if packets_per_s else None,
+            "bytes_per_second": round(bytes_per_s, 1) if bytes_per_s else None,
+            "write_latency": {
+                "response": self.write_latency[True].as_dict(),
+                "no_response": self.write_latency[False].as_dict(),
+            },
+            "counters": dict(self.counters),
+        }
+
+    def emit(self, json_path=None):
+        """印出 METRICS| 行（供 .NET 端解析），並可另存 JSON 檔"""
+        record = self.as_record()
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        print(f"METRICS|{line}")
+        if json_path:
+            atomic_write(os.path.abspath(json_path), json.dumps(record, ensure_ascii=False, indent=2).encode())
+        return record
+
+    def prometheus_text(self):
+        labels = ",".join(f'{k}="{v}"' for k, v in sorted(self.labels.items()) if v is not None)
+
+        def series(name, value, extra=""):
+            joined = ",".join(part for part in (labels, extra) if part)
+            return f"{name}{{{joined}}} {value}"
+
+        lines = [
+            "# HELP ph6_cast_phase_seconds Duration of each cast phase.",
+            "# TYPE ph6_cast_phase_seconds gauge",
+        ]
+        lines += [series("ph6_cast_phase_seconds", f"{v:.6f}", f'phase="{k}"') for k, v in self.phases.items()]
+        lines += ["# TYPE ph6_cast_block_seconds gauge"]
+        lines += [series("ph6_cast_block_seconds", f"{v:.6f}", f'block="{k}"') for k, v in sorted(self.blocks.items())]
+        packets_per_s, bytes_per_s = self.throughput()
+        lines += [
+            "# TYPE ph6_cast_success gauge",
+            series("ph6_cast_success", int(bool(self.success))),
+            "# TYPE ph6_cast_packets gauge",
+            series("ph6_cast_packets", self.packets),
+            "# TYPE ph6_cast_bytes gauge",
+            series("ph6_cast_bytes", self.bytes),
+            "# TYPE ph6_cast_packets_per_second gauge",
+            series("ph6_cast_packets_per_second", f"{packets_per_s or 0:.1f}"),
+            "# TYPE ph6_cast_bytes_per_second gauge",
+            series("ph6_cast_bytes_per_second", f"{bytes_per_s or 0:.1f}"),
+        ]
+        for name, value in sorted(self.counters.items()):
+            lines += [f"# TYPE ph6_cast_{name} gauge", series(f"ph6_cast_{name}", value)]
+
+        lines += [
+            "# HELP ph6_cast_write_latency_seconds GATT write latency.",
+            "# TYPE ph6_cast_write_latency_seconds histogram",
+        ]
+        for response, histogram in self.write_latency.items():
+            kind = f'response="{str(response).lower()}"'
+            cumulative = 0
+            for upper, n in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += n
+                lines.append(series("ph6_cast_write_latency_seconds_bucket", cumulative, f'{kind},le="{upper}"'))
+            lines.append(series("ph6_cast_write_latency_seconds_sum", f"{histogram.sum:.6f}", kind))
+            lines.append(series("ph6_cast_write_latency_seconds_count", histogram.count, kind))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """原子寫入 textfile，node_exporter 不會讀到半寫入的檔案"""
+        atomic_write(os.path.abspath(path), self.prometheus_text().encode())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""投圖傳輸節奏（pacing）參數
+
+FixedPacing 保持固定的區塊/準備/包間延遲與同步間隔（廠商時序）。
+AdaptivePacer 依傳輸過程中觀察到的寫入延遲、區塊 ACK（廠商模式也會等待設備
+實際的區塊 ACK 旗標）與失敗即時調整
+這些參數（AIMD：順利時逐步加速，變慢或失敗時加倍退避），並可透過
+PacingStore 依設備地址保存，下次投圖從學到的參數開始。
+"""
+import json
+import logging
+import os
+import re
+
+from e6_quantizer import CACHE_DIR
+from frame_cache import atomic_write
+
+logger = logging.getLogger(__name__)
+
+PACING_FIELDS = ("block_delay", "prep_delay", "packet_delay", "sync_interval", "sync_delay")
+
+
+class FixedPacing:
+    # 廠商模式下是否需要等待設備的區塊 ACK 作為回饋（固定節奏不需要，保持廠商時序）
+    needs_block_ack = False
+
+    def __init__(self, block_delay=0.001, prep_delay=0.001, packet_delay=0.001, sync_interval=5, sync_delay=0.1):
+        self.block_delay = block_delay
+        self.prep_delay = prep_delay
+        self.packet_delay = packet_delay
+        self.sync_interval = sync_interval
+        self.sync_delay = sync_delay
+
+    def on_write(self, latency, response):
+        pass
+
+    def on_block(self, ok, latency):
+        pass
+
+    def on_failure(self):
+        pass
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in PACING_FIELDS}
+
+
+class AdaptivePacer(FixedPacing):
+    needs_block_ack = True
+    # (下限, 上限, 從 0 退避時的最小步進)
+    DELAY_LIMITS = {
+        "block_delay": (0.0, 0.5, 0.005),
+        "prep_delay": (0.0, 0.5, 0.005),
+        "packet_delay": (0.0, 0.02, 0.0005),
+        "sync_delay": (0.0, 0.5, 0.01),
+    }
+    SYNC_INTERVAL_LIMITS = (2, 64)
+
+    def __init__(self, *args, target_latency=0.05, speed_up=0.85, **kwargs):
+        """target_latency: 需回應寫入與區塊 ACK 的目標延遲，超過即視為設備緩衝區壅塞"""
+        super().__init__(*args, **kwargs)
+        self.target_latency = target_latency
+        self.speed_up_factor = speed_up
+        self.adjustments = 0
+        self._congested_in_block = False
+
+    @classmethod
+    def from_profile(cls, profile, **kwargs):
+        pacer = cls(**kwargs)
+        for field in PACING_FIELDS:
+            if field in profile:
+                setattr(pacer, field, profile[field])
+        return pacer
+
+    def on_write(self, latency, response):
+        # 只有需回應的寫入能反映設備端的處理進度
+        if response and latency > self.target_latency and not self._congested_in_block:
+            self._congested_in_block = True
+            self._slow_down()
+
+    def on_block(self, ok, latency):
+        if not ok or latency > self.target_latency:
+            if not self._congested_in_block:
+                self._slow_down()
+        elif latency < self.target_latency / 2 and not self._congested_in_block:
+            # 只有明顯低於目標時才加速，介於兩者之間維持現狀避免震盪
+            self._speed_up()
+        self._congested_in_block = False
+
+    def on_failure(self):
+        self._slow_down()
+        self._slow_down()
+
+    def _slow_down(self):
+        for field, (low, high, step) in self.DELAY_LIMITS.items():
+            setattr(self, field, min(high, max(getattr(self, field) * 2, step)))
+        self.sync_interval = max(self.SYNC_INTERVAL_LIMITS[0], self.sync_interval // 2)
+        self.adjustments += 1
+        logger.debug(f"🐢 放慢傳輸節奏: {self.as_dict()}")
+
+    def _speed_up(self):
+        for field, (low, high, step) in self.DELAY_LIMITS.items():
+            value = getattr(self, field) * self.speed_up_factor
+            setattr(self, field, low if value < step / 2 else value)
+        self.sync_interval = min(self.SYNC_INTERVAL_LIMITS[1], self.sync_interval + 2)
+        self.adjustments += 1
+        logger.debug(f"🐇 加快傳輸節奏: {self.as_dict()}")
+
+
+class PacingStore:
+    """每台設備學到的節奏參數，存成 JSON 檔"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "pacing.json")
+
+    @staticmethod
+    def _key(address):
+        return re.sub(r"[^0-9A-Za-z]", "", address).upper()
+
+    def _load_all(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, address):
+        return self._load_all().get(self._key(address))
+
+    def save(self, address, pacing):
+        profiles = self._load_all()
+        profiles[self._key(address)] = pacing.as_dict()
+        try:
+            atomic_write(self.path, json.dumps(profiles, indent=2).encode())
+        except OSError as e:
+            logger.warning(f"⚠️ 無法保存節奏參數: {e}")
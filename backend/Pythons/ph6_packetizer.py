@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""PH6 投圖協定封包產生器
+
+依 MTU 計算封包配置並產生初始請求、圖片數據與刷新指令封包，與 BLE 傳輸分離，
+可單獨測試。MTU 為 247 (DEF_MTU) 時產生的位元組串流與廠商算法完全相同
+（可用 --verify 驗證）。
+
+packetize() 在傳輸開始前一次產生所有數據包（含 CRC）到同一塊預先配置的
+緩衝區，傳輸時直接寫出其 memoryview 切片，不再逐包複製與計算 CRC。
+有 numpy 時所有封包的 CRC 以欄為單位同時計算；numpy 與其 CRC 查表陣列在第一次
+需要時才載入（load_numpy），程序尚未載入 numpy 時預設使用純 Python 路徑。
+
+封包格式:
+    初始請求: FE EF 09 57 01 <side> <總包數 L> <總包數 H> <CRC>
+    圖片數據: FE EF <長度> 57 02 <包序號 L> <包序號 H> <需確認> <數據...> <CRC>
+    刷新顯示: FE EF 05 57 05 <side> <CRC>
+"""
+import sys
+
+np = None  # 由 load_numpy() 載入；沒有 numpy 時逐包計算 CRC
+_numpy_checked = False
+
+DEF_MTU = 247
+# 長度欄位只有 1 個位元組，封包 (MTU - 3) 不可超過 255
+MAX_MTU = 258
+MIN_MTU = 23
+
+BLOCK_SIZE = 32000
+BLOCK_COUNT = 6
+HEADER_SIZE = 8  # FE EF len 57 02 pkgL pkgH flag
+ATT_OVERHEAD = 3
+
+CRC8_TABLE = [
+    0, 94, 188, 226, 97, 63, 221, 131, 194, 156, 126, 32, 163, 253, 31, 65,
+    157, 195, 33, 127, 252, 162, 64, 30, 95, 1, 227, 189, 62, 96, 130, 220,
+    35, 125, 159, 193, 66, 28, 254, 160, 225, 191, 93, 3, 128, 222, 60, 98,
+    190, 224, 2, 92, 223, 129, 99, 61, 124, 34, 192, 158, 29, 67, 161, 255,
+    70, 24, 250, 164, 39, 121, 155, 197, 132, 218, 56, 102, 229, 187, 89, 7,
+    219, 133, 103, 57, 186, 228, 6, 88, 25, 71, 165, 251, 120, 38, 196, 154,
+    101, 59, 217, 135, 4, 90, 184, 230, 167, 249, 27, 69, 198, 152, 122, 36,
+    248, 166, 68, 26, 153, 199, 37, 123, 58, 100, 134, 216, 91, 5, 231, 185,
+    140, 210, 48, 110, 237, 179, 81, 15, 78, 16, 242, 172, 47, 113, 147, 205,
+    17, 79, 173, 243, 112, 46, 204, 146, 211, 141, 111, 49, 178, 236, 14, 80,
+    175, 241, 19, 77, 206, 144, 114, 44, 109, 51, 209, 143, 12, 82, 176, 238,
+    50, 108, 142, 208, 83, 13, 239, 177, 240, 174, 76, 18, 145, 207, 45, 115,
+    202, 148, 118, 40, 171, 245, 23, 73, 8, 86, 180, 234, 105, 55, 213, 139,
+    87, 9, 235, 181, 54, 104, 138, 212, 149, 203, 41, 119, 244, 170, 72, 22,
+    233, 183, 85, 11, 136, 214, 52, 106, 43, 117, 151, 201, 74, 20, 246, 168,
+    116, 42, 200, 150, 21, 75, 169, 247, 182, 232, 10, 84, 215, 137, 107, 53
+]
+
+
+_CRC8_TABLE_NP = None
+
+
+def load_numpy():
+    """第一次呼叫時載入 numpy 並建立 CRC 查表陣列；沒有 numpy 時回傳 None"""
+    global np, _numpy_checked, _CRC8_TABLE_NP
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            _CRC8_TABLE_NP = numpy.array(CRC8_TABLE, dtype=numpy.uint8)
+        np = numpy
+        # 載入完成後才標記，其他執行緒同時呼叫時不會看到尚未設定的 np
+        _numpy_checked = True
+    return np
+
+
+def crc8(data, table=CRC8_TABLE):
+    """data 為 bytes / bytearray / memoryview 時逐位元組即為 0-255 的整數"""
+    crc = 0
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+
+def crc8_rows(rows):
+    """同時計算多列的 CRC8：rows 為 (..., N) uint8 陣列，回傳每列的 CRC"""
+    load_numpy()
+    # 轉置成每個位元組位置一列，逐欄運算時讀取連續記憶體
+    columns = np.ascontiguousarray(np.moveaxis(rows, -1, 0))
+    crc = np.zeros(rows.shape[:-1], dtype=np.uint8)
+    for column in columns:
+        np.bitwise_xor(crc, column, out=crc)
+        crc = _CRC8_TABLE_NP.take(crc)
+    return crc
+
+
+def negotiated_mtu(client, default=DEF_MTU):
+    """讀取 BleakClient 協商後的 MTU
+
+    只在協商值大於 DEF_MTU 時採用（上限 MAX_MTU）：部分平台在協商完成前回報 23，
+    而 247 是目前已知設備可正常運作的封包大小。
+    """
+    mtu = getattr(client, "mtu_size", None)
+    if not isinstance(mtu, int) or mtu <= default:
+        return default
+    return min(mtu, MAX_MTU)
+
+
+class Ph6Packetizer:
+    def __init__(self, mtu=DEF_MTU):
+        if not MIN_MTU <= mtu <= MAX_MTU:
+            raise ValueError(f"MTU 必須介於 {MIN_MTU} 與 {MAX_MTU} 之間，實際為 {mtu}")
+        self.mtu = mtu
+        self.packet_size = mtu - ATT_OVERHEAD
+        self.chunk_size = self.packet_size - HEADER_SIZE - 1
+        self.packets_per_block = -(-BLOCK_SIZE // self.chunk_size)
+        self.total_packets = self.packets_per_block * BLOCK_COUNT
+        # 區塊最後一包的數據長度
+        self.last_chunk_size = BLOCK_SIZE - (self.packets_per_block - 1) * self.chunk_size
+
+    def request_packet(self, side):
+        packet = bytearray([0xFE, 0xEF, 0x09, 0x57, 0x01, side, 0xFF, 0xFF, 0xFF])
+        packet[6] = self.total_packets & 0xFF
+        packet[7] = (self.total_packets >> 8) & 0xFF
+        packet[8] = crc8(packet[:8])
+        return bytes(packet)
+
+    def refresh_packet(self, side):
+        packet = bytearray([0xFE, 0xEF, 0x05, 0x57, 0x05, side, 0xFF])
+        packet[6] = crc8(packet[:6])
+        return bytes(packet)
+
+    def packetize(self, frame, blocks=None, use_numpy=None):
+        """一次產生指定區塊 (預設 1-6) 的所有數據包
+
+        回傳 {區塊編號: [memoryview, ...]}，所有封包共用同一塊緩衝區，
+        每包佔 packet_size 位元組（最後一包較短，切片只涵蓋實際長度）。
+        """
+        blocks = list(range(1, BLOCK_COUNT + 1) if blocks is None else blocks)
+        if not isinstance(frame, (bytes, bytearray, memoryview)):
+            frame = bytes(frame)
+        if len(frame) != BLOCK_SIZE * BLOCK_COUNT:
+            raise ValueError(f"畫面長度必須為 {BLOCK_SIZE * BLOCK_COUNT}，實際為 {len(frame)}")
+        if use_numpy is None:
+            # 只在程序已載入 numpy（例如剛轉換過圖片）時使用：畫面快取命中的單次投圖
+            # 匯入 numpy 的時間遠多於純 Python 路徑多花的幾毫秒
+            use_numpy = "numpy" in sys.modules and load_numpy() is not None
+
+        if use_numpy:
+            load_numpy()
+            buffer = self._fill_numpy(frame, blocks)
+        else:
+            buffer = self._fill_python(frame, blocks)
+
+        view = memoryview(buffer)
+        ppb = self.packets_per_block
+        packets = {}
+        for i, block in enumerate(blocks):
+            base = i * ppb * self.packet_size
+            block_views = [view[base + n * self.packet_size: base + (n + 1) * self.packet_size] for n in range(ppb - 1)]
+            last = base + (ppb - 1) * self.packet_size
+            block_views.append(view[last: last + self.last_chunk_size + HEADER_SIZE + 1])
+            packets[block] = block_views
+        return packets
+
+    def block_packets(self, frame, block):
+        """產生第 block 個區塊 (1-6) 的所有數據包，最後一包需要確認"""
+        return self.packetize(frame, [block])[block]
+
+    def _header_fields(self, block, n):
+        sequence = (block - 1) * self.packets_per_block + n
+        is_last = n == self.packets_per_block - 1
+        size = (self.last_chunk_size if is_last else self.chunk_size) + HEADER_SIZE + 1
+        return size, sequence, 0x01 if is_last else 0x00
+
+    def _fill_python(self, frame, blocks):
+        ppb = self.packets_per_block
+        buffer = bytearray(len(blocks) * ppb * self.packet_size)
+        view = memoryview(buffer)
+        source = memoryview(frame)
+        offset = 0
+        for block in blocks:
+            start = (block - 1) * BLOCK_SIZE
+            for n in range(ppb):
+                size, sequence, flag = self._header_fields(block, n)
+                data_start = start + n * self.chunk_size
+                buffer[offset:offset + HEADER_SIZE] = bytes(
+                    (0xFE, 0xEF, size, 0x57, 0x02, sequence & 0xFF, (sequence >> 8) & 0xFF, flag)
+                )
+                buffer[offset + HEADER_SIZE:offset + size - 1] = source[data_start:data_start + size - HEADER_SIZE - 1]
+                buffer[offset + size - 1] = crc8(view[offset:offset + size - 1])
+                offset += self.packet_size
+        return buffer
+
+    def _fill_numpy(self, frame, blocks):
+        ppb = self.packets_per_block
+        chunk = self.chunk_size
+        last_chunk = self.last_chunk_size
+        source = np.frombuffer(frame, dtype=np.uint8)
+        rows = np.zeros((len(blocks), ppb, self.packet_size), dtype=np.uint8)
+
+        for i, block in enumerate(blocks):
+            data = source[(block - 1) * BLOCK_SIZE: block * BLOCK_SIZE]
+            rows[i, :-1, HEADER_SIZE:HEADER_SIZE + chunk] = data[:(ppb - 1) * chunk].reshape(ppb - 1, chunk)
+            rows[i, -1, HEADER_SIZE:HEADER_SIZE + last_chunk] = data[(ppb - 1) * chunk:]
+            sequence = np.arange((block - 1) * ppb, block * ppb)
+            rows[i, :, 5] = sequence & 0xFF
+            rows[i, :, 6] = sequence >> 8
+
+        rows[..., 0] = 0xFE
+        rows[..., 1] = 0xEF
+        rows[..., 2] = self.packet_size
+        rows[..., 3] = 0x57
+        rows[..., 4] = 0x02
+        rows[:, -1, 2] = last_chunk + HEADER_SIZE + 1
+        rows[:, -1, 7] = 0x01
+
+        # 一般封包與各區塊最後一包長度不同，分兩組計算 CRC
+        rows[:, :-1, self.packet_size - 1] = crc8_rows(rows[:, :-1, :self.packet_size - 1])
+        rows[:, -1, last_chunk + HEADER_SIZE] = crc8_rows(rows[:, -1, :last_chunk + HEADER_SIZE])
+        return rows.reshape(-1)
+
+
+def _vendor_packet_stream(frame, side):
+    """廠商原始算法（DEF_MTU = 247）產生的位元組串流，作為驗證基準"""
+    buf = list(frame)
+    stream = []
+    total_pkg_in_block = (32000 // (DEF_MTU - 9 - 3)) + 1
+    total_pkg = total_pkg_in_block * 6
+
+    data_request = bytearray([0xFE, 0xEF, 0x09, 0x57, 0x01, side, 0xFF, 0xFF, 0xFF])
+    data_request[6] = total_pkg & 0xFF
+    data_request[7] = (total_pkg >> 8) & 0xFF
+    data_request[8] = crc8(data_request[:8])
+    stream.append(bytes(data_request))
+
+    pkg = bytearray(DEF_MTU - 3)
+    pkg[0], pkg[1], pkg[3], pkg[4] = 0xFE, 0xEF, 0x57, 0x02
+    index = 0
+    current = 0
+    for _ in range(6):
+        for n in range(total_pkg_in_block):
+            if n == total_pkg_in_block - 1:
+                size = 32000 - (n * (DEF_MTU - 9 - 3)) + 9
+                pkg[2], pkg[5], pkg[6], pkg[7] = size, current & 0xFF, (current >> 8) & 0xFF, 0x01
+                pkg[8:8 + (size - 9)] = buf[index:index + (size - 9)]
+                pkg[size - 1] = crc8(pkg[:size - 1])
+                stream.append(bytes(pkg[:size]))
+                index += size - 9
+            else:
+                chunk = DEF_MTU - 3 - 9
+                pkg[2], pkg[5], pkg[6], pkg[7] = DEF_MTU - 3, current & 0xFF, (current >> 8) & 0xFF, 0x00
+                pkg[8:8 + chunk] = buf[index:index + chunk]
+                pkg[DEF_MTU - 3 - 1] = crc8(pkg[:DEF_MTU - 3 - 1])
+                stream.append(bytes(pkg))
+                index += chunk
+            current += 1
+
+    refresh = bytearray([0xFE, 0xEF, 0x05, 0x57, 0x05, side, 0xFF])
+    refresh[6] = crc8(refresh[:6])
+    stream.append(bytes(refresh))
+    return stream
+
+
+def verify(samples=3):
+    import random
+
+    rng = random.Random(20250611)
+    packetizer = Ph6Packetizer(DEF_MTU)
+    modes = [False, True] if load_numpy() is not None else [False]
+    all_passed = True
+    for n in range(samples):
+        frame = bytes(rng.getrandbits(8) for _ in range(BLOCK_SIZE * BLOCK_COUNT))
+        for side in (1, 2):
+            expected = _vendor_packet_stream(frame, side)
+            for use_numpy in modes:
+                packets = packetizer.packetize(frame, use_numpy=use_numpy)
+                stream = [packetizer.request_packet(side)]
+                for block in range(1, BLOCK_COUNT + 1):
+                    stream.extend(bytes(p) for p in packets[block])
+                stream.append(packetizer.refresh_packet(side))
+                passed = stream == expected
+                all_passed = all_passed and passed
+                engine = "numpy" if use_numpy else "python"
+                print(f"{'✅' if passed else '❌'} 樣本 {n + 1} side={side} ({engine}): {len(stream)} 包")
+
+    # 其他 MTU：兩種實作結果一致，且每包長度與 CRC 正確
+    frame = bytes(rng.getrandbits(8) for _ in range(BLOCK_SIZE * BLOCK_COUNT))
+    for mtu in (MIN_MTU, 185, DEF_MTU, MAX_MTU):
+        p = Ph6Packetizer(mtu)
+        results = [p.packetize(frame, use_numpy=m) for m in modes]
+        packets = [bytes(pkt) for block in range(1, BLOCK_COUNT + 1) for pkt in results[0][block]]
+        passed = all(
+            [bytes(pkt) for block in range(1, BLOCK_COUNT + 1) for pkt in r[block]] == packets for r in results
+        )
+        passed = passed and all(pkt[2] == len(pkt) and crc8(pkt[:-1]) == pkt[-1] for pkt in packets)
+        passed = passed and b"".join(pkt[HEADER_SIZE:-1] for pkt in packets) == frame
+        all_passed = all_passed and passed
+        print(f"{'✅' if passed else '❌'} MTU {mtu}: 每包數據 {p.chunk_size} bytes, 每塊 {p.packets_per_block} 包, 總共 {p.total_packets} 包")
+    return all_passed
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "--verify":
+        print("使用方法: python3 ph6_packetizer.py --verify")
+        sys.exit(1)
+    sys.exit(0 if verify() else 1)
+
+
+if __name__ == "__main__":
+    main()
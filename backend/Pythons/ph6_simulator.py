@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""PH6 桌牌的模擬 BleakClient
+
+提供與 BleakClient 相同的非同步介面（async with、write_gatt_char、
+start_notify 等），記錄所有寫入的封包，讓投圖流程可以在沒有實體設備的
+情況下執行與量測。收到初始請求、區塊最後一包與刷新指令時會在
+ACK_CHAR_UUID 上回送通知（格式 FE EF 07 57 <指令> <旗標> <CRC>）。
+
+可選擇模擬設備接收緩衝區：設備以 drain_rate 包/秒處理資料，不需回應的封包在
+緩衝區已滿 (buffer_size) 時會被丟棄，需回應的寫入則要等緩衝區處理完才返回；
+drop_rate 為隨機丟包機率。區塊內有丟包時，區塊 ACK 旗標為 0x00。
+mtu_size 模擬連線協商後的 MTU（與 BleakClient.mtu_size 相同）。
+has_ph6_service=False 時 services 不含 PH6 服務，用來模擬名稱相符但不是桌牌的設備。
+
+EmulatedPh6Client 進一步模擬完整投圖協定：Ph6DeviceEmulator 解析每個
+FE EF 封包（0x57 0x01 請求、0x02 數據包、0x05 刷新）、以 CRC8_TABLE 驗證 CRC
+與長度、依包序號把資料放回 192000 位元組畫面，區塊完整才回 ACK，刷新後
+保存每一面目前顯示的畫面；連線另外模擬鏈路頻寬與需回應寫入的往返延遲。
+設備狀態獨立於連線，重新連線或差異上傳時保留上一次的顯示內容；每一面的接收
+緩衝區也跨連線保留，請求回應旗標 0x01 表示緩衝區仍在（可只傳部分區塊），剛開機或
+reset()（模擬斷電）後緩衝區為空白，第一個請求回 0x00。drop_link_after 模擬傳輸中斷線。
+
+使用方法: python3 ph6_simulator.py --verify   # 以模擬設備驗證 BleClientFixed 傳輸的正確性與吞吐量
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from ph6_packetizer import ATT_OVERHEAD, BLOCK_COUNT, BLOCK_SIZE, DEF_MTU, HEADER_SIZE, crc8
+
+SERVICE_UUID = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
+COMMAND_CHAR_UUID = "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"
+ACK_CHAR_UUID = "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"
+
+
+class FakeGattCharacteristic:
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class FakeGattService:
+    def __init__(self, uuid, characteristic_uuids):
+        self.uuid = uuid
+        self.characteristics = [FakeGattCharacteristic(u) for u in characteristic_uuids]
+
+
+class FakeBleakClient:
+    # 所有模擬連線共用的統計，用來確認連線上限是否生效
+    active_connections = 0
+    peak_connections = 0
+
+    def __init__(self, address="SIMULATED", write_latency=0.0, connect_latency=0.0, connect_failure_rate=0.0, refresh_time=0.0, buffer_size=None, drain_rate=None, drop_rate=0.0, mtu_size=DEF_MTU, has_ph6_service=True, **kwargs):
+        self.address = getattr(address, "address", address)
+        self.mtu_size = mtu_size
+        if has_ph6_service:
+            self.services = [FakeGattService(SERVICE_UUID, [COMMAND_CHAR_UUID, ACK_CHAR_UUID])]
+        else:
+            self.services = [FakeGattService("0000180A-0000-1000-8000-00805F9B34FB", [])]
+        self.write_latency = write_latency
+        self.connect_latency = connect_latency
+        self.connect_failure_rate = connect_failure_rate
+        self.refresh_time = refresh_time
+        self.buffer_size = buffer_size
+        self.drain_rate = drain_rate
+        self.drop_rate = drop_rate
+        self.dropped_packets = 0
+        self._buffer_level = 0.0
+        self._last_drain = None
+        self._block_corrupt = False
+        self.is_connected = False
+        self.writes = []  # (uuid, bytes, response)
+        self._notify_callbacks = {}
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def connect(self, **kwargs):
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+        if random.random() < self.connect_failure_rate:
+            raise ConnectionError(f"模擬連線失敗: {self.address}")
+        self.is_connected = True
+        FakeBleakClient.active_connections += 1
+        FakeBleakClient.peak_connections = max(FakeBleakClient.peak_connections, FakeBleakClient.active_connections)
+        return True
+
+    async def disconnect(self):
+        if self.is_connected:
+            FakeBleakClient.active_connections -= 1
+        self.is_connected = False
+        self._notify_callbacks.clear()
+        return True
+
+    async def start_notify(self, char_uuid, callback, **kwargs):
+        if char_uuid in self._notify_callbacks:
+            raise ValueError("Notifications already started")
+        self._notify_callbacks[char_uuid] = callback
+
+    async def stop_notify(self, char_uuid):
+        self._notify_callbacks.pop(char_uuid, None)
+
+    async def write_gatt_char(self, char_uuid, data, response=False):
+        if not self.is_connected:
+            raise RuntimeError("Not connected")
+        if self.write_latency:
+            await asyncio.sleep(self.write_latency)
+        data = bytes(data)
+        is_data_packet = len(data) > 7 and data[3] == 0x57 and data[4] == 0x02
+        if is_data_packet and not await self._accept_into_buffer(response):
+            self.dropped_packets += 1
+            self._block_corrupt = True
+            if data[7] != 0x01:
+                return
+        self.writes.append((char_uuid, data, response))
+
+        if len(data) > 4 and data[3] == 0x57:
+            command = data[4]
+            if command == 0x01:
+                self._notify(0x01)
+            elif command == 0x02 and len(data) > 7 and data[7] == 0x01:
+                self._notify(0x02, 0x00 if self._block_corrupt else 0x01)
+                self._block_corrupt = False
+            elif command == 0x05:
+                asyncio.get_running_loop().call_later(self.refresh_time, self._notify, 0x05)
+
+    async def _accept_into_buffer(self, response):
+        """模擬設備接收緩衝區，回傳封包是否被接收"""
+        if random.random() < self.drop_rate:
+            return False
+        if not self.drain_rate:
+            return True
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self._last_drain is not None:
+            self._buffer_level = max(0.0, self._buffer_level - (now - self._last_drain) * self.drain_rate)
+        self._last_drain = now
+
+        if response:
+            # 需回應的寫入要等設備處理完緩衝區內的資料才會回覆
+            await asyncio.sleep(self._buffer_level / self.drain_rate)
+            self._buffer_level = 0.0
+            self._last_drain = loop.time()
+        elif self.buffer_size and self._buffer_level >= self.buffer_size:
+            return False
+
+        self._buffer_level += 1
+        return True
+
+    def _notify(self, command, flag=0x01):
+        callback = self._notify_callbacks.get(ACK_CHAR_UUID)
+        if callback is None:
+            return
+        ack = bytearray([0xFE, 0xEF, 0x07, 0x57, command, flag, 0x00])
+        ack[6] = crc8(ack[:6])
+        result = callback(ACK_CHAR_UUID, ack)
+        if asyncio.iscoroutine(result):
+            asyncio.ensure_future(result)
+
+    @property
+    def data_packet_count(self):
+        """已寫入的圖片數據包 (0x57 0x02) 數量"""
+        return sum(1 for _, data, _ in self.writes if len(data) > 4 and data[3] == 0x57 and data[4] == 0x02)
+
+
+class Ph6DeviceEmulator:
+    """桌牌端的投圖協定狀態機
+
+    receive() 處理一個寫入的封包並回傳要送出的通知 [(延遲秒數, 指令, 旗標)]。
+    封包格式或 CRC 錯誤、未先送出請求的數據包等協定錯誤只計數並記錄，不回應。
+    每塊包數由請求的總包數決定，每包資料長度由收到的數據包長度推得，
+    並檢查同一次傳輸內所有封包一致。
+    """
+    # 依地址保存的模擬設備，重新連線時沿用同一台設備的畫面與統計
+    registry = {}
+
+    def __init__(self, address="SIMULATED", refresh_time=0.0):
+        self.address = address
+        self.refresh_time = refresh_time
+        self.displays = {}  # side -> 刷新後顯示的畫面 (bytes)
+        self.buffers = {}  # side -> 接收緩衝區 (bytearray)，跨連線保留直到 reset()
+        self.buffer_valid = False  # 開機後尚未收到請求時，緩衝區內容不可信
+        self.session = None
+        self.stats = {
+            "requests": 0,
+            "data_packets": 0,
+            "payload_bytes": 0,
+            "blocks_acked": 0,
+            "blocks_nacked": 0,
+            "refreshes": 0,
+            "incomplete_refreshes": 0,
+            "lost": 0,
+            "crc_errors": 0,
+            "malformed": 0,
+            "protocol_errors": 0,
+        }
+        self.errors = []
+
+    @classmethod
+    def for_address(cls, address, **kwargs):
+        device = cls.registry.get(address)
+        if device is None:
+            device = cls.registry[address] = cls(address, **kwargs)
+        return device
+
+    def reset(self):
+        """模擬設備斷電重開：顯示內容保留（電子紙），接收緩衝區清空、進行中的傳輸遺失"""
+        self.buffers.clear()
+        self.buffer_valid = False
+        self.session = None
+
+    def receive(self, data, accepted=True):
+        if not accepted:
+            # 封包在鏈路或設備緩衝區遺失，設備完全沒有看到
+            self.stats["lost"] += 1
+            return []
+        if len(data) < 7 or data[0] != 0xFE or data[1] != 0xEF or data[3] != 0x57:
+            return self._error("malformed", f"無法辨識的封包: {data[:8].hex()}")
+        if crc8(data[:-1]) != data[-1]:
+            return self._error("crc_errors", f"CRC 錯誤: {data[:8].hex()}... 收到 {data[-1]:02x}，應為 {crc8(data[:-1]):02x}")
+
+        command = data[4]
+        if command == 0x01:
+            return self._request(data)
+        if command == 0x02:
+            return self._data(data)
+        if command == 0x05:
+            return self._refresh(data)
+        return self._error("malformed", f"未知指令 0x{command:02x}")
+
+    def _request(self, data):
+        if len(data) != 9 or data[2] != 9:
+            return self._error("malformed", f"請求長度錯誤: {data.hex()}")
+        side = data[5]
+        total = data[6] | (data[7] << 8)
+        if total == 0 or total % BLOCK_COUNT:
+            return self._error("protocol_errors", f"總包數 {total} 不是 {BLOCK_COUNT} 的倍數")
+
+        self.stats["requests"] += 1
+        retained = self.buffer_valid
+        self.buffer_valid = True
+        # 未重傳的區塊保留緩衝區內容：刷新過的畫面（差異上傳）或中斷傳輸已收到的區塊（續傳）；
+        # 開機或斷電後緩衝區是空白的，只傳部分區塊會顯示空白與新資料混合的畫面
+        buffer = self.buffers.get(side)
+        if buffer is None:
+            buffer = self.buffers[side] = bytearray(BLOCK_SIZE * BLOCK_COUNT)
+        self.session = {
+            "side": side,
+            "frame": buffer,
+            "received": [set() for _ in range(BLOCK_COUNT)],
+            "packets_per_block": total // BLOCK_COUNT,
+            "chunk_size": None,
+        }
+        return [(0.0, 0x01, 0x01 if retained else 0x00)]
+
+    def _data(self, data):
+        if self.session is None:
+            return self._error("protocol_errors", "收到數據包但沒有進行中的請求")
+        if data[2] != len(data):
+            return self._error("malformed", f"長度欄位 {data[2]} 與實際長度 {len(data)} 不符")
+
+        session = self.session
+        ppb = session["packets_per_block"]
+        seq = data[5] | (data[6] << 8)
+        block, index = divmod(seq, ppb)
+        is_last = index == ppb - 1
+        payload = data[HEADER_SIZE:-1]
+        if is_last:
+            # 區塊最後一包補滿 BLOCK_SIZE，由此反推一般封包的資料長度
+            chunk_size, remainder = divmod(BLOCK_SIZE - len(payload), max(1, ppb - 1))
+        else:
+            chunk_size, remainder = len(payload), 0
+        if session["chunk_size"] is None and not remainder:
+            session["chunk_size"] = chunk_size
+        if block >= BLOCK_COUNT or remainder or chunk_size != session["chunk_size"] or data[7] != (0x01 if is_last else 0x00):
+            return self._error("protocol_errors", f"包 {seq} 的長度 {len(data)} 或旗標 {data[7]} 不正確")
+
+        offset = block * BLOCK_SIZE + index * chunk_size
+        self.session["frame"][offset:offset + len(payload)] = payload
+        received = self.session["received"][block]
+        received.add(index)
+        self.stats["data_packets"] += 1
+        self.stats["payload_bytes"] += len(payload)
+
+        if not is_last:
+            return []
+        complete = len(received) == ppb
+        self.stats["blocks_acked" if complete else "blocks_nacked"] += 1
+        return [(0.0, 0x02, 0x01 if complete else 0x00)]
+
+    def _refresh(self, data):
+        if len(data) != 7:
+            return self._error("malformed", f"刷新指令長度錯誤: {data.hex()}")
+        side = data[5]
+        session = self.session
+        if session is not None and session["side"] == side:
+            ppb = session["packets_per_block"]
+            if any(0 < len(received) < ppb for received in session["received"]):
+                # 有區塊只收到一部分：畫面會顯示新舊混合的內容
+                self.stats["incomplete_refreshes"] += 1
+            self.displays[side] = bytes(session["frame"])
+            self.session = None
+        self.stats["refreshes"] += 1
+        return [(self.refresh_time, 0x05, 0x01)]
+
+    def _error(self, kind, message):
+        self.stats[kind] += 1
+        self.errors.append(message)
+        del self.errors[:-20]
+        return []
+
+
+class EmulatedPh6Client(FakeBleakClient):
+    """以 Ph6DeviceEmulator 回應的模擬 BleakClient
+
+    bandwidth 為鏈路頻寬（位元組/秒，含 ATT 標頭；None 表示不限），所有寫入依序
+    佔用鏈路；需回應的寫入另加 response_latency 往返延遲。drop_rate、buffer_size、
+    drain_rate 與 FakeBleakClient 相同，只作用於數據包。
+    寫入超過 mtu_size - 3 位元組時與真實 BLE 堆疊一樣拋出例外。
+    drop_link_after 為 N 時，送出第 N 個數據包後連線中斷（只發生一次）。
+    """
+
+    def __init__(self, address="SIMULATED", bandwidth=None, response_latency=0.0, device=None, drop_link_after=None, **kwargs):
+        super().__init__(address, **kwargs)
+        self.device = device or Ph6DeviceEmulator.for_address(self.address, refresh_time=self.refresh_time)
+        self.bandwidth = bandwidth
+        self.response_latency = response_latency
+        self.drop_link_after = drop_link_after
+        self.link_drops = 0
+        self._data_packets = 0
+        self.bytes_written = 0
+        self._link_free_at = 0.0
+
+    async def write_gatt_char(self, char_uuid, data, response=False):
+        if not self.is_connected:
+            raise RuntimeError("Not connected")
+        data = bytes(data)
+        if len(data) > self.mtu_size - ATT_OVERHEAD:
+            raise ValueError(f"寫入長度 {len(data)} 超過 MTU {self.mtu_size} 可承載的 {self.mtu_size - ATT_OVERHEAD} 位元組")
+        await self._transmit(len(data), response)
+        self.writes.append((char_uuid, data, response))
+        self.bytes_written += len(data)
+        if char_uuid.upper() != COMMAND_CHAR_UUID:
+            return
+
+        accepted = True
+        if len(data) > 4 and data[4] == 0x02:
+            self._data_packets += 1
+            accepted = await self._accept_into_buffer(response)
+            if not accepted:
+                self.dropped_packets += 1
+        loop = asyncio.get_running_loop()
+        for delay, command, flag in self.device.receive(data, accepted):
+            if delay:
+                loop.call_later(delay, self._notify, command, flag)
+            else:
+                self._notify(command, flag)
+
+        if self.drop_link_after is not None and self._data_packets >= self.drop_link_after:
+            self.drop_link_after = None
+            self.link_drops += 1
+            await self.disconnect()
+            raise ConnectionError(f"模擬連線中斷: {self.address}")
+
+    async def _transmit(self, size, response):
+        """依鏈路頻寬排隊傳送，回傳時封包已送達設備"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        wait = self.write_latency
+        if self.bandwidth:
+            self._link_free_at = max(now, self._link_free_at) + (size + ATT_OVERHEAD) / self.bandwidth
+            wait += self._link_free_at - now
+        if response:
+            wait += self.response_latency
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class FakeAdvertisement:
+    def __init__(self, local_name, rssi, service_data=None, manufacturer_data=None):
+        self.local_name = local_name
+        self.rssi = rssi
+        self.service_data = service_data or {}
+        self.manufacturer_data = manufacturer_data or {}
+
+
+class FakeBLEDevice:
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+
+
+class FakeBleakScanner:
+    """模擬 BleakScanner：每台設備依各自的廣播間隔呼叫 detection_callback
+
+    devices 為 (address, name, mac, rssi, interval) 列表；mac 不為 None 時以
+    0x2001 服務數據廣播（與 PH6 相同的位元組順序）。
+    """
+    MAC_SERVICE_UUID = "00002001-0000-1000-8000-00805f9b34fb"
+    DEFAULT_DEVICES = [
+        ("SIMULATED", "PH6-SIM", "AA:BB:CC:DD:EE:01", -55, 0.1),
+    ]
+
+    def __init__(self, detection_callback=None, devices=None, rssi_jitter=4, **kwargs):
+        self.detection_callback = detection_callback
+        self.devices = devices if devices is not None else self.DEFAULT_DEVICES
+        self.rssi_jitter = rssi_jitter
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._advertise(*d)) for d in self.devices]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _advertise(self, address, name, mac, rssi, interval):
+        device = FakeBLEDevice(address, name)
+        service_data = {}
+        if mac:
+            service_data[self.MAC_SERVICE_UUID] = bytes.fromhex(mac.replace(":", ""))[::-1]
+        while True:
+            # 廣播時間點有隨機延遲（與 BLE advDelay 類似）
+            await asyncio.sleep(interval * random.uniform(0.5, 1.0))
+            adv = FakeAdvertisement(name, rssi + random.randint(-self.rssi_jitter, self.rssi_jitter), service_data)
+            if self.detection_callback:
+                self.detection_callback(device, adv)
+
+
+async def _cast_to_emulator(frame, side, flow_control="ack", blocks=None, **client_options):
+    """以 BleClientFixed 對模擬設備投一面，回傳 (是否成功, 耗時, client)"""
+    import cast_image_to_ph6_fixed as cast
+
+    client = EmulatedPh6Client(**client_options)
+    started = time.perf_counter()
+    async with client:
+        ble = cast.BleClientFixed(flow_control=flow_control)
+        ble.ble_connect = True
+        ok = await ble.send_image_to_ph6(client, frame, side, 0, 0, 0, 5, blocks=blocks, sync_delay=0, refresh_wait=0.5)
+    return ok, time.perf_counter() - started, client
+
+
+async def verify_transfers():
+    """各種流量控制、MTU、頻寬與丟包設定下，比對設備重組後顯示的畫面"""
+    rng = random.Random(6)
+    frame = bytes(rng.getrandbits(8) for _ in range(BLOCK_SIZE * BLOCK_COUNT))
+    edited = bytearray(frame)
+    edited[2 * BLOCK_SIZE + 10:2 * BLOCK_SIZE + 4010] = bytes(4000)
+    edited = bytes(edited)
+
+    # (名稱, 畫面, side, 預期成功, cast 參數)；power_loss 表示投圖前設備斷電重開
+    scenarios = [
+        ("vendor", frame, 2, True, {"flow_control": "vendor", "address": "EMU-VENDOR"}),
+        ("ack", frame, 1, True, {"flow_control": "ack", "address": "EMU-ACK"}),
+        ("ack-incremental", edited, 1, True, {"flow_control": "ack", "address": "EMU-ACK", "blocks": [3]}),
+        # 斷電後緩衝區已清空，差異上傳必須改為整面傳送
+        ("ack-incr-reset", frame, 1, True, {"flow_control": "ack", "address": "EMU-ACK", "blocks": [3], "power_loss": True}),
+        ("vendor-incr-reset", edited, 2, True, {"flow_control": "vendor", "address": "EMU-VENDOR", "blocks": [3], "power_loss": True}),
+        ("ack-mtu258", frame, 1, True, {"flow_control": "ack", "address": "EMU-MTU", "mtu_size": 258}),
+        ("ack-link", frame, 2, True, {"flow_control": "ack", "address": "EMU-LINK", "bandwidth": 100_000, "response_latency": 0.0075}),
+        ("ack-loss", frame, 2, False, {"flow_control": "ack", "address": "EMU-LOSS", "drop_rate": 0.02}),
+    ]
+    Ph6DeviceEmulator.registry.clear()
+    results = []
+    for name, data, side, expect_ok, options in scenarios:
+        device = Ph6DeviceEmulator.for_address(options["address"])
+        if options.pop("power_loss", False):
+            device.reset()
+        payload_before = device.stats["payload_bytes"]
+        ok, elapsed, client = await _cast_to_emulator(data, side, **options)
+        displayed = device.displays.get(side) == data
+        protocol_errors = device.stats["crc_errors"] + device.stats["malformed"] + device.stats["protocol_errors"]
+        passed = ok == expect_ok and displayed == expect_ok and protocol_errors == 0
+        results.append({
+            "scenario": name,
+            "passed": passed,
+            "success": ok,
+            "frame_matches": displayed,
+            "seconds": round(elapsed, 3),
+            "payload_kib_per_s": round((device.stats["payload_bytes"] - payload_before) / 1024 / elapsed, 1),
+            "device": dict(device.stats),
+            "errors": device.errors[-3:],
+        })
+    results.extend(await verify_resume(frame))
+    return results
+
+
+async def verify_resume(frame):
+    """第 4 個區塊傳到一半時斷線：設備保留緩衝區時只補傳未確認的區塊，斷電重開時整面重傳"""
+    import cast_image_to_ph6_fixed as cast
+    from ph6_metrics import CastMetrics
+
+    dropped_at = 3 * 137 + 50  # MTU 247 時每區塊 137 包
+    # (名稱, 地址, 重新連線前是否模擬斷電, 預期數據包數, 預期計數)
+    scenarios = [
+        ("ack-resume", "EMU-RESUME", False, dropped_at + 3 * 137, {"reconnects": 1, "resumed_blocks": 3}),
+        ("ack-resume-reset", "EMU-RESET", True, dropped_at + 6 * 137, {"reconnects": 1, "buffer_restarts": 1}),
+    ]
+    results = []
+    for name, address, power_loss, expected_packets, expected_counters in scenarios:
+        device = Ph6DeviceEmulator.for_address(address)
+        clients = []
+
+        def client_factory(_address):
+            if clients and power_loss:
+                device.reset()
+            clients.append(EmulatedPh6Client(address, drop_link_after=None if clients else dropped_at))
+            return clients[-1]
+
+        metrics = CastMetrics()
+        started = time.perf_counter()
+        try:
+            ok = await cast.cast_frame_to_device(frame, 1, address, client_factory, 0, 0, 0, 5, sync_delay=0, refresh_wait=0.5, flow_control="ack", metrics=metrics, resume_window=30)
+        except Exception as e:
+            ok = False
+            device.errors.append(f"投圖例外: {e}")
+        elapsed = time.perf_counter() - started
+        displayed = device.displays.get(1) == frame
+        counters_ok = all(metrics.counters.get(k) == v for k, v in expected_counters.items())
+        protocol_errors = device.stats["crc_errors"] + device.stats["malformed"] + device.stats["protocol_errors"]
+        results.append({
+            "scenario": name,
+            "passed": ok and displayed and counters_ok and device.stats["data_packets"] == expected_packets and protocol_errors == 0,
+            "success": ok,
+            "frame_matches": displayed,
+            "seconds": round(elapsed, 3),
+            "payload_kib_per_s": round(device.stats["payload_bytes"] / 1024 / elapsed, 1),
+            "data_packets": device.stats["data_packets"],
+            "expected_packets": expected_packets,
+            "counters": dict(metrics.counters),
+            "device": dict(device.stats),
+            "errors": device.errors[-3:],
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(usage="python3 ph6_simulator.py --verify")
+    parser.add_argument("--verify", action="store_true", help="以模擬設備驗證投圖協定與畫面重組")
+    args = parser.parse_args()
+    if not args.verify:
+        parser.print_usage()
+        sys.exit(1)
+
+    import contextlib
+    import logging
+
+    logging.getLogger("cast_image_to_ph6_fixed").setLevel(logging.WARNING)
+    # PROGRESS 行改寫到 stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(verify_transfers())
+    for r in results:
+        print(f"{'✅' if r['passed'] else '❌'} {r['scenario']:>16}: 成功={r['success']} 畫面一致={r['frame_matches']} "
+              f"{r['seconds']:.3f}s {r['payload_kib_per_s']} KiB/s 遺失={r['device']['lost']}")
+    print(json.dumps(results, ensure_ascii=False, indent=2), file=sys.stderr)
+    sys.exit(0 if all(r["passed"] for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()